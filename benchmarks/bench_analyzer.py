@@ -0,0 +1,70 @@
+"""Analyzer time for N distinct IPs: Python sets and per-row inserts versus the scoring INSERT ... SELECT.
+
+Run from the repository root: python -m benchmarks.bench_analyzer [ips]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from classes.analyzer import Analyzer
+from classes.storage import get_storage
+
+TABLES = {"auth_db": "failed_logins", "ids_ips_db": "ids_ips_alerts", "ufw_db": "ufw_alerts"}
+
+def populate(folder, n):
+    paths = {}
+    for i, (key, table) in enumerate(TABLES.items()):
+        path = os.path.join(folder, f"{key}.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute(f"CREATE TABLE {table} (ip TEXT PRIMARY KEY, count INTEGER, status TEXT, last_updated REAL)")
+            # Every source sees two thirds of the addresses, so overlaps produce both classes
+            conn.executemany(
+                f"INSERT INTO {table} (ip, count, status, last_updated) VALUES (?, ?, ?, 1)",
+                ((f"10.{j >> 16 & 255}.{j >> 8 & 255}.{j & 255}", j % 50 + 1, "attack" if j % 50 > 40 else "normal")
+                 for j in range(n) if j % 3 != i)
+            )
+        paths[key] = path
+    return paths
+
+def python_loop(paths, analysis_path):
+    # The previous Analyzer.analyze: load every IP into sets, then one INSERT OR REPLACE per IP
+    sets = []
+    for key, table in TABLES.items():
+        with sqlite3.connect(paths[key]) as conn:
+            sets.append(set(row[0] for row in conn.execute(f"SELECT ip FROM {table}")))
+    auth_ips, ids_ips_ips, ufw_ips = sets
+    with sqlite3.connect(analysis_path) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS threat_summary (
+                ip TEXT PRIMARY KEY, auth_flag INTEGER, ids_ips_flag INTEGER, ufw_flag INTEGER, classification TEXT
+            )
+        """)
+        for ip in auth_ips | ids_ips_ips | ufw_ips:
+            a, s, u = int(ip in auth_ips), int(ip in ids_ips_ips), int(ip in ufw_ips)
+            conn.execute(
+                "INSERT OR REPLACE INTO threat_summary VALUES (?, ?, ?, ?, ?)",
+                (ip, a, s, u, "attack" if a + s + u >= 2 else "suspicious")
+            )
+        conn.commit()
+
+def scored(paths, analysis_path):
+    Analyzer(dict(paths, db_path=analysis_path)).analyze()
+
+def measure(name, fn, n):
+    with tempfile.TemporaryDirectory() as folder:
+        paths = populate(folder, n)
+        analysis_path = os.path.join(folder, "threats.db")
+        start = time.perf_counter()
+        fn(paths, analysis_path)
+        elapsed = time.perf_counter() - start
+        with sqlite3.connect(analysis_path) as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM threat_summary").fetchone()[0]
+        get_storage().close()
+    print(f"{name:<26} {rows:>9} IPs  {elapsed:>8.2f} s")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    measure("python loop", python_loop, n)
+    measure("scored INSERT ... SELECT", scored, n)
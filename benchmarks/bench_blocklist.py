@@ -0,0 +1,69 @@
+"""Defense's blocklist lookups: SQLite queries per run versus the in-memory BlocklistIndex.
+
+defense.db is filled with N historical blocks; each run checks a wave of attack IPs, half of
+them already blocked.
+
+Run from the repository root: python -m benchmarks.bench_blocklist [blocked] [--wave N]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from classes.defense import Defense
+from classes.storage import get_storage
+
+def address(i):
+    if i % 10 == 0:
+        return f"2001:db8:{i >> 16 & 0xffff:x}::{i & 0xffff:x}"
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+def populate(path, n):
+    defense = Defense({"db_path": path, "analysis_db": path, "blocklist_index": {"enabled": False}})
+    get_storage().flush()
+    with sqlite3.connect(path) as conn:
+        conn.executemany("INSERT INTO blocked_ips (ip, status) VALUES (?, ?)",
+                         ((address(i), "covered" if i % 7 == 0 else "blocked") for i in range(n)))
+    return defense
+
+def run(name, defense, wave):
+    start = time.perf_counter()
+    defense.sync_blocklist()
+    blocked = defense.get_blocked_ips(wave)
+    print(f"{name:<22} {time.perf_counter() - start:>8.4f} s")
+    return blocked
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("blocked", nargs="?", type=int, default=300000)
+    parser.add_argument("--wave", type=int, default=10000, help="attack IPs checked per run")
+    args = parser.parse_args()
+
+    # Half of the wave is already blocked, half is new
+    wave = [address(i) for i in range(0, 2 * args.wave, 2)]
+    wave = [ip for ip in wave[:args.wave // 2]] + [address(args.blocked + i) for i in range(args.wave // 2)]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "defense.db")
+        sql = populate(path, args.blocked)
+        expected = run("SQLite per run", sql, wave)
+
+        indexed = Defense({"db_path": path, "analysis_db": path})
+        assert run("index, first load", indexed, wave) == expected, "index disagrees with defense.db"
+        run("index, next run", indexed, wave)
+
+        # A later run: one wave recorded, then the delta sync and the lookups again
+        indexed.record_blocked_ips([(ip, "blocked") for ip in wave])
+        assert run("index, after delta", indexed, wave) == set(wave)
+
+        # Memory is measured apart from the timings, which tracemalloc would distort
+        tracemalloc.start()
+        Defense({"db_path": path, "analysis_db": path}).sync_blocklist()
+        print(f"{'index memory':<22} {tracemalloc.get_traced_memory()[0] / 2 ** 20:>8.1f} MiB")
+        tracemalloc.stop()
+        tracemalloc.start()
+        strings = set(row[0] for row in sqlite3.connect(path).execute("SELECT ip FROM blocked_ips"))
+        print(f"{'set of str':<22} {tracemalloc.get_traced_memory()[0] / 2 ** 20:>8.1f} MiB for {len(strings)} addresses")
+        tracemalloc.stop()
+        get_storage().close()
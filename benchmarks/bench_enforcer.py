@@ -0,0 +1,47 @@
+"""Time to block N addresses with each enforcement backend, against fake ufw/ipset/iptables/nft binaries.
+
+The fakes only consume their arguments and stdin, so this measures process spawning and
+batch construction, not the kernel. Run from the repository root:
+python -m benchmarks.bench_enforcer [addresses]
+"""
+import os
+import stat
+import sys
+import tempfile
+import time
+
+from classes.enforcer import IpsetBackend, NftBackend, UfwBackend
+
+FAKE = "#!/bin/sh\nexit 0\n"
+FAKE_READS_STDIN = "#!/bin/sh\ncat > /dev/null\nexit 0\n"
+
+class QuietLogger:
+    def info(self, message):
+        pass
+
+    def error(self, message):
+        print(message, file=sys.stderr)
+
+def install_fakes(folder):
+    for tool in ("ufw", "ipset", "iptables", "ip6tables", "nft"):
+        path = os.path.join(folder, tool)
+        with open(path, "w") as f:
+            f.write(FAKE_READS_STDIN if tool in ("ipset", "nft") else FAKE)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+    os.environ["PATH"] = folder + os.pathsep + os.environ["PATH"]
+
+def measure(backend, addresses):
+    backend.ensure()
+    start = time.perf_counter()
+    blocked, failed = backend.block(addresses)
+    elapsed = time.perf_counter() - start
+    print(f"{backend.name:<6} {len(blocked):>7} blocked  {len(failed):>5} failed  {elapsed:>8.3f} s")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    addresses = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n)]
+    with tempfile.TemporaryDirectory() as folder:
+        install_fakes(folder)
+        logger = QuietLogger()
+        for backend in (NftBackend({}, logger), IpsetBackend({}, logger), UfwBackend({}, logger)):
+            measure(backend, addresses)
@@ -0,0 +1,97 @@
+"""The lookup service: per-lookup cost in process, then requests per second over localhost HTTP.
+
+threats.db holds N scored IPs, a third of them attacks, and defense.db blocks a tenth of
+them. Lookups draw from a hot set that fits the cache and a cold tail that does not.
+
+Run from the repository root: python -m benchmarks.bench_lookup [threats] [--clients N] [--requests N]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+
+from classes.lookup import LookupService
+from classes.storage import get_storage
+
+def address(i):
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+def populate(threats, defense, n):
+    with sqlite3.connect(threats) as conn:
+        conn.execute("CREATE TABLE threat_summary (ip TEXT PRIMARY KEY, classification TEXT, score REAL)")
+        conn.executemany("INSERT INTO threat_summary VALUES (?, ?, ?)",
+                         ((address(i), ("attack", "suspicious", "normal")[i % 3], i % 7) for i in range(n)))
+    with sqlite3.connect(defense) as conn:
+        conn.execute("CREATE TABLE blocked_ips (ip TEXT PRIMARY KEY, status TEXT)")
+        conn.execute("CREATE TABLE blocked_prefixes (prefix TEXT PRIMARY KEY, status TEXT)")
+        conn.executemany("INSERT INTO blocked_ips VALUES (?, 'blocked')", ((address(i),) for i in range(0, n, 10)))
+
+def in_process(name, service, ips):
+    start = time.perf_counter()
+    for ip in ips:
+        service.lookup(ip)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {elapsed / len(ips) * 1e6:>8.2f} us/lookup")
+
+def over_http(name, port, clients, requests, make_request, per_request=1):
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        for _ in range(requests):
+            method, path, body = make_request(rng)
+            conn.request(method, path, body=body)
+            conn.getresponse().read()
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {clients * requests * per_request / elapsed:>8.0f} lookups/s with {clients} client(s)")
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("threats", nargs="?", type=int, default=1000000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="requests per client")
+    parser.add_argument("--batch", type=int, default=100, help="addresses per batch request")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    hot = [address(rng.randrange(args.threats)) for _ in range(1000)]
+    sample = lambda rng: rng.choice(hot) if rng.random() < 0.9 else address(rng.randrange(2 * args.threats))
+    with tempfile.TemporaryDirectory() as folder:
+        threats, defense = os.path.join(folder, "threats.db"), os.path.join(folder, "defense.db")
+        populate(threats, defense, args.threats)
+        port = free_port()
+        service = LookupService({"threats_db": threats, "defense_db": defense, "port": port, "cache_size": 10000})
+        start = time.perf_counter()
+        service.start()
+        print(f"{'index load':<22} {time.perf_counter() - start:>8.2f} s")
+
+        cold = [address(rng.randrange(2 * args.threats)) for _ in range(100000)]
+        service.cache.size = 0
+        in_process("index only", service, cold)
+        service.cache.size = 10000
+        in_process("cache, 90% hot", service, [sample(rng) for _ in range(100000)])
+
+        over_http("GET /lookup", port, args.clients, args.requests,
+                  lambda rng: ("GET", f"/lookup?ip={sample(rng)}", None))
+        over_http(f"POST /lookup x{args.batch}", port, args.clients, args.requests // 10,
+                  lambda rng: ("POST", "/lookup", json.dumps([sample(rng) for _ in range(args.batch)])), args.batch)
+        service.stop()
+        get_storage().close()
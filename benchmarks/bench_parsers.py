@@ -0,0 +1,113 @@
+"""Parser throughput, peak RSS and upsert rate for every log format, reported as JSON.
+
+Each case runs in its own interpreter so peak RSS belongs to that parser alone. The report
+goes to stdout, or to --output, for comparison across releases.
+
+Run from the repository root: python -m benchmarks.bench_parsers [lines] [--ips N] [--output FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.generators import write_log
+
+CASES = {
+    # name: (log format, module, class, parse method, extra config)
+    "auth": ("sshd", "classes.Auth", "Auth", "get_failed_login_counts", {}),
+    "ufw": ("ufw", "classes.ufw", "UFW", "parse_logs", {}),
+    "snort": ("snort", "classes.ids_ips", "IDS_IPS", "parse_snort_alerts", {"type": "snort"}),
+    "suricata": ("eve", "classes.ids_ips", "IDS_IPS", "parse_suricata_alerts", {"type": "suricata"}),
+}
+
+def peak_rss_mib():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+def run_case(name, lines, ips):
+    from importlib import import_module
+    from classes.storage import get_storage
+
+    log_format, module, class_name, method, extra = CASES[name]
+    cls = getattr(import_module(module), class_name)
+    with tempfile.TemporaryDirectory() as folder:
+        log_path = os.path.join(folder, f"{name}.log")
+        size = write_log(log_path, log_format, lines, ips)
+        rss_before = peak_rss_mib()
+
+        parser = cls(dict(extra, log_path=log_path, threshold=5, db_path=os.path.join(folder, "parse.db")))
+        start = time.perf_counter()
+        result = getattr(parser, method)()
+        parse_seconds = time.perf_counter() - start
+        counts = result[0] if isinstance(result, tuple) else result
+        args = result if isinstance(result, tuple) else (result,)
+
+        start = time.perf_counter()
+        get_storage().run(parser.db_path, lambda conn: parser._upsert(conn, *args, parser.tailer))
+        upsert_seconds = time.perf_counter() - start
+
+        # End to end on a fresh database: parse, upsert and checkpoint in one call
+        store = cls(dict(extra, log_path=log_path, threshold=5, db_path=os.path.join(folder, "store.db")))
+        start = time.perf_counter()
+        store.store_to_db()
+        store_seconds = time.perf_counter() - start
+        get_storage().close()
+
+    return {
+        "case": name,
+        "format": log_format,
+        "lines": lines,
+        "bytes": size,
+        "distinct_ips": len(counts),
+        "events": sum(counts.values()),
+        "parse_seconds": round(parse_seconds, 4),
+        "lines_per_sec": round(lines / parse_seconds),
+        "mb_per_sec": round(size / 2 ** 20 / parse_seconds, 2),
+        "upsert_seconds": round(upsert_seconds, 4),
+        "upserts_per_sec": round(len(counts) / upsert_seconds) if upsert_seconds else None,
+        "store_to_db_seconds": round(store_seconds, 4),
+        "rss_before_mib": rss_before,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("lines", nargs="?", type=int, default=200000)
+    parser.add_argument("--ips", type=int, default=5000, help="distinct source addresses per log")
+    parser.add_argument("--case", choices=sorted(CASES), action="append", help="run only these cases")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_case(args.child, args.lines, args.ips), sys.stdout)
+        return
+
+    results = []
+    for name in args.case or CASES:
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_parsers", str(args.lines), "--ips", str(args.ips), "--child", name],
+            capture_output=True, text=True, check=True
+        )
+        results.append(json.loads(child.stdout))
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
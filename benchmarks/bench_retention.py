@@ -0,0 +1,58 @@
+"""Retention on a UFW store of N IPs, half of them past the TTL, and the threat summary they feed.
+
+Prints the time to roll up and delete the expired rows, then the file sizes before and after the
+incremental vacuum that follows.
+
+Run from the repository root: python -m benchmarks.bench_retention [ips]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from classes.analyzer import Analyzer
+from classes.retention import Retention
+from classes.storage import get_storage
+
+def populate(path, n, now):
+    with sqlite3.connect(path) as conn:
+        conn.execute("""
+            CREATE TABLE ufw_alerts (ip TEXT PRIMARY KEY, count INTEGER, proto TEXT, spt TEXT, dpt TEXT, status TEXT,
+                                     last_updated REAL, first_seen REAL)
+        """)
+        conn.execute("CREATE INDEX ufw_alerts_last_updated ON ufw_alerts (last_updated)")
+        # Every other IP was last seen 40 days ago, spread over that day's hours
+        conn.executemany(
+            "INSERT INTO ufw_alerts VALUES (?, ?, 'TCP', '40000', ?, 'normal', ?, ?)",
+            ((f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", i % 20 + 1, str(i % 1024),
+              now - 40 * 86400 - i % 86400 if i % 2 else now, now - 40 * 86400) for i in range(n))
+        )
+
+def megabytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)) / 2 ** 20
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    now = time.time()
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {key: os.path.join(folder, f"{key}.db") for key in ("auth_db", "ids_ips_db", "ufw_db")}
+        populate(paths["ufw_db"], n, now)
+        threats = os.path.join(folder, "threats.db")
+        Analyzer(dict(paths, db_path=threats)).analyze()
+        retention = Retention(dict(paths, threats_db=threats, defense_db=os.path.join(folder, "defense.db"),
+                                   quiet_seconds=0))
+
+        before = {path: megabytes(path) for path in (paths["ufw_db"], threats)}
+        start = time.perf_counter()
+        pruned = retention.prune(now)
+        print(f"{'prune':<12} {time.perf_counter() - start:>8.2f} s  {pruned}")
+        start = time.perf_counter()
+        retention.maintain()
+        print(f"{'maintain':<12} {time.perf_counter() - start:>8.2f} s")
+        for path, size in before.items():
+            print(f"{os.path.basename(path):<12} {size:>8.1f} MiB -> {megabytes(path):.1f} MiB")
+        with sqlite3.connect(paths["ufw_db"]) as conn:
+            buckets = conn.execute("SELECT COUNT(*), SUM(rows), SUM(events) FROM activity_rollup").fetchone()
+        print(f"{'rollup':<12} {buckets[0]} bucket(s) holding {buckets[1]} row(s), {buckets[2]} event(s)")
+        get_storage().close()
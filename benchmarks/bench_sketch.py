@@ -0,0 +1,45 @@
+"""Memory and accuracy of the exact Counter versus the Space-Saving sketch under a spoofed-source flood.
+
+Run from the repository root: python -m benchmarks.bench_sketch [spoofed_ips]
+"""
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from classes.sketch import SpaceSaving
+
+ATTACKERS = 500
+
+def make_events(n):
+    # A few hundred real attackers with 20-2000 hits each, buried in n single-packet spoofed sources
+    rng = random.Random(42)
+    events = [f"10.0.{i >> 8}.{i & 255}" for i in range(ATTACKERS) for _ in range(rng.randint(20, 2000))]
+    events += [f"{rng.randint(11, 223)}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n)]
+    rng.shuffle(events)
+    return events
+
+def measure(name, counter, events):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for ip in events:
+        counter[ip] += 1
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<22} {len(counter):>9} keys  {peak / 2 ** 20:>8.1f} MiB peak  {elapsed:>6.2f} s")
+    return counter
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    events = make_events(n)
+    exact = measure("Counter", Counter(), events)
+    truth = dict(exact.most_common(ATTACKERS))
+    for capacity in (1000, 5000, 20000):
+        sketch = measure(f"SpaceSaving({capacity})", SpaceSaving({"capacity": capacity, "top_k": ATTACKERS}), events)
+        top = sketch.top()
+        recall = len(set(top) & set(truth)) / len(truth)
+        worst = max((exact[ip] - count for ip, count in top.items()), default=0)
+        print(f"{'':<22} top-{ATTACKERS} recall {recall:.1%}, worst undercount {worst}, "
+              f"untracked bound {sketch.min_count()}")
@@ -0,0 +1,70 @@
+"""Warm restart: loading the lookup indexes and rate windows from SQLite versus from a snapshot.
+
+threats.db holds N attack IPs and defense.db blocks N addresses, a tenth of them IPv6; a rate
+window tracks N / 10 keys. Prints the cold load, which starts the window empty, the snapshot
+write and size, then the load from the snapshot with the window's keys back.
+
+Run from the repository root: python -m benchmarks.bench_snapshot [n]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import classes.snapshot as snapshot
+from classes.blocklist import BlocklistIndex
+from classes.logger import Logger
+from classes.lookup import ThreatIndex
+from classes.ratewindow import RateWindow
+from classes.snapshot import Snapshots
+from classes.storage import get_storage
+
+def address(i):
+    if i % 10 == 0:
+        return f"2001:db8:{i >> 16 & 0xffff:x}::{i & 0xffff:x}"
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+def populate(threats, defense, n):
+    with sqlite3.connect(threats) as conn:
+        conn.execute("CREATE TABLE threat_summary (ip TEXT PRIMARY KEY, classification TEXT)")
+        conn.executemany("INSERT INTO threat_summary VALUES (?, 'attack')", ((address(i),) for i in range(n)))
+    with sqlite3.connect(defense) as conn:
+        conn.execute("CREATE TABLE blocked_ips (ip TEXT PRIMARY KEY, status TEXT)")
+        conn.execute("CREATE TABLE blocked_prefixes (prefix TEXT PRIMARY KEY, status TEXT)")
+        conn.executemany("INSERT INTO blocked_ips VALUES (?, 'blocked')", ((address(i),) for i in range(n)))
+
+def start(path, threats, defense, rate_keys):
+    """A fresh process's startup: the snapshot read, the indexes synced and the rate window restored."""
+    snapshot._shared = Snapshots({"enabled": True, "path": path, "interval": 3600})
+    logger, storage = Logger(), get_storage()
+    began = time.perf_counter()
+    indexes = [BlocklistIndex(storage, defense, logger), ThreatIndex(storage, threats, logger)]
+    for index in indexes:
+        index.sync()
+    rate = RateWindow({"events": 10, "max_ips": rate_keys})
+    snapshot._shared.restore("rate:auth", rate.restore)
+    elapsed = time.perf_counter() - began
+    return elapsed, rate, snapshot._shared
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as folder:
+        threats, defense = os.path.join(folder, "threats.db"), os.path.join(folder, "defense.db")
+        path = os.path.join(folder, "state.snap")
+        populate(threats, defense, n)
+
+        elapsed, rate, snapshots = start(path, threats, defense, n // 10)
+        print(f"{'cold start':<16} {elapsed:>8.2f} s  {len(rate)} rate key(s)")
+        # The window the first process built up before it stopped
+        for i in range(n // 10):
+            for t in range(10):
+                rate.add(address(i), 1000.0 + t)
+        snapshots.offer("rate:auth", rate.state)
+        began = time.perf_counter()
+        snapshots.close()
+        print(f"{'snapshot write':<16} {time.perf_counter() - began:>8.2f} s  {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+        elapsed, rate, snapshots = start(path, threats, defense, n // 10)
+        print(f"{'warm start':<16} {elapsed:>8.2f} s  {len(rate)} rate key(s)")
+        get_storage().close()
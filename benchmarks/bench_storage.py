@@ -0,0 +1,73 @@
+"""Rows/sec of the old per-call sqlite3.connect pattern versus the Storage writer.
+
+Run from the repository root: python -m benchmarks.bench_storage [rows]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from classes.storage import Storage
+
+DDL = "CREATE TABLE IF NOT EXISTS blocked_ips (ip TEXT PRIMARY KEY, status TEXT)"
+INSERT = "INSERT OR IGNORE INTO blocked_ips (ip, status) VALUES (?, ?)"
+
+def make_rows(n):
+    return [(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", "blocked") for i in range(n)]
+
+def connect_per_row(path, rows):
+    # What Defense.record_blocked_ip did: one connection and one commit per IP
+    for row in rows:
+        with sqlite3.connect(path) as conn:
+            conn.execute(INSERT, row)
+            conn.commit()
+
+def connection_per_call(path, rows):
+    # What the parsers' store_to_db did: one connection, one execute per row
+    with sqlite3.connect(path) as conn:
+        for row in rows:
+            conn.execute(INSERT, row)
+        conn.commit()
+
+def storage_per_row(path, rows, threads=3):
+    storage = Storage({})
+    storage.execute(path, DDL).result()
+    chunks = [rows[i::threads] for i in range(threads)]
+
+    def writer(chunk):
+        futures = [storage.executemany(path, INSERT, [row]) for row in chunk]
+        for future in futures:
+            future.result()
+
+    workers = [threading.Thread(target=writer, args=(chunk,)) for chunk in chunks]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    storage.close()
+
+def storage_batched(path, rows):
+    storage = Storage({})
+    storage.execute(path, DDL).result()
+    storage.executemany(path, INSERT, rows).result()
+    storage.close()
+
+def measure(name, fn, rows):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "bench.db")
+        with sqlite3.connect(path) as conn:
+            conn.execute(DDL)
+        start = time.perf_counter()
+        fn(path, rows)
+        elapsed = time.perf_counter() - start
+    print(f"{name:<24} {len(rows):>8} rows  {len(rows) / elapsed:>12.0f} rows/sec")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rows = make_rows(n)
+    measure("connect per row", connect_per_row, rows)
+    measure("connection per call", connection_per_call, rows)
+    measure("storage, row per write", storage_per_row, rows)
+    measure("storage, batched", storage_batched, rows)
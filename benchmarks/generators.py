@@ -0,0 +1,108 @@
+"""Deterministic synthetic logs in every format the parsers read.
+
+Each generator yields `n` newline-terminated lines built from random.Random(seed), so a given
+(n, ips, seed) always produces byte-identical output. Roughly `attack_ratio` of the lines are
+events the parsers count; the rest is the surrounding noise a real host writes.
+"""
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+START = datetime(2024, 8, 25, tzinfo=timezone.utc)
+SIGNATURES = (
+    (2001219, "ET SCAN Potential SSH Scan", "Attempted Information Leak", 2),
+    (2010935, "ET SCAN Suspicious inbound to MSSQL port 1433", "Potentially Bad Traffic", 2),
+    (2024897, "ET USER_AGENTS Go HTTP Client User-Agent", "Misc activity", 3),
+    (2013028, "ET POLICY curl User-Agent Outbound", "Attempted Administrator Privilege Gain", 1),
+)
+USERS = ("root", "admin", "test", "ubuntu", "oracle", "postgres", "git", "user")
+PORTS = (22, 23, 80, 443, 445, 1433, 3306, 3389, 5900, 8080)
+
+def _attackers(rng, ips):
+    return [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            for _ in range(ips)]
+
+def _clock(n):
+    # One event every ~50ms starting at START, so timestamps are ordered like a real log
+    for i in range(n):
+        yield START + timedelta(milliseconds=50 * i)
+
+def sshd_lines(n, ips=1000, seed=0, attack_ratio=0.6):
+    """rsyslog high-precision auth.log lines, matching log/auth.log."""
+    rng = random.Random(seed)
+    attackers = _attackers(rng, ips)
+    for i, moment in enumerate(_clock(n)):
+        stamp = moment.isoformat(timespec="microseconds")
+        pid = 100000 + i
+        if rng.random() < attack_ratio:
+            user = rng.choice(USERS)
+            invalid = "invalid user " if rng.random() < 0.5 else ""
+            yield (f"{stamp} benchhost sshd[{pid}]: Failed password for {invalid}{user} "
+                   f"from {rng.choice(attackers)} port {rng.randint(1024, 65535)} ssh2\n")
+        elif rng.random() < 0.5:
+            yield f"{stamp} benchhost CRON[{pid}]: pam_unix(cron:session): session opened for user root(uid=0) by root(uid=0)\n"
+        else:
+            yield (f"{stamp} benchhost sshd[{pid}]: Connection closed by authenticating user root "
+                   f"{rng.choice(attackers)} port {rng.randint(1024, 65535)} [preauth]\n")
+
+def snort_fast_lines(n, ips=1000, seed=0, attack_ratio=1.0):
+    """snort alert_fast lines."""
+    rng = random.Random(seed)
+    attackers = _attackers(rng, ips)
+    for moment in _clock(n):
+        stamp = moment.strftime("%m/%d-%H:%M:%S.%f")
+        if rng.random() >= attack_ratio:
+            yield f"{stamp}  [**] snort restarted [**]\n"
+            continue
+        sid, message, classification, priority = rng.choice(SIGNATURES)
+        proto = rng.choice(("TCP", "UDP"))
+        yield (f"{stamp}  [**] [1:{sid}:3] {message} [**] [Classification: {classification}] "
+               f"[Priority: {priority}] {{{proto}}} {rng.choice(attackers)}:{rng.randint(1024, 65535)} "
+               f"-> 10.0.0.5:{rng.choice(PORTS)}\n")
+
+def eve_lines(n, ips=1000, seed=0, attack_ratio=0.3):
+    """Suricata EVE JSON lines; non-alert events (flow, dns, tls) make up the rest."""
+    rng = random.Random(seed)
+    attackers = _attackers(rng, ips)
+    for i, moment in enumerate(_clock(n)):
+        record = {
+            "timestamp": moment.strftime("%Y-%m-%dT%H:%M:%S.%f+0000"),
+            "flow_id": 1000000000 + i,
+            "in_iface": "eth0",
+            "src_ip": rng.choice(attackers),
+            "src_port": rng.randint(1024, 65535),
+            "dest_ip": "10.0.0.5",
+            "dest_port": rng.choice(PORTS),
+            "proto": rng.choice(("TCP", "UDP")),
+        }
+        if rng.random() < attack_ratio:
+            sid, message, classification, priority = rng.choice(SIGNATURES)
+            record["event_type"] = "alert"
+            record["alert"] = {"action": "allowed", "gid": 1, "signature_id": sid, "rev": 3,
+                               "signature": message, "category": classification, "severity": priority}
+        else:
+            record["event_type"] = rng.choice(("flow", "dns", "tls"))
+            record["flow"] = {"pkts_toserver": rng.randint(1, 20), "bytes_toserver": rng.randint(60, 4000)}
+        yield json.dumps(record, separators=(",", ":")) + "\n"
+
+def ufw_lines(n, ips=1000, seed=0, attack_ratio=0.9):
+    """Kernel [UFW BLOCK] lines as rsyslog writes them to ufw.log."""
+    rng = random.Random(seed)
+    attackers = _attackers(rng, ips)
+    for moment in _clock(n):
+        stamp = moment.isoformat(timespec="microseconds")
+        action = "BLOCK" if rng.random() < attack_ratio else "AUDIT"
+        yield (f"{stamp} benchhost kernel: [UFW {action}] IN=eth0 OUT= "
+               f"MAC=52:54:00:12:34:56:52:54:00:65:43:21:08:00 SRC={rng.choice(attackers)} DST=10.0.0.5 "
+               f"LEN={rng.choice((40, 44, 52, 60))} TOS=0x00 PREC=0x00 TTL={rng.randint(30, 128)} "
+               f"ID={rng.randint(1, 65535)} PROTO=TCP SPT={rng.randint(1024, 65535)} "
+               f"DPT={rng.choice(PORTS)} WINDOW=1024 RES=0x00 SYN URGP=0\n")
+
+GENERATORS = {"sshd": sshd_lines, "snort": snort_fast_lines, "eve": eve_lines, "ufw": ufw_lines}
+
+def write_log(path, format, n, ips=1000, seed=0):
+    """Writes n lines of format ("sshd", "snort", "eve" or "ufw") to path and returns its size in bytes."""
+    with open(path, "w") as file:
+        file.writelines(GENERATORS[format](n, ips, seed))
+    return os.path.getsize(path)
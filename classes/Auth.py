@@ -1,13 +1,43 @@
 import os
-import re
-import sqlite3
 import sys
+import time
 from collections import Counter
+from classes.dbutil import backfill_last_updated, changed_ips, ensure_column, select_in
+from classes.lineparser import AUTH_MESSAGE, count_auth_message, text_blocks
+from classes.logger import Logger
+from classes.metrics import get_metrics
+from classes.parallel import ParallelScanner
+from classes.ratewindow import RateWindow, parse_timestamp
+from classes.sketch import finish_counts, new_counter
+from classes.snapshot import get_snapshots
+from classes.storage import get_storage
+from classes.tailer import Tailer
+
+# How much each sshd/PAM event adds to an IP's count; PAM failures repeat the sshd line for the
+# same attempt and accepted logins are not failures, so both are only recorded
+WEIGHTS = {"failed_password": 1, "invalid_user": 1, "preauth_closed": 1, "max_attempts": 1,
+           "pam_failure": 0, "accepted": 0}
 
 class Auth:
     def __init__(self, config):
         self.log_path = config.get("log_path")
         self.threshold = config.get("threshold")
+        self.weights = dict(WEIGHTS, **config.get("events", {}))
+        # Usernames kept per IP, so a dictionary attack cannot grow the table without bound
+        self.max_users = config.get("max_users", 100)
+        # With a rate configured, IPs are flagged by events per time window instead of a lifetime count
+        self.rate = RateWindow(config["rate"]) if config.get("rate", {}).get("enabled") else None
+        self.snapshots = get_snapshots()
+        if self.rate is not None:
+            self.snapshots.restore("rate:auth", self.rate.restore)
+        self.flagged = set()
+        self.lines_matched = 0  # Of the last parse, for lines_matched_total
+        # Under floods of spoofed sources, a sketch bounds memory to its capacity and keeps the top_k
+        self.sketch = config.get("sketch", {})
+        self.logger = Logger()
+        self.metrics = get_metrics()
+        parallel = config.get("parallel", {})
+        self.parallel = ParallelScanner(parallel, self.logger) if parallel.get("enabled") else None
         
         if getattr(sys, 'frozen', False):
             base_dir = os.path.dirname(sys.executable)
@@ -15,47 +45,179 @@ class Auth:
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         
         db_root = os.path.join(base_dir, "db")
-        self.db_path = os.path.join(db_root, "auth_data.db")
+        self.db_path = config.get("db_path", os.path.join(db_root, "auth_data.db"))
+        self.storage = get_storage()
         self._ensure_folder(db_root)
         self._init_db()
+        self.tailer = Tailer("auth", self.log_path, self.db_path)
 
     def _ensure_folder(self, folder):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
     def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS failed_logins (
-                    ip TEXT PRIMARY KEY,
-                    count INTEGER,
-                    status TEXT
-                )
-            """)
-
-    def get_failed_login_counts(self):
-        ip_counter = Counter()
-        if not os.path.isfile(self.log_path):
-            return {}
-
-        with open(self.log_path, "r") as file:
-            for line in file:
-                if "Failed password for" in line:
-                    match = re.search(r"from ([\d\.]+|[a-fA-F0-9:]+)", line)
-                    if match:
-                        ip = match.group(1)
-                        ip_counter[ip] += 1
-        return dict(sorted(ip_counter.items(), key=lambda x: x[1], reverse=True))
-
-    def store_to_db(self):
-        failed_counts = self.get_failed_login_counts()
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            for ip, count in failed_counts.items():
-                status = "attack" if count > self.threshold else "normal"
-                cursor.execute("""
-                    INSERT INTO failed_logins (ip, count, status)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(ip) DO UPDATE SET count=excluded.count, status=excluded.status
-                """, (ip, count, status))
-            conn.commit()
\ No newline at end of file
+        self.storage.run(self.db_path, self._create_tables)
+
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS failed_logins (
+                ip TEXT PRIMARY KEY,
+                count INTEGER,
+                status TEXT,
+                last_updated REAL,
+                first_seen REAL
+            )
+        """)
+        ensure_column(conn, "failed_logins", "last_updated", "REAL")
+        ensure_column(conn, "failed_logins", "first_seen", "REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS failed_logins_last_updated ON failed_logins (last_updated)")
+        backfill_last_updated(conn, "failed_logins")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS auth_events (
+                ip TEXT,
+                event TEXT,
+                count INTEGER,
+                last_updated REAL,
+                PRIMARY KEY (ip, event)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS auth_users (
+                ip TEXT,
+                username TEXT,
+                count INTEGER,
+                last_updated REAL,
+                PRIMARY KEY (ip, username)
+            )
+        """)
+
+    def get_failed_login_counts(self, lines=None):
+        """Weighted failure counts per IP and, per IP, its {event: count} and {username: count}.
+
+        Each block of lines is searched once by AUTH_MESSAGE for every event type together.
+        """
+        ip_counter = new_counter(self.sketch)
+        details = {}
+        self.flagged = set()
+        self.lines_matched = 0
+        if lines is None:
+            if not os.path.isfile(self.log_path):
+                return {}, {}
+
+            scanned = self._scan_parallel("auth")
+            if scanned is not None:
+                self.lines_matched = scanned[2]
+                return dict(sorted(scanned[0].items(), key=lambda x: x[1], reverse=True)), scanned[1]
+
+        if self.rate is None:
+            blocks = self.tailer.read_blocks() if lines is None else text_blocks(lines)
+            # Repeats of a message are counted in C and each distinct one is parsed once;
+            # under a sketch they are parsed block by block so memory stays bounded
+            messages = Counter()
+            for text in blocks:
+                found = AUTH_MESSAGE.findall(text)
+                self.lines_matched += len(found)
+                messages.update(found)
+                if self.sketch.get("enabled"):
+                    self._count_messages(messages, ip_counter, details)
+            self._count_messages(messages, ip_counter, details)
+        else:
+            # Rate windows need every event's own timestamp, so these are matched line by line
+            for line in lines if lines is not None else self.tailer.read_lines():
+                found = AUTH_MESSAGE.findall(line)
+                self.lines_matched += bool(found)
+                for message in found:
+                    ip = count_auth_message(message, 1, ip_counter, details, self.weights, self.max_users)
+                    if ip is not None and self.rate.add(ip, parse_timestamp(line)):
+                        self.flagged.add(ip)
+                self._bound_details(ip_counter, details)
+        counts, details = finish_counts(ip_counter, details, self.logger, "Auth")
+        return dict(sorted(counts.items(), key=lambda x: x[1], reverse=True)), details
+
+    def _count_messages(self, messages, ip_counter, details):
+        for message, n in messages.items():
+            count_auth_message(message, n, ip_counter, details, self.weights, self.max_users)
+        messages.clear()
+        self._bound_details(ip_counter, details)
+
+    def _bound_details(self, ip_counter, details):
+        # A sketch bounds the counts, so the details follow it
+        if self.sketch.get("enabled") and len(details) > 2 * len(ip_counter) + 1024:
+            for ip in [ip for ip in details if ip not in ip_counter]:
+                del details[ip]
+
+    def _scan_parallel(self, kind):
+        # Rate windows and sketches depend on seeing the lines in order, so they stay sequential
+        if self.parallel is None or self.rate is not None or self.sketch.get("enabled"):
+            return None
+        return self.parallel.scan(kind, self.tailer, {"weights": self.weights, "max_users": self.max_users})
+
+    def _status(self, ip, count, threshold):
+        if ip in self.flagged or (threshold is not None and count > threshold):
+            return "attack"
+        return "normal"
+
+    def store_to_db(self, lines=None, checkpoint=None):
+        """Upserts the new counts and returns the IPs that are new or just crossed the threshold.
+
+        Replay passes historical lines and its own checkpoint in place of the tailer's."""
+        started = time.perf_counter()
+        failed_counts, details = self.get_failed_login_counts(lines)
+        parsed = time.perf_counter()
+        checkpoint = checkpoint or self.tailer
+        changed = self.storage.run(self.db_path, lambda conn: self._upsert(conn, failed_counts, details, checkpoint))
+        self.metrics.record_batch("auth", checkpoint, self.lines_matched, parsed - started, time.perf_counter() - parsed)
+        if self.rate is not None:
+            # Taken once the checkpoint is stored, so a restored window never counts lines read again
+            self.snapshots.offer("rate:auth", self.rate.state)
+        return changed
+
+    def _capped_users(self, cursor, details):
+        # max_users holds across batches too: names already stored keep counting, and an IP
+        # that has max_users rows takes no new ones (the smallest new names fill any room left)
+        ips = [ip for ip, (_, users) in details.items() if users]
+        stored = {}
+        for ip, user in select_in(cursor, "SELECT ip, username FROM auth_users WHERE ip IN ({})", ips):
+            stored.setdefault(ip, set()).add(user)
+        rows = []
+        for ip in ips:
+            users = details[ip][1]
+            known = stored.get(ip, set())
+            room = self.max_users - len(known)
+            for user in sorted(users):
+                if user in known:
+                    rows.append((ip, user, users[user]))
+                elif room > 0:
+                    room -= 1
+                    rows.append((ip, user, users[user]))
+        return rows
+
+    def _upsert(self, conn, failed_counts, details, checkpoint):
+        # Stamped on the writer thread, so timestamps follow commit order for the Analyzer watermark
+        now = time.time()
+        threshold = None if self.rate is not None else self.threshold
+        cursor = conn.cursor()
+        previous = dict(select_in(cursor, "SELECT ip, count FROM failed_logins WHERE ip IN ({})", failed_counts))
+        cursor.executemany("""
+            INSERT INTO failed_logins (ip, count, status, last_updated, first_seen)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(ip) DO UPDATE SET count=failed_logins.count + excluded.count,
+                status=CASE WHEN failed_logins.status = 'attack' OR excluded.status = 'attack'
+                    OR failed_logins.count + excluded.count > ? THEN 'attack' ELSE 'normal' END,
+                last_updated=excluded.last_updated
+        """, [
+            (ip, count, self._status(ip, count, threshold), now, now, threshold)
+            for ip, count in failed_counts.items()
+        ])
+        cursor.executemany("""
+            INSERT INTO auth_events (ip, event, count, last_updated) VALUES (?, ?, ?, ?)
+            ON CONFLICT(ip, event) DO UPDATE SET count=auth_events.count + excluded.count,
+                last_updated=excluded.last_updated
+        """, [(ip, event, count, now) for ip, (events, _) in details.items() for event, count in events.items()])
+        cursor.executemany("""
+            INSERT INTO auth_users (ip, username, count, last_updated) VALUES (?, ?, ?, ?)
+            ON CONFLICT(ip, username) DO UPDATE SET count=auth_users.count + excluded.count,
+                last_updated=excluded.last_updated
+        """, [(ip, user, count, now) for ip, user, count in self._capped_users(cursor, details)])
+        checkpoint.save_checkpoint(conn)
+        return changed_ips(previous, failed_counts, threshold, self.flagged)
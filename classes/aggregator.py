@@ -0,0 +1,87 @@
+import bisect
+import ipaddress
+from collections import defaultdict
+
+MAX_LEN = {4: 32, 6: 128}
+
+class Aggregator:
+    """Collapses attacker addresses into the widest CIDR prefixes that are dense enough.
+
+    Addresses are counted into a prefix trie stored as one dict per depth (prefix value ->
+    hosts below it), from min_prefix_len down to single hosts. Walking it from the top, a
+    node becomes one block when it holds at least min_hosts attackers and at least
+    min_density of its address space; otherwise its children are tried.
+    """
+
+    def __init__(self, config):
+        self.min_hosts = config.get("min_hosts", 8)
+        self.min_density = config.get("min_density", 0.0)
+        self.min_prefix_len = {4: config.get("min_prefix_len", 24), 6: config.get("min_prefix_len6", 64)}
+
+    def aggregate(self, ips):
+        """Returns {prefix: member ips} for every prefix worth blocking as a whole."""
+        by_version = defaultdict(list)
+        for ip in ips:
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            by_version[address.version].append((int(address), ip))
+
+        prefixes = {}
+        for version, addresses in by_version.items():
+            addresses.sort()
+            prefixes.update(self._aggregate_family(version, addresses))
+        return prefixes
+
+    def _aggregate_family(self, version, addresses):
+        max_len = MAX_LEN[version]
+        top = self.min_prefix_len[version]
+        levels = [defaultdict(int) for _ in range(top, max_len)]
+        for value, _ in addresses:
+            for depth, level in enumerate(levels):
+                level[value >> (max_len - top - depth)] += 1
+
+        values = [value for value, _ in addresses]
+        prefixes = {}
+
+        def walk(depth, prefix):
+            length = top + depth
+            count = levels[depth][prefix]
+            if count >= self.min_hosts and count >= self.min_density * (1 << (max_len - length)):
+                first = prefix << (max_len - length)
+                start = bisect.bisect_left(values, first)
+                end = bisect.bisect_left(values, first + (1 << (max_len - length)))
+                network = ipaddress.ip_network((first, length))
+                prefixes[str(network)] = set(ip for _, ip in addresses[start:end])
+            elif depth + 1 < len(levels):
+                for child in (prefix << 1, (prefix << 1) | 1):
+                    if child in levels[depth + 1]:
+                        walk(depth + 1, child)
+
+        for prefix in sorted(levels[0]) if levels else ():
+            walk(0, prefix)
+        return prefixes
+
+def index_prefixes(prefixes):
+    """Groups CIDR strings by (version, prefix length) for covering_prefix()."""
+    index = defaultdict(dict)
+    for prefix in prefixes:
+        network = ipaddress.ip_network(prefix, strict=False)
+        index[(network.version, network.prefixlen)][int(network.network_address)] = prefix
+    return index
+
+def covering_prefix(index, ip):
+    """Returns the indexed prefix containing ip, or None; one dict lookup per prefix length."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    value = int(address)
+    max_len = MAX_LEN[address.version]
+    for (version, length), networks in index.items():
+        if version == address.version:
+            prefix = networks.get(value >> (max_len - length) << (max_len - length))
+            if prefix is not None:
+                return prefix
+    return None
@@ -1,11 +1,42 @@
 import os
-import sqlite3
 import sys
+import time
+from classes.dbutil import ensure_column
 from classes.logger import Logger
+from classes.metrics import get_metrics
+from classes.scoring import Scorer, ensure_log10
+from classes.storage import get_storage
+
+SOURCES = (
+    ("auth", "failed_logins"),
+    ("ids_ips", "ids_ips_alerts"),
+    ("ufw", "ufw_alerts"),
+)
+# Scoring inputs beyond presence, status and count: feature -> (column it needs, expression)
+FEATURE_COLUMNS = {
+    "auth": {
+        "first_seen": ("first_seen", "first_seen"),
+    },
+    "ids_ips": {
+        "first_seen": ("first_seen", "first_seen"),
+        "ids_port": ("dest_port", "dest_port"),
+        "protocol": ("protocol", "protocol"),
+        "classifications": ("classification", "classification"),
+        "severities": ("severity", "severity"),
+    },
+    "ufw": {
+        "first_seen": ("first_seen", "first_seen"),
+        "ufw_port": ("dpt", "CAST(NULLIF(dpt, 'Unknown') AS INTEGER)"),
+        "protocol": ("proto", "proto"),
+    },
+}
 
 class Analyzer:
     def __init__(self, config):
         self.logger = Logger()
+        self.metrics = get_metrics()
+        self.storage = get_storage()
+        self.scorer = Scorer(config.get("scoring"))
         
         if getattr(sys, 'frozen', False):
             base_dir = os.path.dirname(sys.executable)
@@ -13,12 +44,13 @@ class Analyzer:
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             
         self.analysis_folder = os.path.join(base_dir, "db")
-        self.auth_db = os.path.join(self.analysis_folder, "auth_data.db")
-        self.ids_ips_db = os.path.join(self.analysis_folder, "ids_ips_data.db")
-        self.ufw_db = os.path.join(self.analysis_folder, "ufw_data.db")
-        self.analysis_path = os.path.join(self.analysis_folder, "threats.db")
+        self.auth_db = config.get("auth_db", os.path.join(self.analysis_folder, "auth_data.db"))
+        self.ids_ips_db = config.get("ids_ips_db", os.path.join(self.analysis_folder, "ids_ips_data.db"))
+        self.ufw_db = config.get("ufw_db", os.path.join(self.analysis_folder, "ufw_data.db"))
+        self.analysis_path = config.get("db_path", os.path.join(self.analysis_folder, "threats.db"))
         self._ensure_folder()
         self._init_db()
+        self._attach_sources()
 
     def _ensure_folder(self):
         if not os.path.exists(self.analysis_folder):
@@ -26,50 +58,169 @@ class Analyzer:
 
     def _init_db(self):
         try:
-            with sqlite3.connect(self.analysis_path) as conn:
-                conn.execute("""
-                    CREATE TABLE IF NOT EXISTS threat_summary (
-                        ip TEXT PRIMARY KEY,
-                        auth_flag INTEGER,
-                        ids_ips_flag INTEGER,
-                        ufw_flag INTEGER,
-                        classification TEXT
-                    )
-                """)
+            self.storage.run(self.analysis_path, self._create_tables)
         except Exception as e:
             self.logger.error(f"Analyzer DB init error: {e}")
 
-    def fetch_ips(self, db_path, table):
-        try:
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(f"SELECT ip FROM {table}")
-                return set(row[0] for row in cursor.fetchall())
-        except Exception as e:
-            self.logger.error(f"Analyzer DB read error from {db_path}: {e}")
-            return set()
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS threat_summary (
+                ip TEXT PRIMARY KEY,
+                auth_flag INTEGER,
+                ids_ips_flag INTEGER,
+                ufw_flag INTEGER,
+                classification TEXT,
+                promoted_at REAL,
+                first_seen REAL,
+                last_attack REAL,
+                score REAL
+            )
+        """)
+        ensure_column(conn, "threat_summary", "promoted_at", "REAL")
+        ensure_column(conn, "threat_summary", "first_seen", "REAL")
+        ensure_column(conn, "threat_summary", "last_attack", "REAL")
+        ensure_column(conn, "threat_summary", "score", "REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS threat_summary_promoted_at ON threat_summary (promoted_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS threat_summary_last_attack ON threat_summary (last_attack)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyzer_state (
+                source TEXT PRIMARY KEY,
+                watermark REAL
+            )
+        """)
+
+    def _attach_sources(self):
+        # Sources kept in their own files are ATTACHed to threats.db; in single-file mode they are already in main
+        self.schemas = {}
+        for name, _ in SOURCES:
+            db_path = getattr(self, f"{name}_db")
+            if os.path.abspath(db_path) == os.path.abspath(self.analysis_path):
+                self.schemas[name] = "main"
+            else:
+                self.storage.attach(self.analysis_path, name, db_path)
+                self.schemas[name] = name
+
+    def _source_tables(self, conn):
+        tables = []
+        for i, (name, table) in enumerate(SOURCES):
+            schema = self.schemas[name]
+            exists = conn.execute(
+                f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+            if not exists:
+                self.logger.error(f"Analyzer DB read error: {schema}.{table} does not exist")
+                continue
+            tables.append((i, name, f"{schema}.{table}"))
+        return tables
+
+    def _load_changed_ips(self, conn, tables):
+        """Fills temp.analyze_ips with the IPs updated since each source's watermark.
+
+        Returns False when no watermark exists yet, meaning every IP has to be classified.
+        """
+        watermarks = dict(conn.execute("SELECT source, watermark FROM analyzer_state"))
+        if not watermarks:
+            return False
+        for _, name, table in tables:
+            if name in watermarks:
+                conn.execute(
+                    f"INSERT OR IGNORE INTO temp.analyze_ips (ip) SELECT ip FROM {table} WHERE last_updated > ?",
+                    (watermarks[name],)
+                )
+            else:
+                conn.execute(f"INSERT OR IGNORE INTO temp.analyze_ips (ip) SELECT ip FROM {table}")
+        return True
+
+    def _save_watermarks(self, conn, tables):
+        for _, name, table in tables:
+            conn.execute(f"""
+                INSERT INTO analyzer_state (source, watermark)
+                SELECT ?, COALESCE(MAX(last_updated), 0) FROM {table} WHERE true
+                ON CONFLICT(source) DO UPDATE SET watermark=excluded.watermark
+            """, (name,))
+
+    def _classify(self, conn, ips):
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS analyze_ips (ip TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.analyze_ips")
+        tables = self._source_tables(conn)
+        if not tables:
+            return 0
+
+        # Writes are serialized on the storage thread, so nothing can change between
+        # collecting the changed IPs and moving the watermarks past them
+        if ips is not None:
+            conn.executemany("INSERT OR IGNORE INTO temp.analyze_ips (ip) VALUES (?)", ((ip,) for ip in ips))
+            restrict = True
+        else:
+            restrict = self._load_changed_ips(conn, tables)
+            self._save_watermarks(conn, tables)
+        if restrict and not conn.execute("SELECT 1 FROM temp.analyze_ips LIMIT 1").fetchone():
+            return 0
 
-    def analyze(self):
-        auth_ips = self.fetch_ips(self.auth_db, "failed_logins")
-        ids_ips_ips = self.fetch_ips(self.ids_ips_db, "ids_ips_alerts")
-        ufw_ips = self.fetch_ips(self.ufw_db, "ufw_alerts")
+        # Each source's row carries its share of the score; the GROUP BY sums them and adds the
+        # terms that span sources (ports seen by IDS and UFW, protocol), so every score is computed once.
+        # promoted_at records when an IP first became an attack, for Defense's watermark;
+        # last_attack when it was last scored as one, so expired blocks can be renewed;
+        # first_seen is when its first event in any source was ingested, for ingest_to_block_seconds.
+        where = " WHERE ip IN (SELECT ip FROM temp.analyze_ips)" if restrict else ""
+        selects, params = [], []
+        for i, name, table in tables:
+            select, source_params = self._source_select(conn, i, name, table)
+            selects.append(select + where)
+            params += source_params
+        shared, shared_params = self.scorer.score({
+            "ports_seen_across_sources":
+                "(MAX(ids_port) IS NOT NULL) + (MAX(ufw_port) IS NOT NULL AND MAX(ufw_port) IS NOT MAX(ids_port))",
+            "protocols": "MAX(protocol)",
+        })
+        ensure_log10(conn)
+        now = time.time()
+        return conn.execute(f"""
+            INSERT INTO threat_summary (ip, auth_flag, ids_ips_flag, ufw_flag, classification, score, promoted_at,
+                                        first_seen, last_attack)
+            SELECT ip, a, s, u, classification, score, CASE WHEN classification = 'attack' THEN ? END, first_seen,
+                   CASE WHEN classification = 'attack' THEN ? END
+            FROM (
+                SELECT *, {self.scorer.classification("score")} AS classification
+                FROM (
+                    SELECT ip, MAX(a) AS a, MAX(s) AS s, MAX(u) AS u, MIN(first_seen) AS first_seen,
+                           SUM(partial) + {shared} AS score
+                    FROM ({" UNION ALL ".join(selects)})
+                    GROUP BY ip
+                )
+            ) WHERE true
+            ON CONFLICT(ip) DO UPDATE SET auth_flag=excluded.auth_flag, ids_ips_flag=excluded.ids_ips_flag,
+                ufw_flag=excluded.ufw_flag, classification=excluded.classification, score=excluded.score,
+                promoted_at=CASE WHEN threat_summary.classification = 'attack' THEN threat_summary.promoted_at
+                                 ELSE excluded.promoted_at END,
+                first_seen=COALESCE(MIN(threat_summary.first_seen, excluded.first_seen),
+                                    threat_summary.first_seen, excluded.first_seen),
+                last_attack=COALESCE(excluded.last_attack, threat_summary.last_attack)
+        """, [now, now] + shared_params + params).rowcount
 
-        all_ips = auth_ips | ids_ips_ips | ufw_ips
+    def _source_select(self, conn, i, name, table):
+        """(SELECT, parameters) for one source's rows with their flags, partial score and shared features."""
+        schema, table_name = table.split(".")
+        # A source whose parser has not started yet may still have the old schema
+        present = set(row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table_name})"))
+        found = {feature: expression for feature, (column, expression) in FEATURE_COLUMNS[name].items()
+                 if column in present}
+        flags = ", ".join(f"{int(j == i)} AS {column}" for j, column in enumerate(("a", "s", "u")))
+        partial, params = self.scorer.score(dict(
+            {name: "1", f"{name}_attack": "COALESCE(status = 'attack', 0)", f"{name}_count": "COALESCE(count, 0)"},
+            **{category: found[category] for category in ("classifications", "severities") if category in found}
+        ))
+        shared = ", ".join(f"{found.get(feature, 'NULL')} AS {feature}"
+                           for feature in ("first_seen", "ids_port", "ufw_port", "protocol"))
+        return f"SELECT ip, {flags}, {partial} AS partial, {shared} FROM {table}", params
 
+    def analyze(self, ips=None):
+        """Scores and classifies the IPs changed since the last run, or only the given ips when streaming."""
+        started = time.perf_counter()
         try:
-            with sqlite3.connect(self.analysis_path) as conn:
-                cursor = conn.cursor()
-                for ip in all_ips:
-                    a = int(ip in auth_ips)
-                    s = int(ip in ids_ips_ips)
-                    u = int(ip in ufw_ips)
-                    # Classify as attack if present in at least 2 systems, or strict 3 based on preference
-                    classification = "attack" if (a + s + u) >= 2 else "suspicious"
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO threat_summary (ip, auth_flag, ids_ips_flag, ufw_flag, classification)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (ip, a, s, u, classification))
-                conn.commit()
-            self.logger.info("Threat analysis DB updated successfully")
+            count = self.storage.run(self.analysis_path, lambda conn: self._classify(conn, ips))
+            self.metrics.inc("ips_classified_total", count)
+            self.logger.info(f"Threat analysis DB updated successfully ({count} IP(s) classified)")
         except Exception as e:
-            self.logger.error(f"Analyzer DB write error: {e}")
\ No newline at end of file
+            self.logger.error(f"Analyzer DB write error: {e}")
+        self.metrics.observe("analyzer_seconds", time.perf_counter() - started)
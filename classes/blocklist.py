@@ -0,0 +1,304 @@
+import bisect
+import heapq
+import os
+import socket
+from array import array
+from contextlib import nullcontext
+from classes.aggregator import covering_prefix, index_prefixes
+from classes.snapshot import get_snapshots
+
+LOW = (1 << 64) - 1
+
+def pack(ip):
+    """(4 or 16, the address as an integer), or None if ip is not an address."""
+    try:
+        packed = socket.inet_pton(socket.AF_INET6 if ":" in ip else socket.AF_INET, ip)
+    except (OSError, TypeError, ValueError):
+        return None
+    return len(packed), int.from_bytes(packed, "big")
+
+class PackedSet:
+    """A set of 4- or 16-byte integers kept in sorted arrays plus small change overlays.
+
+    IPv4 keys live in one array of 32-bit values; IPv6 keys are split into parallel arrays
+    of high and low 64-bit halves. Lookups are bisections done in C, and entries cost their
+    width in bytes. Additions and removals go to two hash sets that are merged into the
+    arrays once they grow past a fraction of their size.
+    """
+
+    def __init__(self, width, keys=()):
+        self.width = width
+        self._build(sorted(set(keys)))
+
+    def _build(self, keys):
+        if self.width == 4:
+            self.high = array("I", keys)
+            self.low = None
+        else:
+            self.high = array("Q", (key >> 64 for key in keys))
+            self.low = array("Q", (key & LOW for key in keys))
+        self.added = set()  # keys not in the arrays
+        self.removed = set()  # keys in the arrays
+
+    def __len__(self):
+        return len(self.high) + len(self.added) - len(self.removed)
+
+    def _in_base(self, key):
+        if self.low is None:
+            i = bisect.bisect_left(self.high, key)
+            return i < len(self.high) and self.high[i] == key
+        high, low = key >> 64, key & LOW
+        start = bisect.bisect_left(self.high, high)
+        end = bisect.bisect_right(self.high, high, start)
+        i = bisect.bisect_left(self.low, low, start, end)
+        return i < end and self.low[i] == low
+
+    def __contains__(self, key):
+        if key in self.added:
+            return True
+        if key in self.removed:
+            return False
+        return self._in_base(key)
+
+    def add(self, key):
+        if key in self.removed:
+            self.removed.discard(key)
+        elif key not in self.added and not self._in_base(key):
+            self.added.add(key)
+            self._maybe_compact()
+
+    def discard(self, key):
+        if key in self.added:
+            self.added.discard(key)
+        elif key not in self.removed and self._in_base(key):
+            self.removed.add(key)
+            self._maybe_compact()
+
+    def _base_keys(self):
+        if self.low is None:
+            return iter(self.high)
+        return ((high << 64) | low for high, low in zip(self.high, self.low))
+
+    def __iter__(self):
+        kept = (key for key in self._base_keys() if key not in self.removed)
+        return heapq.merge(kept, sorted(self.added))
+
+    def _maybe_compact(self):
+        if len(self.added) + len(self.removed) > max(1024, len(self.high) // 16):
+            self._build(list(self))
+
+    def state(self):
+        """The arrays and overlays as bytes, for restore()."""
+        overlay = lambda keys: b"".join(key.to_bytes(self.width, "big") for key in keys)
+        return [self.high.tobytes(), b"" if self.low is None else self.low.tobytes(),
+                overlay(self.added), overlay(self.removed)]
+
+    @classmethod
+    def restore(cls, width, blobs):
+        packed = cls(width)
+        high, low, added, removed = blobs
+        packed.high.frombytes(high)
+        if packed.low is not None:
+            packed.low.frombytes(low)
+            if len(packed.low) != len(packed.high):
+                raise ValueError("array lengths differ")
+        overlay = lambda data: set(int.from_bytes(data[i:i + width], "big") for i in range(0, len(data), width))
+        packed.added, packed.removed = overlay(added), overlay(removed)
+        return packed
+
+class ChangeIndex:
+    """Database rows held in memory and kept current by deltas from a trigger-fed change table.
+
+    Subclasses name the change table and the columns of one change, create the triggers, load
+    the rows in _reload() and apply one change in _apply(), which returns the value it changed
+    or None when the change may affect any value.
+    """
+
+    # Changes kept behind the newest one; an index that falls further behind reloads
+    RETAIN = 100000
+    CHANGES = None
+    COLUMNS = None
+
+    def __init__(self, storage, db_path, logger):
+        self.storage = storage
+        self.db_path = db_path
+        self.logger = logger
+        self.seq = None
+        self.snapshots = get_snapshots()
+        self.snapshot_name = f"{self.CHANGES}:{os.path.abspath(db_path)}"
+        self.storage.run(self.db_path, self._create_triggers)
+
+    def _restore(self, conn, meta, blobs):
+        # The snapshot belongs to this file, and the file has not been recreated since
+        last = conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = ?", (self.CHANGES,)
+        ).fetchone()[0]
+        if meta["inode"] != os.stat(self.db_path).st_ino or last < meta["seq"]:
+            return False
+        self._restore_state(meta, blobs)
+        self.seq = meta["seq"]
+        return True
+
+    def _capture(self):
+        meta, blobs = self._state()
+        return dict(meta, seq=self.seq, inode=os.stat(self.db_path).st_ino), blobs
+
+    def sync(self, lock=None):
+        """Loads the rows on first use and applies the changes recorded since the last sync.
+
+        The first load starts from the snapshot when one is saved and still current. Returns
+        the set of values changed, or None when any value may have changed. The change rows are
+        read outside lock; only loading and applying them hold it, so readers of the index never
+        wait on the query.
+        """
+        lock = lock or nullcontext()
+        restored = False
+        with self.storage.read(self.db_path) as conn:
+            if self.seq is None:
+                with lock:
+                    restored = self.snapshots.restore(
+                        self.snapshot_name, lambda meta, blobs: self._restore(conn, meta, blobs)
+                    )
+                    if not restored:
+                        self._reload(conn)
+                if not restored:
+                    self.snapshots.offer(self.snapshot_name, self._capture)
+                    return None
+            first = conn.execute(f"SELECT MIN(seq) FROM {self.CHANGES}").fetchone()[0]
+            if first is not None and first > self.seq + 1:
+                # Changes this index never saw have been pruned
+                with lock:
+                    self._reload(conn)
+                self.snapshots.offer(self.snapshot_name, self._capture)
+                return None
+            rows = conn.execute(
+                f"SELECT seq, {self.COLUMNS} FROM {self.CHANGES} WHERE seq > ? ORDER BY seq", (self.seq,)
+            ).fetchall()
+        changed = set()
+        with lock:
+            for row in rows:
+                value = self._apply(*row[1:])
+                if value is None:
+                    changed = None
+                elif changed is not None:
+                    changed.add(value)
+                self.seq = row[0]
+            if rows:
+                self._applied(changed)
+        if rows:
+            self.snapshots.offer(self.snapshot_name, self._capture)
+        if rows and first is not None and self.seq - first > 2 * self.RETAIN:
+            self.storage.execute(self.db_path, f"DELETE FROM {self.CHANGES} WHERE seq <= ?", (self.seq - self.RETAIN,))
+        return None if restored else changed
+
+    def _applied(self, changed):
+        pass
+
+class BlocklistIndex(ChangeIndex):
+    """defense.db's blocked addresses and prefixes, held in memory and kept current by deltas.
+
+    Triggers on blocked_ips and blocked_prefixes append every insert, status change and
+    delete to blocklist_changes; sync() loads the tables once and afterwards applies only
+    the changes past the last sequence number it saw. Addresses are packed 4- or 16-byte
+    integers (PackedSet), so membership is a hash or binary-search lookup, and prefix coverage
+    is one dict lookup per blocked prefix length.
+    """
+
+    CHANGES = "blocklist_changes"
+    COLUMNS = "kind, value, status"
+
+    def _create_triggers(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS blocklist_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                value TEXT,
+                status TEXT
+            )
+        """)
+        for table, kind, column in (("blocked_ips", "ip", "ip"), ("blocked_prefixes", "prefix", "prefix")):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO blocklist_changes (kind, value, status) VALUES ('{kind}', NEW.{column}, NEW.status);
+                END
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF status ON {table} BEGIN
+                    INSERT INTO blocklist_changes (kind, value, status) VALUES ('{kind}', NEW.{column}, NEW.status);
+                END
+            """)
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO blocklist_changes (kind, value, status) VALUES ('{kind}', OLD.{column}, NULL);
+                END
+            """)
+
+    def _reload(self, conn):
+        # The sequence is read first: changes racing the load are applied again by the next
+        # sync, which is harmless because applying a change only sets the row's final state
+        self.seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM blocklist_changes").fetchone()[0]
+        known = {4: [], 16: []}
+        self.other = set()  # values that are not addresses
+        self.failed = set()  # addresses whose block failed; few, so kept as strings
+        for ip, status in conn.execute("SELECT ip, status FROM blocked_ips"):
+            if status == "block_failed":
+                self.failed.add(ip)
+            key = pack(ip)
+            if key is None:
+                self.other.add(ip)
+            else:
+                known[key[0]].append(key[1])
+        self.known = {width: PackedSet(width, values) for width, values in known.items()}
+        self.prefixes = set(row[0] for row in conn.execute("SELECT prefix FROM blocked_prefixes WHERE status = 'blocked'"))
+        self.prefix_index = index_prefixes(self.prefixes)
+        self.logger.info(f"Blocklist index loaded: {len(self)} address(es), {len(self.prefixes)} prefix(es)")
+
+    def _apply(self, kind, value, status):
+        if kind == "prefix":
+            if status == "blocked":
+                self.prefixes.add(value)
+            else:
+                self.prefixes.discard(value)
+            return None
+        (self.failed.add if status == "block_failed" else self.failed.discard)(value)
+        key = pack(value)
+        if key is None:
+            (self.other.discard if status is None else self.other.add)(value)
+        elif status is None:
+            self.known[key[0]].discard(key[1])
+        else:
+            self.known[key[0]].add(key[1])
+        return value
+
+    def _applied(self, changed):
+        if changed is None:
+            self.prefix_index = index_prefixes(self.prefixes)
+
+    def _state(self):
+        meta = {"other": sorted(self.other), "failed": sorted(self.failed), "prefixes": sorted(self.prefixes)}
+        return meta, self.known[4].state() + self.known[16].state()
+
+    def _restore_state(self, meta, blobs):
+        if len(blobs) != 8:
+            raise ValueError("unexpected number of sets")
+        self.known = {4: PackedSet.restore(4, blobs[:4]), 16: PackedSet.restore(16, blobs[4:])}
+        self.other, self.failed, self.prefixes = set(meta["other"]), set(meta["failed"]), set(meta["prefixes"])
+        self.prefix_index = index_prefixes(self.prefixes)
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.known.values()) + len(self.other)
+
+    def __contains__(self, ip):
+        """Whether ip has a row in blocked_ips, whatever its status."""
+        key = pack(ip)
+        if key is None:
+            return ip in self.other
+        return key[1] in self.known[key[0]]
+
+    def blocked(self, ip):
+        """Whether ip has a row in blocked_ips that is not a failed block."""
+        return ip in self and ip not in self.failed
+
+    def covering(self, ip):
+        """The blocked prefix containing ip, or None."""
+        return covering_prefix(self.prefix_index, ip) if self.prefixes else None
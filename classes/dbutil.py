@@ -0,0 +1,31 @@
+import time
+
+def select_in(cursor, query, values, chunk_size=500):
+    """Runs query once per chunk of values, filling its "{}" with the IN placeholders."""
+    values = list(values)
+    rows = []
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i + chunk_size]
+        cursor.execute(query.format(",".join("?" * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+def changed_ips(previous, counts, threshold, flagged=()):
+    """IPs that are new to the table, just passed threshold, or were flagged by a rate window."""
+    return [
+        ip for ip, count in counts.items()
+        if ip not in previous or ip in flagged
+        or (threshold is not None and previous[ip] <= threshold < previous[ip] + count)
+    ]
+
+def backfill_last_updated(conn, table):
+    """Stamps rows from before last_updated existed with now, so retention can age them out.
+
+    Their real last activity is unknown; counting it from the upgrade keeps them one full TTL."""
+    conn.execute(f"UPDATE {table} SET last_updated = ? WHERE last_updated IS NULL", (time.time(),))
+
+def ensure_column(conn, table, column, declaration):
+    """Adds column to a table created by an older version."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
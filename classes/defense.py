@@ -1,12 +1,38 @@
+import ipaddress
 import os
-import sqlite3
-import subprocess
 import sys
+import threading
+import time
+from collections import defaultdict
+from classes.aggregator import Aggregator, covering_prefix, index_prefixes
+from classes.blocklist import BlocklistIndex
+from classes.dbutil import ensure_column, select_in
+from classes.enforcer import get_backend
+from classes.expiry import ExpiryScheduler
 from classes.logger import Logger
+from classes.metrics import get_metrics
+from classes.storage import get_storage
 
 class Defense:
     def __init__(self, config):
         self.logger = Logger()
+        self.metrics = get_metrics()
+        self.storage = get_storage()
+        self.config = config
+        self._backend = None
+        self.lock = threading.Lock()
+        ttl = config.get("ttl", {})
+        # Block duration for a first, second, ... offence; None means permanent
+        self.durations = ttl.get("durations", [3600, 86400, None]) if ttl.get("enabled") else None
+        if self.durations is not None and not self.durations:
+            self.logger.error("defense.ttl.durations is empty; every block will be permanent")
+            self.durations = [None]
+        self.forget_after = ttl.get("forget_after", 30 * 86400)
+        self.max_active = ttl.get("max_active", 0)
+        self.retry = ttl.get("retry", 60)
+        self.expiry = None  # Loaded from defense.db on first use
+        aggregate = config.get("aggregate", {})
+        self.aggregator = Aggregator(aggregate) if aggregate.get("enabled") else None
         
         if getattr(sys, 'frozen', False):
             base_dir = os.path.dirname(sys.executable)
@@ -14,10 +40,16 @@ class Defense:
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             
         self.db_root = os.path.join(base_dir, "db")
-        self.analysis_db = os.path.join(self.db_root, "threats.db")
-        self.db_path = os.path.join(self.db_root, "defense.db")
+        self.analysis_db = config.get("analysis_db", os.path.join(self.db_root, "threats.db"))
+        self.db_path = config.get("db_path", os.path.join(self.db_root, "defense.db"))
         self._ensure_folder(self.db_root)
         self._init_db()
+        self.blocklist = None
+        if config.get("blocklist_index", {}).get("enabled", True):
+            try:
+                self.blocklist = BlocklistIndex(self.storage, self.db_path, self.logger)
+            except Exception as e:
+                self.logger.error(f"Blocklist index unavailable, querying defense.db instead: {e}")
 
     def _ensure_folder(self, folder):
         if not os.path.exists(folder):
@@ -25,85 +57,454 @@ class Defense:
 
     def _init_db(self):
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    CREATE TABLE IF NOT EXISTS blocked_ips (
-                        ip TEXT PRIMARY KEY,
-                        blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        status TEXT
-                    )
-                """)
-                conn.commit()
+            self.storage.run(self.db_path, self._create_tables)
         except Exception as e:
             self.logger.error(f"Defense DB init error: {e}")
 
-    def get_blocked_ips(self):
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS blocked_ips (
+                ip TEXT PRIMARY KEY,
+                blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT,
+                expires_at REAL
+            )
+        """)
+        ensure_column(conn, "blocked_ips", "expires_at", "REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS blocked_ips_expires_at ON blocked_ips (expires_at)")
+        # Outlives the blocked_ips row, so a repeat offender's next block is longer
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS block_history (
+                ip TEXT PRIMARY KEY,
+                offences INTEGER,
+                last_blocked REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS blocked_prefixes (
+                prefix TEXT PRIMARY KEY,
+                blocked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                status TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS prefix_members (
+                prefix TEXT,
+                ip TEXT,
+                PRIMARY KEY (prefix, ip)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS defense_state (
+                key TEXT PRIMARY KEY,
+                value REAL
+            )
+        """)
+
+    def get_watermark(self):
+        try:
+            with self.storage.read(self.db_path) as conn:
+                row = conn.execute("SELECT value FROM defense_state WHERE key = 'promoted_at'").fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            self.logger.error(f"Defense DB read error: {e}")
+            return None
+
+    def save_watermark(self, value):
+        self.storage.execute(self.db_path, """
+            INSERT INTO defense_state (key, value) VALUES ('promoted_at', ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value
+        """, (value,)).result()
+
+    def sync_blocklist(self):
+        if self.blocklist is None:
+            return
+        try:
+            self.blocklist.sync()
+        except Exception as e:
+            self.logger.error(f"Blocklist index sync failed, querying defense.db instead: {e}")
+            self.blocklist = None
+
+    def get_blocked_ips(self, ips=None):
+        if self.blocklist is not None and ips is not None:
+            return set(ip for ip in ips if ip in self.blocklist)
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.storage.read(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT ip FROM blocked_ips")
-                return set(row[0] for row in cursor.fetchall())
+                if ips is None:
+                    cursor.execute("SELECT ip FROM blocked_ips")
+                    rows = cursor.fetchall()
+                else:
+                    rows = select_in(cursor, "SELECT ip FROM blocked_ips WHERE ip IN ({})", ips)
+                return set(row[0] for row in rows)
         except Exception as e:
             self.logger.error(f"Defense DB read error: {e}")
             return set()
 
-    def get_attack_ips(self):
+    def get_blocked_prefixes(self):
+        """Active prefix blocks mapped to every IP recorded under them."""
+        try:
+            with self.storage.read(self.db_path) as conn:
+                prefixes = {row[0]: set() for row in conn.execute("SELECT prefix FROM blocked_prefixes WHERE status = 'blocked'")}
+                for prefix, ip in conn.execute("""
+                    SELECT m.prefix, m.ip FROM prefix_members m
+                    JOIN blocked_prefixes p ON p.prefix = m.prefix WHERE p.status = 'blocked'
+                """):
+                    prefixes[prefix].add(ip)
+                return prefixes
+        except Exception as e:
+            self.logger.error(f"Defense DB read error: {e}")
+            return {}
+
+    def get_individually_blocked_ips(self):
         try:
-            with sqlite3.connect(self.analysis_db) as conn:
+            with self.storage.read(self.db_path) as conn:
+                return set(row[0] for row in conn.execute("SELECT ip FROM blocked_ips WHERE status = 'blocked'"))
+        except Exception as e:
+            self.logger.error(f"Defense DB read error: {e}")
+            return set()
+
+    def get_attack_ips(self, ips=None):
+        try:
+            with self.storage.read(self.analysis_db) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT ip FROM threat_summary WHERE classification = 'attack'")
-                return set(row[0] for row in cursor.fetchall())
+                if ips is None:
+                    cursor.execute("SELECT ip FROM threat_summary WHERE classification = 'attack'")
+                    rows = cursor.fetchall()
+                else:
+                    rows = select_in(cursor, "SELECT ip FROM threat_summary WHERE classification = 'attack' AND ip IN ({})", ips)
+                return set(row[0] for row in rows)
         except Exception as e:
             self.logger.error(f"Analyzer DB read error: {e}")
             return set()
 
-    def block_ip(self, ip):
+    def get_promoted_ips(self, since=None):
+        """Attack IPs promoted after the since watermark (all of them when None) and the newest promotion seen.
+
+        With TTLs on, an attack IP's renewed activity counts as a promotion too, so an offender
+        whose block expired is blocked again once it comes back.
+        """
+        column = "last_attack" if self.durations is not None else "promoted_at"
         try:
-            command = f"ufw deny from {ip}"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, check=False)
-            
-            if result.returncode == 0:
-                self.logger.info(f"UFW rule added: deny from {ip}")
-                return True
-            else:
-                self.logger.error(f"Failed to block IP {ip}: {result.stderr}")
-                return False
+            with self.storage.read(self.analysis_db) as conn:
+                if since is None:
+                    rows = conn.execute(
+                        f"SELECT ip, {column} FROM threat_summary WHERE classification = 'attack'"
+                    ).fetchall()
+                else:
+                    rows = conn.execute(
+                        f"SELECT ip, {column} FROM threat_summary WHERE classification = 'attack' AND {column} > ?",
+                        (since,)
+                    ).fetchall()
         except Exception as e:
-            self.logger.error(f"Error executing UFW command for {ip}: {e}")
-            return False
+            self.logger.error(f"Analyzer DB read error: {e}")
+            return set(), since
+        newest = max((promoted_at for _, promoted_at in rows if promoted_at is not None), default=since)
+        return set(ip for ip, _ in rows), newest
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            backend = get_backend(self.config, self.logger)
+            self.logger.info(f"Defense enforcement backend: {backend.name}")
+            # Set-based backends start empty after a reboot; defense.db says what must be enforced
+            enforced = self.get_individually_blocked_ips() | set(self.get_blocked_prefixes())
+            loaded, failed = backend.load(enforced)
+            if enforced:
+                self.logger.info(f"Defense: Re-applied {len(loaded)} recorded block(s) via {backend.name}"
+                                 + (f", {len(failed)} failed" if failed else ""))
+            self._backend = backend
+        return self._backend
+
+    def block_ip(self, ip):
+        blocked, _ = self.backend.block([ip])
+        return ip in blocked
 
     def record_blocked_ip(self, ip, status="blocked"):
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
+        self.record_blocked_ips([(ip, status)])
+
+    def record_blocked_ips(self, rows, expiries=None):
+        """Records (ip, status) rows in one write instead of one transaction per IP.
+
+        expiries maps IPs blocked with a TTL to (offence number, expiry or None if permanent);
+        their block history is updated in the same write.
+        """
+        if not expiries:
+            try:
+                self.storage.executemany(self.db_path, """
                     INSERT OR IGNORE INTO blocked_ips (ip, status)
                     VALUES (?, ?)
-                """, (ip, status))
-                conn.commit()
+                """, rows).result()
+            except Exception as e:
+                self.logger.error(f"Error recording {len(rows)} blocked IP(s): {e}")
+            return
+
+        now = time.time()
+        def write(conn):
+            conn.executemany("""
+                INSERT OR IGNORE INTO blocked_ips (ip, status, expires_at)
+                VALUES (?, ?, ?)
+            """, ((ip, status, expiries[ip][1] if ip in expiries else None) for ip, status in rows))
+            conn.executemany("""
+                INSERT INTO block_history (ip, offences, last_blocked) VALUES (?, ?, ?)
+                ON CONFLICT(ip) DO UPDATE SET offences=excluded.offences, last_blocked=excluded.last_blocked
+            """, ((ip, offences, now) for ip, (offences, _) in expiries.items()))
+        try:
+            self.storage.run(self.db_path, write)
+        except Exception as e:
+            self.logger.error(f"Error recording {len(rows)} blocked IP(s): {e}")
+
+    def get_offences(self, ips, now):
+        """How many blocks each IP has already served, forgetting those older than forget_after."""
+        try:
+            with self.storage.read(self.db_path) as conn:
+                rows = select_in(conn.cursor(), "SELECT ip, offences, last_blocked FROM block_history WHERE ip IN ({})", ips)
         except Exception as e:
-            self.logger.error(f"Error recording blocked IP {ip}: {e}")
+            self.logger.error(f"Defense DB read error: {e}")
+            return {}
+        return {ip: offences for ip, offences, last_blocked in rows if now - last_blocked < self.forget_after}
+
+    def plan_expiries(self, ips, now):
+        """{ip: (offence number, expiry or None)}, escalating through durations for repeat offenders."""
+        previous = self.get_offences(ips, now)
+        expiries = {}
+        for ip in ips:
+            offences = previous.get(ip, 0) + 1
+            duration = self.durations[min(offences, len(self.durations)) - 1]
+            expiries[ip] = (offences, None if duration is None else now + duration)
+        return expiries
+
+    def _load_expiry(self):
+        # Restarts resume from the expiries recorded in defense.db
+        if self.expiry is None:
+            with self.storage.read(self.db_path) as conn:
+                entries = conn.execute(
+                    "SELECT ip, expires_at FROM blocked_ips WHERE status = 'blocked' AND expires_at IS NOT NULL"
+                ).fetchall()
+            self.expiry = ExpiryScheduler(entries)
+            self.logger.info(f"Block expiry loaded: {len(self.expiry)} temporary block(s)")
+        return self.expiry
 
-    def defend(self):
+    def expire(self, now=None):
+        """Lifts the temporary blocks that are due with one backend call and one write; returns how many."""
+        if self.durations is None:
+            return 0
+        with self.lock:
+            return self._expire(time.time() if now is None else now)
+
+    def _expire(self, now):
         try:
-            attack_ips = self.get_attack_ips()
-            blocked_ips = self.get_blocked_ips()
+            expiry = self._load_expiry()
+        except Exception as e:
+            self.logger.error(f"Defense DB read error: {e}")
+            return 0
+        due = expiry.pop_due(now, self.max_active or None)
+        if not due:
+            return 0
+        # Another Defense (the hourly sweep in stream mode) may have lifted or renewed some of them
+        try:
+            with self.storage.read(self.db_path) as conn:
+                current = dict(select_in(
+                    conn.cursor(), "SELECT ip, expires_at FROM blocked_ips WHERE status = 'blocked' AND ip IN ({})",
+                    [ip for ip, _ in due]
+                ))
+        except Exception as e:
+            self.logger.error(f"Defense DB read error: {e}")
+            for ip, _ in due:
+                expiry.schedule(ip, now + self.retry)
+            return 0
+        targets = {}
+        for ip, expires_at in due:
+            recorded = current.get(ip)
+            if recorded == expires_at:
+                targets[ip] = expires_at
+            elif recorded is not None:
+                expiry.schedule(ip, recorded)
+
+        removed, failed = self.backend.unblock(targets)
+        for ip in failed:
+            expiry.schedule(ip, now + self.retry)
+        try:
+            # Guarded by the expiry, so a block renewed in the meantime is kept
+            self.storage.executemany(self.db_path, "DELETE FROM blocked_ips WHERE ip = ? AND expires_at = ?",
+                                     [(ip, targets[ip]) for ip in removed]).result()
+        except Exception as e:
+            self.logger.error(f"Error removing {len(removed)} expired block(s): {e}")
+        self.metrics.inc("ips_expired_total", len(removed))
+        self.metrics.set("blocks_scheduled", len(expiry))
+        if failed:
+            self.logger.error(f"Failed to lift {len(failed)} expired block(s), retrying in {self.retry}s")
+        self.logger.info(f"Defense: Lifted {len(removed)} expired block(s) via {self.backend.name}")
+        return len(removed)
+
+    def _plan_blocks(self, ips_to_block):
+        """Decides which addresses and prefixes to enforce for the new attack IPs.
+
+        Returns (targets, members, replaces): firewall targets, {prefix: IPs to record under
+        it} and {new prefix: individual IPs and narrower prefixes it makes redundant}.
+        """
+        if self.aggregator is None:
+            return set(ips_to_block), {}, {}
+
+        active = None
+        if self.blocklist is not None:
+            covering = self.blocklist.covering
+        else:
+            active = self.get_blocked_prefixes()
+            index = index_prefixes(active)
+            covering = lambda ip: covering_prefix(index, ip)
+        members = defaultdict(set)
+        singles = set()
+        for ip in ips_to_block:
+            prefix = covering(ip)
+            if prefix is not None:
+                members[prefix].add(ip)  # Already enforced by an existing prefix
+            else:
+                singles.add(ip)
+        if not singles:
+            return set(), members, {}
+        if active is None:
+            # Prefix members are only needed to aggregate, so the index does not hold them
+            active = self.get_blocked_prefixes()
+
+        individually_blocked = self.get_individually_blocked_ips()
+        candidates = singles | individually_blocked
+        for prefix_members in active.values():
+            candidates |= prefix_members
+
+        targets = set()
+        replaces = {}
+        covered = set()
+        for prefix, prefix_members in self.aggregator.aggregate(candidates).items():
+            if prefix in active or not prefix_members & singles:
+                continue
+            network = ipaddress.ip_network(prefix)
+            targets.add(prefix)
+            members[prefix] |= prefix_members
+            covered |= prefix_members
+            replaces[prefix] = (prefix_members & individually_blocked) | {
+                other for other in active
+                if ipaddress.ip_network(other).version == network.version and ipaddress.ip_network(other).subnet_of(network)
+            }
+        targets |= singles - covered
+        return targets, members, replaces
+
+    def record_prefixes(self, members, superseded):
+        """Records prefix blocks, their member IPs and what they replaced in one write."""
+        def write(conn):
+            for prefix, ips in members.items():
+                conn.execute("""
+                    INSERT INTO blocked_prefixes (prefix, status) VALUES (?, 'blocked')
+                    ON CONFLICT(prefix) DO UPDATE SET status='blocked'
+                """, (prefix,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO prefix_members (prefix, ip) VALUES (?, ?)",
+                    ((prefix, ip) for ip in ips)
+                )
+                conn.executemany("""
+                    INSERT INTO blocked_ips (ip, status) VALUES (?, 'covered')
+                    ON CONFLICT(ip) DO UPDATE SET status='covered'
+                """, ((ip,) for ip in ips))
+            conn.executemany(
+                "UPDATE blocked_prefixes SET status = 'superseded' WHERE prefix = ?",
+                ((target,) for target in superseded if "/" in target)
+            )
+        try:
+            self.storage.run(self.db_path, write)
+        except Exception as e:
+            self.logger.error(f"Error recording {len(members)} blocked prefix(es): {e}")
+
+    def record_latency(self, ips):
+        """Observes the time from when each newly enforced IP's first event was ingested until now.
+
+        first_seen is stamped when a parser stores the event, not taken from the log line, so
+        this measures this process's reaction time and leaves out any delay before ingestion."""
+        now = time.time()
+        try:
+            with self.storage.read(self.analysis_db) as conn:
+                rows = select_in(conn.cursor(), "SELECT first_seen FROM threat_summary WHERE ip IN ({})", ips)
+        except Exception as e:
+            self.logger.error(f"Analyzer DB read error: {e}")
+            return
+        for (first_seen,) in rows:
+            if first_seen is not None:
+                self.metrics.observe("ingest_to_block_seconds", max(0.0, now - first_seen))
+
+    def defend(self, ips=None):
+        """Blocks IPs promoted to attack since the last run, or only the given ips when streaming."""
+        with self.lock:
+            self._defend(ips)
+
+    def _defend(self, ips):
+        started = time.perf_counter()
+        try:
+            if self.durations is not None:
+                # Lifted first, so an offender whose block just ran out is judged on this run's activity
+                self._expire(time.time())
+            self.sync_blocklist()
+            watermark = None
+            if ips is None:
+                since = self.get_watermark()
+                attack_ips, watermark = self.get_promoted_ips(since)
+                blocked_ips = self.get_blocked_ips(attack_ips)
+            else:
+                attack_ips = self.get_attack_ips(ips)
+                blocked_ips = self.get_blocked_ips(ips)
             
             # IPs to block = attack IPs - already blocked IPs
             ips_to_block = attack_ips - blocked_ips
             
             if not ips_to_block:
                 self.logger.info("No new IPs to block")
+                if watermark is not None:
+                    self.save_watermark(watermark)
                 return
             
-            for ip in ips_to_block:
-                if self.block_ip(ip):
-                    self.record_blocked_ip(ip, "blocked")
-                    self.logger.info(f"IP {ip} blocked and recorded")
-                else:
-                    self.record_blocked_ip(ip, "block_failed")
-                    self.logger.error(f"Failed to block IP {ip}")
+            targets, members, replaces = self._plan_blocks(ips_to_block)
+
+            # One batch per cycle: a single set update for ipset/nft, one rule per IP for ufw.
+            # Rules a new prefix makes redundant are swapped out in the same batch.
+            blocked, failed = self.backend.block(targets, replaces)
+            failed_prefixes = {target for target in failed if target in members}
+            if failed_prefixes:
+                # Fall back to blocking the new addresses of a prefix that could not be enforced
+                retry = set().union(*(members.pop(prefix) for prefix in failed_prefixes)) & ips_to_block
+                retried, retry_failed = self.backend.block(retry)
+                blocked |= retried
+                failed = (failed - failed_prefixes) | retry_failed
+
+            rows = [(ip, "blocked") for ip in blocked if ip not in members]
+            expiries = None
+            if self.durations is not None and rows:
+                expiries = self.plan_expiries([ip for ip, _ in rows], time.time())
+            rows += [(ip, "block_failed") for ip in failed]
+            self.record_blocked_ips(rows, expiries)
+            if expiries:
+                expiry = self._load_expiry()
+                for ip, (_, expires_at) in expiries.items():
+                    if expires_at is not None:
+                        expiry.schedule(ip, expires_at)
+                self.metrics.set("blocks_scheduled", len(expiry))
+            if members:
+                superseded = set().union(*(replaces[prefix] for prefix in replaces if prefix in blocked))
+                self.record_prefixes(members, superseded)
+            if failed:
+                self.logger.error(f"Failed to block {len(failed)} IP(s): {', '.join(sorted(failed)[:20])}")
+            if watermark is not None:
+                self.save_watermark(watermark)
             
-            self.logger.info(f"Defense: Blocked {len(ips_to_block)} new IP(s)")
+            prefix_count = len([target for target in blocked if target in members])
+            self.metrics.inc("ips_blocked_total", len(blocked) - prefix_count, kind="ip")
+            self.metrics.inc("ips_blocked_total", prefix_count, kind="prefix")
+            self.metrics.inc("block_failures_total", len(failed))
+            enforced = {ip for ip in blocked if ip not in members}
+            enforced |= set().union(*(members[target] for target in blocked if target in members))
+            self.record_latency(enforced & ips_to_block)
+            self.logger.info(
+                f"Defense: Blocked {len(ips_to_block)} new IP(s) with {len(blocked)} rule(s) "
+                f"({prefix_count} prefix(es)) via {self.backend.name}"
+            )
         except Exception as e:
             self.logger.error(f"Defense system error: {e}")
+        finally:
+            self.metrics.observe("defense_seconds", time.perf_counter() - started)
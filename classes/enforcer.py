@@ -0,0 +1,265 @@
+import ipaddress
+import shutil
+import subprocess
+
+def split_families(targets):
+    """Splits addresses and CIDR prefixes into IPv4, IPv6 and unparseable lists."""
+    ipv4, ipv6, invalid = [], [], []
+    for target in targets:
+        try:
+            network = ipaddress.ip_network(target, strict=False)
+        except ValueError:
+            invalid.append(target)
+            continue
+        member = str(network) if network.num_addresses > 1 else str(network.network_address)
+        (ipv4 if network.version == 4 else ipv6).append(member)
+    return ipv4, ipv6, invalid
+
+class UfwBackend:
+    """One `ufw deny from` rule per address; slow for large waves but needs nothing beyond ufw."""
+
+    name = "ufw"
+
+    def __init__(self, config, logger):
+        self.logger = logger
+        self.ufw = config.get("ufw_path", "ufw")
+
+    def ensure(self):
+        if shutil.which(self.ufw) is None:
+            raise OSError(f"{self.ufw} not found")
+
+    def load(self, targets):
+        # ufw saves its rules itself, so they are still in place after a reboot
+        return set(targets), set()
+
+    def _run(self, args, target):
+        try:
+            result = subprocess.run([self.ufw] + args, stdin=subprocess.DEVNULL, capture_output=True, text=True, check=False)
+            if result.returncode == 0:
+                return True
+            self.logger.error(f"Failed to {args[0]} {target}: {result.stderr}")
+        except Exception as e:
+            self.logger.error(f"Error executing UFW command for {target}: {e}")
+        return False
+
+    def block(self, targets, replaces=None):
+        blocked, failed = set(), set()
+        for target in targets:
+            if self._run(["deny", "from", target], target):
+                self.logger.info(f"UFW rule added: deny from {target}")
+                blocked.add(target)
+            else:
+                failed.add(target)
+        # Rules are independent here, so only drop what a successfully added prefix replaces
+        redundant = set()
+        for prefix, replaced in (replaces or {}).items():
+            if prefix in blocked:
+                redundant |= replaced
+        self.unblock(redundant)
+        return blocked, failed
+
+    def unblock(self, targets):
+        removed, failed = set(), set()
+        for target in targets:
+            (removed if self._run(["delete", "deny", "from", target], target) else failed).add(target)
+        return removed, failed
+
+class IpsetBackend:
+    """Members of two hash:net ipsets (IPv4 and IPv6) matched by one iptables/ip6tables DROP rule each.
+
+    Every change is fed to a single `ipset restore` call per cycle.
+    """
+
+    name = "ipset"
+
+    def __init__(self, config, logger):
+        self.logger = logger
+        self.ipset = config.get("ipset_path", "ipset")
+        self.iptables = config.get("iptables_path", "iptables")
+        self.ip6tables = config.get("ip6tables_path", "ip6tables")
+        self.set_name = config.get("set_name", "perfect_trio")
+
+    def _sets(self):
+        return ((self.set_name, "inet", self.iptables), (f"{self.set_name}6", "inet6", self.ip6tables))
+
+    def ensure(self):
+        for tool in (self.ipset, self.iptables):
+            if shutil.which(tool) is None:
+                raise OSError(f"{tool} not found")
+        script = "".join(f"create {name} hash:net family {family} -exist\n" for name, family, _ in self._sets())
+        self._restore(script)
+        for name, _, iptables in self._sets():
+            if shutil.which(iptables) is None:
+                continue
+            rule = ["INPUT", "-m", "set", "--match-set", name, "src", "-j", "DROP"]
+            check = subprocess.run([iptables, "-C"] + rule, stdin=subprocess.DEVNULL, capture_output=True, check=False)
+            if check.returncode != 0:
+                subprocess.run([iptables, "-I"] + rule, stdin=subprocess.DEVNULL, capture_output=True, check=True)
+
+    def load(self, targets):
+        """Replaces the sets' members with targets, as recorded in defense.db; kernel sets do not survive a reboot."""
+        targets = set(targets)
+        script, invalid = self._lines("add", targets)
+        script = "".join(f"flush {name}\n" for name, _, _ in self._sets()) + script
+        try:
+            self._restore(script)
+            return targets - set(invalid), set(invalid)
+        except Exception as e:
+            self.logger.error(f"ipset reload of {len(targets)} address(es) failed: {e}")
+            return set(), targets
+
+    def _restore(self, script):
+        result = subprocess.run([self.ipset, "restore", "-exist"], input=script, capture_output=True, text=True, check=False)
+        if result.returncode != 0:
+            raise OSError(f"ipset restore failed: {result.stderr.strip()}")
+
+    def _lines(self, action, targets):
+        ipv4, ipv6, invalid = split_families(targets)
+        (name4, _, _), (name6, _, _) = self._sets()
+        script = "".join(f"{action} {name4} {target}\n" for target in ipv4)
+        script += "".join(f"{action} {name6} {target}\n" for target in ipv6)
+        return script, invalid
+
+    def _apply(self, action, targets, replaces=None):
+        targets = set(targets)
+        if not targets:
+            return set(), set()
+        script, invalid = self._lines(action, targets)
+        if replaces:
+            removed, _ = self._lines("del", set().union(*replaces.values()))
+            script = removed + script
+        try:
+            # With -exist, deleting a member that is already gone is not an error
+            self._restore(script)
+            return targets - set(invalid), set(invalid)
+        except Exception as e:
+            self.logger.error(f"ipset {action} of {len(targets)} address(es) failed: {e}")
+            return set(), targets
+
+    def block(self, targets, replaces=None):
+        return self._apply("add", targets, replaces)
+
+    def unblock(self, targets):
+        return self._apply("del", targets)
+
+class NftBackend:
+    """Members of nftables interval sets in a dedicated table, changed in one atomic `nft -f -` transaction."""
+
+    name = "nft"
+
+    def __init__(self, config, logger):
+        self.logger = logger
+        self.nft = config.get("nft_path", "nft")
+        self.table = config.get("set_name", "perfect_trio")
+
+    def ensure(self):
+        if shutil.which(self.nft) is None:
+            raise OSError(f"{self.nft} not found")
+        # The chain belongs to us alone, so it is safe to flush and re-create its two rules
+        self._run(f"""
+add table inet {self.table}
+add set inet {self.table} blocked4 {{ type ipv4_addr; flags interval; }}
+add set inet {self.table} blocked6 {{ type ipv6_addr; flags interval; }}
+add chain inet {self.table} input {{ type filter hook input priority -10; policy accept; }}
+flush chain inet {self.table} input
+add rule inet {self.table} input ip saddr @blocked4 drop
+add rule inet {self.table} input ip6 saddr @blocked6 drop
+""")
+
+    def load(self, targets):
+        """Replaces the sets' members with targets, as recorded in defense.db; kernel sets do not survive a reboot."""
+        targets = set(targets)
+        script, invalid = self._lines("add", targets)
+        script = f"flush set inet {self.table} blocked4\nflush set inet {self.table} blocked6\n" + script
+        try:
+            self._run(script)
+            return targets - set(invalid), set(invalid)
+        except Exception as e:
+            self.logger.error(f"nft reload of {len(targets)} address(es) failed: {e}")
+            return set(), targets
+
+    def _run(self, script):
+        result = subprocess.run([self.nft, "-f", "-"], input=script, capture_output=True, text=True, check=False)
+        if result.returncode != 0:
+            raise OSError(f"nft failed: {result.stderr.strip()}")
+
+    def _lines(self, action, targets):
+        ipv4, ipv6, invalid = split_families(targets)
+        script = ""
+        for set_name, members in (("blocked4", ipv4), ("blocked6", ipv6)):
+            if members:
+                script += f"{action} element inet {self.table} {set_name} {{ {', '.join(members)} }}\n"
+        return script, invalid
+
+    def _delete_each(self, targets):
+        """Deletes targets one transaction at a time; a member that is already gone counts as removed."""
+        removed, failed = set(), set()
+        for target in targets:
+            script, _ = self._lines("delete", [target])
+            try:
+                self._run(script)
+            except OSError as e:
+                if "No such file or directory" not in str(e):
+                    self.logger.error(f"nft delete of {target} failed: {e}")
+                    failed.add(target)
+                    continue
+            removed.add(target)
+        return removed, failed
+
+    def _apply(self, action, targets, replaces=None):
+        targets = set(targets)
+        if not targets:
+            return set(), set()
+        script, invalid = self._lines(action, targets)
+        replaced = set().union(*replaces.values()) if replaces else set()
+        if replaced:
+            # Interval elements may not overlap, so what a prefix replaces is removed in the same transaction
+            removed, _ = self._lines("delete", replaced)
+            script = removed + script
+        try:
+            if script:
+                self._run(script)
+            return targets - set(invalid), set(invalid)
+        except Exception as e:
+            if action != "delete" and not replaced:
+                self.logger.error(f"nft {action} of {len(targets)} address(es) failed: {e}")
+                return set(), targets
+        # One missing member aborts the whole transaction, so the deletes are retried one by one
+        # and members already gone are skipped
+        valid = targets - set(invalid)
+        if action == "delete":
+            removed, failed = self._delete_each(valid)
+            return removed, failed | set(invalid)
+        self._delete_each(replaced)
+        script, _ = self._lines(action, valid)
+        try:
+            self._run(script)
+            return valid, set(invalid)
+        except Exception as e:
+            self.logger.error(f"nft {action} of {len(targets)} address(es) failed: {e}")
+            return set(), targets
+
+    def block(self, targets, replaces=None):
+        """Adds targets; replaces maps new prefixes to the members and prefixes they make redundant."""
+        return self._apply("add", targets, replaces)
+
+    def unblock(self, targets):
+        return self._apply("delete", targets)
+
+BACKENDS = {"nft": NftBackend, "ipset": IpsetBackend, "ufw": UfwBackend}
+
+def get_backend(config, logger):
+    """Returns the configured enforcement backend ("auto" tries nft, then ipset), falling back to ufw."""
+    wanted = config.get("backend", "auto")
+    if wanted != "auto" and wanted not in BACKENDS:
+        raise ValueError(f"Unknown defense.backend {wanted!r}: expected auto, {', '.join(BACKENDS)}")
+    names = ["nft", "ipset", "ufw"] if wanted == "auto" else [wanted, "ufw"]
+    for name in names:
+        backend = BACKENDS[name](config, logger)
+        try:
+            backend.ensure()
+            return backend
+        except Exception as e:
+            if name == wanted:
+                logger.error(f"Enforcement backend {name} unavailable, falling back: {e}")
+    return backend
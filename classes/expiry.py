@@ -0,0 +1,52 @@
+import heapq
+import threading
+
+class ExpiryScheduler:
+    """Temporary blocks in a min-heap ordered by expiry time.
+
+    Rescheduling or cancelling a target leaves its old entry in the heap; entries that no
+    longer match the target's current expiry are dropped when they reach the top, and the
+    heap is rebuilt once such leftovers outnumber the live entries.
+    """
+
+    def __init__(self, entries=()):
+        self.expires = dict(entries)  # target -> current expiry
+        self.heap = [(expires_at, target) for target, expires_at in self.expires.items()]
+        heapq.heapify(self.heap)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.expires)
+
+    def schedule(self, target, expires_at):
+        with self.lock:
+            self.expires[target] = expires_at
+            heapq.heappush(self.heap, (expires_at, target))
+            if len(self.heap) > 2 * len(self.expires) + 1024:
+                self.heap = [(when, key) for key, when in self.expires.items()]
+                heapq.heapify(self.heap)
+
+    def cancel(self, target):
+        with self.lock:
+            self.expires.pop(target, None)
+
+    def pop_due(self, now, keep=None):
+        """Removes and returns (target, expiry) for everything due at now.
+
+        With keep set, the soonest-expiring targets beyond that many are returned as well, so
+        the number of scheduled blocks never exceeds it after a tick.
+        """
+        due = []
+        with self.lock:
+            heap = self.heap
+            while heap:
+                expires_at, target = heap[0]
+                if self.expires.get(target) != expires_at:
+                    heapq.heappop(heap)
+                    continue
+                if expires_at > now and (not keep or len(self.expires) <= keep):
+                    break
+                heapq.heappop(heap)
+                del self.expires[target]
+                due.append((target, expires_at))
+        return due
@@ -1,14 +1,34 @@
 import os
-import re
-import sqlite3
-import json
 import sys
-from collections import Counter
+import time
+from classes.dbutil import backfill_last_updated, changed_ips, ensure_column, select_in
+from classes.lineparser import count_snort, parse_snort, parse_suricata, text_blocks
+from classes.logger import Logger
+from classes.metrics import get_metrics
+from classes.parallel import ParallelScanner
+from classes.ratewindow import RateWindow, parse_timestamp
+from classes.sketch import finish_counts, new_counter
+from classes.snapshot import get_snapshots
+from classes.storage import get_storage
+from classes.tailer import Tailer
 
 class IDS_IPS:
     def __init__(self, config):
         self.log_path = config.get("log_path")
         self.threshold = config.get("threshold")
+        # With a rate configured, IPs are flagged by events per time window instead of a lifetime count
+        self.rate = RateWindow(config["rate"]) if config.get("rate", {}).get("enabled") else None
+        self.snapshots = get_snapshots()
+        if self.rate is not None:
+            self.snapshots.restore("rate:ids_ips", self.rate.restore)
+        self.flagged = set()
+        self.lines_matched = 0  # Of the last parse, for lines_matched_total
+        # Under floods of spoofed sources, a sketch bounds memory to its capacity and keeps the top_k
+        self.sketch = config.get("sketch", {})
+        self.logger = Logger()
+        self.metrics = get_metrics()
+        parallel = config.get("parallel", {})
+        self.parallel = ParallelScanner(parallel, self.logger) if parallel.get("enabled") else None
         self.ids_type = config.get("type", "snort").lower()  # "snort" or "suricata"
         
         if getattr(sys, 'frozen', False):
@@ -17,115 +37,174 @@ class IDS_IPS:
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             
         db_root = os.path.join(base_dir, "db")
-        self.db_path = os.path.join(db_root, "ids_ips_data.db")
+        self.db_path = config.get("db_path", os.path.join(db_root, "ids_ips_data.db"))
+        self.storage = get_storage()
         self._ensure_folder(db_root)
         self._init_db()
+        self.tailer = Tailer("ids_ips", self.log_path, self.db_path)
 
     def _ensure_folder(self, folder):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
     def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS ids_ips_alerts (
-                    ip TEXT PRIMARY KEY,
-                    count INTEGER,
-                    ids_type TEXT,
-                    classification TEXT,
-                    protocol TEXT,
-                    status TEXT
-                )
-            """)
-
-    def parse_snort_alerts(self):
-        ip_counter = Counter()
+        self.storage.run(self.db_path, self._create_tables)
+
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ids_ips_alerts (
+                ip TEXT PRIMARY KEY,
+                count INTEGER,
+                ids_type TEXT,
+                classification TEXT,
+                protocol TEXT,
+                status TEXT,
+                last_updated REAL,
+                signature_id INTEGER,
+                severity INTEGER,
+                dest_port INTEGER,
+                first_seen REAL
+            )
+        """)
+        for column, declaration in (("last_updated", "REAL"), ("signature_id", "INTEGER"),
+                                    ("severity", "INTEGER"), ("dest_port", "INTEGER"), ("first_seen", "REAL")):
+            ensure_column(conn, "ids_ips_alerts", column, declaration)
+        conn.execute("CREATE INDEX IF NOT EXISTS ids_ips_alerts_last_updated ON ids_ips_alerts (last_updated)")
+        backfill_last_updated(conn, "ids_ips_alerts")
+
+    def parse_snort_alerts(self, lines=None):
+        ip_counter = new_counter(self.sketch)
+        self.flagged = set()
+        self.lines_matched = 0
         details = {}
 
-        if not os.path.isfile(self.log_path):
-            return {}, {}
-
-        with open(self.log_path, "r") as file:
-            for line in file:
-                class_match = re.search(r"\[Classification: (.*?)\]", line)
-                proto_match = re.search(r"\{(\w+)\}", line)
-                src_match = re.search(r"\{.*?\}\s+(\d{1,3}(?:\.\d{1,3}){3}):\d+\s+->", line)
-
-                if class_match and proto_match and src_match:
-                    classification = class_match.group(1).strip()
-                    protocol = proto_match.group(1).strip()
-                    ip = src_match.group(1)
+        if lines is None:
+            if not os.path.isfile(self.log_path):
+                return {}, {}
+
+            scanned = self._scan_parallel("snort")
+            if scanned is not None:
+                self.lines_matched = scanned[2]
+                return dict(scanned[0]), scanned[1]
+
+        if self.rate is None:
+            # One findall per block; see count_snort
+            blocks = self.tailer.read_blocks() if lines is None else text_blocks(lines)
+            for text in blocks:
+                self.lines_matched += count_snort(text, ip_counter, details)
+                # Only a sketch drops counters, so this never fires for a plain Counter
+                if len(details) > 2 * len(ip_counter):
+                    details = {key: value for key, value in details.items() if key in ip_counter}
+        else:
+            # Rate windows need every alert's own timestamp, so these are matched line by line
+            for line in lines if lines is not None else self.tailer.read_lines():
+                alert = parse_snort(line)
+                if alert is not None:
+                    classification, protocol, ip = alert
 
                     ip_counter[ip] += 1
+                    self.lines_matched += 1
+                    if self.rate.add(ip, parse_timestamp(line)):
+                        self.flagged.add(ip)
                     if ip not in details:
                         details[ip] = {
                             "classification": classification,
                             "protocol": protocol
                         }
+                        # Only a sketch drops counters, so this never fires for a plain Counter
+                        if len(details) > 2 * len(ip_counter):
+                            details = {key: value for key, value in details.items() if key in ip_counter}
 
-        return dict(ip_counter), details
+        return finish_counts(ip_counter, details, self.logger, "IDS/IPS")
 
-    def parse_suricata_alerts(self):
-        ip_counter = Counter()
+    def parse_suricata_alerts(self, lines=None):
+        ip_counter = new_counter(self.sketch)
+        self.flagged = set()
+        self.lines_matched = 0
         details = {}
 
-        if not os.path.isfile(self.log_path):
-            return {}, {}
-
-        with open(self.log_path, "r") as file:
-            for line in file:
-                # Suricata EVE JSON format parsing (common format)
-                try:
-                    # Try to parse JSON (Suricata EVE format)
-                    record = json.loads(line.strip())
-                    if "alert" in record and "src_ip" in record:
-                        ip = record["src_ip"]
-                        classification = record.get("alert", {}).get("category", "Unknown")
-                        protocol = record.get("proto", "Unknown")
-
-                        ip_counter[ip] += 1
-                        if ip not in details:
-                            details[ip] = {
-                                "classification": classification,
-                                "protocol": protocol
-                            }
-                except (json.JSONDecodeError, KeyError):
-                    # Fallback to text parsing for non-JSON format
-                    src_match = re.search(r"\[(\d{1,3}(?:\.\d{1,3}){3})\]", line)
-                    class_match = re.search(r"\[Classification: (.*?)\]", line)
-                    proto_match = re.search(r"\{(\w+)\}", line)
-
-                    if src_match:
-                        ip = src_match.group(1)
-                        classification = class_match.group(1).strip() if class_match else "Unknown"
-                        protocol = proto_match.group(1).strip() if proto_match else "Unknown"
-
-                        ip_counter[ip] += 1
-                        if ip not in details:
-                            details[ip] = {
-                                "classification": classification,
-                                "protocol": protocol
-                            }
-
-        return dict(ip_counter), details
-
-    def parse_alerts(self):
+        if lines is None:
+            if not os.path.isfile(self.log_path):
+                return {}, {}
+
+            scanned = self._scan_parallel("suricata")
+            if scanned is not None:
+                self.lines_matched = scanned[2]
+                return dict(scanned[0]), scanned[1]
+            lines = self.tailer.read_lines()
+
+        for line in lines:
+            alert = parse_suricata(line)
+            if alert is not None:
+                ip = alert.src
+                ip_counter[ip] += 1
+                self.lines_matched += 1
+                if self.rate is not None and self.rate.add(ip, parse_timestamp(alert.timestamp)):
+                    self.flagged.add(ip)
+                if ip not in details:
+                    details[ip] = {
+                        "classification": alert.classification,
+                        "protocol": alert.proto,
+                        "signature_id": alert.signature_id,
+                        "severity": alert.severity,
+                        "dest_port": alert.dest_port
+                    }
+                    if len(details) > 2 * len(ip_counter):
+                        details = {key: value for key, value in details.items() if key in ip_counter}
+
+        return finish_counts(ip_counter, details, self.logger, "IDS/IPS")
+
+    def parse_alerts(self, lines=None):
         if self.ids_type == "suricata":
-            return self.parse_suricata_alerts()
+            return self.parse_suricata_alerts(lines)
         else:  # default to snort
-            return self.parse_snort_alerts()
-
-    def store_to_db(self):
-        ip_counts, details = self.parse_alerts()
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            for ip, count in ip_counts.items():
-                classification = details[ip]["classification"]
-                protocol = details[ip]["protocol"]
-                status = "attack" if count > self.threshold else "normal"
-                cursor.execute("""
-                    INSERT INTO ids_ips_alerts (ip, count, ids_type, classification, protocol, status)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(ip) DO UPDATE SET count=excluded.count, ids_type=excluded.ids_type, classification=excluded.classification, protocol=excluded.protocol, status=excluded.status
-                """, (ip, count, self.ids_type, classification, protocol, status))
-            conn.commit()
+            return self.parse_snort_alerts(lines)
+
+    def _scan_parallel(self, kind):
+        # Rate windows and sketches depend on seeing the lines in order, so they stay sequential
+        if self.parallel is None or self.rate is not None or self.sketch.get("enabled"):
+            return None
+        return self.parallel.scan(kind, self.tailer)
+
+    def _status(self, ip, count, threshold):
+        if ip in self.flagged or (threshold is not None and count > threshold):
+            return "attack"
+        return "normal"
+
+    def store_to_db(self, lines=None, checkpoint=None):
+        """Upserts the new counts and returns the IPs that are new or just crossed the threshold.
+
+        Replay passes historical lines and its own checkpoint in place of the tailer's."""
+        started = time.perf_counter()
+        ip_counts, details = self.parse_alerts(lines)
+        parsed = time.perf_counter()
+        checkpoint = checkpoint or self.tailer
+        changed = self.storage.run(self.db_path, lambda conn: self._upsert(conn, ip_counts, details, checkpoint))
+        self.metrics.record_batch("ids_ips", checkpoint, self.lines_matched, parsed - started, time.perf_counter() - parsed)
+        if self.rate is not None:
+            # Taken once the checkpoint is stored, so a restored window never counts lines read again
+            self.snapshots.offer("rate:ids_ips", self.rate.state)
+        return changed
+
+    def _upsert(self, conn, ip_counts, details, checkpoint):
+        # Stamped on the writer thread, so timestamps follow commit order for the Analyzer watermark
+        now = time.time()
+        threshold = None if self.rate is not None else self.threshold
+        cursor = conn.cursor()
+        previous = dict(select_in(cursor, "SELECT ip, count FROM ids_ips_alerts WHERE ip IN ({})", ip_counts))
+        cursor.executemany("""
+            INSERT INTO ids_ips_alerts (ip, count, ids_type, classification, protocol, signature_id, severity,
+                dest_port, status, last_updated, first_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ip) DO UPDATE SET count=ids_ips_alerts.count + excluded.count, ids_type=excluded.ids_type,
+                status=CASE WHEN ids_ips_alerts.status = 'attack' OR excluded.status = 'attack'
+                    OR ids_ips_alerts.count + excluded.count > ? THEN 'attack' ELSE 'normal' END,
+                last_updated=excluded.last_updated
+        """, [
+            (ip, count, self.ids_type, details[ip]["classification"], details[ip]["protocol"],
+             details[ip].get("signature_id"), details[ip].get("severity"), details[ip].get("dest_port"),
+             self._status(ip, count, threshold), now, now, threshold)
+            for ip, count in ip_counts.items()
+        ])
+        checkpoint.save_checkpoint(conn)
+        return changed_ips(previous, ip_counts, threshold, self.flagged)
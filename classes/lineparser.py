@@ -0,0 +1,272 @@
+import json
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+from itertools import islice
+
+UfwRecord = namedtuple("UfwRecord", "iface src dst length ttl proto spt dpt")
+SnortAlert = namedtuple("SnortAlert", "classification proto src")
+
+# The kernel logs netfilter fields in a fixed order (IN OUT [MAC] SRC DST LEN, then TOS PREC TTL
+# for IPv4 or TC HOPLIMIT for IPv6, ..., PROTO SPT DPT), so one unrolled pattern reads them all in
+# a single left-to-right pass without backtracking between the anchors.
+UFW_LINE = re.compile(
+    r" IN=(\S*) [^S]*(?:S(?!RC=)[^S]*)*SRC=(\S+) DST=(\S+) LEN=(\d+) "
+    r"(?:TOS=\S+ PREC=\S+ TTL=(\d+) |TC=\S+ HOPLIMIT=(\d+) )?"
+    r"[^P]*(?:P(?!ROTO=)[^P]*)*PROTO=(\w+)(?: SPT=(\d+) DPT=(\d+))?"
+)
+UFW_FIELD = {key: re.compile(rf"\b{key}=(\S+)") for key in ("IN", "SRC", "DST", "LEN", "TTL", "PROTO", "SPT", "DPT")}
+
+# Neither pattern crosses a newline, so each also finds every alert or SRC in a block of lines
+SNORT_ALERT = re.compile(
+    r"\[Classification: ([^\]\n]*)\][^{\n]*\{(\w+)\}[ \t]+(\d{1,3}(?:\.\d{1,3}){3}):\d+[ \t]+->"
+)
+# SNORT_ALERT with only the source captured, for counting
+SNORT_SOURCE = re.compile(
+    r"\[Classification: [^\]\n]*\][^{\n]*\{\w+\}[ \t]+(\d{1,3}(?:\.\d{1,3}){3}):\d+[ \t]+->"
+)
+UFW_SOURCE = re.compile(r" SRC=(\S+)")
+# Lines joined into one text per block pass
+BATCH_LINES = 65536
+
+# sshd and PAM authentication events. One pass of AUTH_MESSAGE over a block of lines finds
+# every event as the syslog message ("...sshd[pid]: <message>") up to its last " port N", or
+# the whole message for PAM, which has no port. Without the port, the same attacker trying the
+# same user repeats one key, so the block's keys are counted in C and only the distinct ones
+# are parsed, by parse_auth_message.
+AUTH_MESSAGE = re.compile(
+    r"\]: ("
+    r"(?:Failed |Invalid user |Connection closed by |Disconnected from |error: maximum authentication attempts "
+    r"|Accepted |message repeated )[^\n]*(?= port \d)"
+    r"|(?:pam_unix\(sshd:auth\): authentication failure;|PAM \d+ more authentication failures;)[^\n]*"
+    r")"
+)
+# First four characters of a message -> event
+AUTH_EVENTS = {
+    "Fail": "failed_password",
+    "Inva": "invalid_user",
+    "Conn": "preauth_closed",
+    "Disc": "preauth_closed",
+    "erro": "max_attempts",
+    "pam_": "pam_failure",
+    "PAM ": "pam_failure",
+    "Acce": "accepted",
+}
+AUTH_PREFIXES = {
+    "failed_password": ("Failed ",),
+    "invalid_user": ("Invalid user ",),
+    "preauth_closed": ("Connection closed by authenticating user ", "Connection closed by invalid user ",
+                       "Disconnected from authenticating user ", "Disconnected from invalid user "),
+    "max_attempts": ("error: maximum authentication attempts exceeded for ",),
+    "pam_failure": ("pam_unix(sshd:auth): authentication failure;", "PAM "),
+    "accepted": ("Accepted ",),
+}
+REPEATED = "message repeated "
+IP_CHARS = "0123456789.:abcdefABCDEF"
+
+@lru_cache(maxsize=65536)
+def parse_auth_message(message):
+    """(event, ip, user, times) for a message found by AUTH_MESSAGE, or None.
+
+    times is more than 1 for "message repeated N times" and "PAM N more authentication failures";
+    user is None when the message does not name one. The address is the last one before the
+    port, so a username containing " from <address>" cannot stand in for the real source.
+    """
+    times = 1
+    if message.startswith(REPEATED):
+        end = message.find(" ", 17)
+        inner = message.find("[ ", end)
+        if inner < 0 or not message[17:end].isdigit():
+            return None
+        times, message = int(message[17:end]), message[inner + 2:]
+    event = AUTH_EVENTS.get(message[:4])
+    if event is None:
+        return None
+    for prefix in AUTH_PREFIXES[event]:
+        if message.startswith(prefix):
+            break
+    else:
+        return None
+    body = len(prefix)
+
+    if event == "pam_failure":
+        if prefix == "PAM ":
+            end = message.find(" more authentication failures;", body)
+            if end < 0 or not message[body:end].isdigit():
+                return None
+            times *= int(message[body:end])
+        rhost = message.find(" rhost=", body)
+        if rhost < 0:
+            return None
+        fields = message[rhost + 7:].split()
+        if not fields:
+            return None
+        ip = fields[0]
+        user = fields[1][5:] if len(fields) > 1 and fields[1].startswith("user=") else None
+    elif event == "preauth_closed":
+        gap = message.rfind(" ")
+        if gap < body:
+            return None
+        ip, user = message[gap + 1:], message[body:gap]
+    else:
+        source = message.rfind(" from ", body)
+        if source < 0:
+            return None
+        ip = message[source + 6:]
+        if event != "invalid_user" and event != "max_attempts":
+            # "Failed password for ..." / "Accepted publickey for ..."
+            body = message.find(" for ", body, source)
+            if body < 0:
+                return None
+            body += 5
+        user = message[body:source]
+        if event != "invalid_user" and user.startswith("invalid user "):
+            user = user[13:]
+    if not ip or ip.strip(IP_CHARS):
+        return None
+    return event, ip, user, times
+
+def add_username(users, user, count, max_users):
+    """Adds count tries of user to {username: count}, keeping the max_users smallest names.
+
+    The kept names do not depend on the order they are seen in, so sequential and parallel
+    scans, and ranges merged in any order, keep the same names with the same counts.
+    """
+    if user in users or len(users) < max_users:
+        users[user] = users.get(user, 0) + count
+        return
+    if not max_users:
+        return
+    largest = max(users)
+    if user < largest:
+        del users[largest]
+        users[user] = count
+
+def count_auth_message(message, n, counts, details, weights, max_users):
+    """Adds n occurrences of an AUTH_MESSAGE key; returns its IP when the event counts as a failure.
+
+    details maps an IP to ({event: count}, {username: count}), with at most max_users names per IP
+    (see add_username).
+    """
+    parsed = parse_auth_message(message)
+    if parsed is None:
+        return None
+    event, ip, user, times = parsed
+    times *= n
+    entry = details.get(ip)
+    if entry is None:
+        entry = details[ip] = ({}, {})
+    events, users = entry
+    events[event] = events.get(event, 0) + times
+    if user is not None:
+        add_username(users, user, times, max_users)
+    weight = weights.get(event, 0)
+    if not weight:
+        return None
+    counts[ip] += weight * times
+    return ip
+
+def ufw_source(line):
+    """The SRC address of a ufw kernel line, found without parsing the other fields, or None."""
+    start = line.find(" SRC=") + 5
+    if start == 4:
+        return None
+    end = line.find(" ", start)
+    return line[start:end] if end >= 0 else line[start:].rstrip()
+
+def ufw_line(text, ip):
+    """The first line of a block of text whose SRC is ip, or None."""
+    key = " SRC=" + ip
+    start = text.find(key)
+    while start >= 0:
+        end = start + len(key)
+        if end == len(text) or text[end].isspace():
+            stop = text.find("\n", end)
+            return text[text.rfind("\n", 0, start) + 1:stop if stop >= 0 else len(text)]
+        start = text.find(key, end)
+    return None
+
+def text_blocks(lines):
+    """Joins an iterable of lines into blocks of up to BATCH_LINES lines, for the block parsers."""
+    lines = iter(lines)
+    return ("\n".join(batch) for batch in iter(lambda: list(islice(lines, BATCH_LINES)), []))
+
+def parse_ufw(line):
+    """Reads a ufw kernel line into a UfwRecord, or returns None if it has no SRC."""
+    if "SRC=" not in line:
+        return None
+    match = UFW_LINE.search(line)
+    if match:
+        iface, src, dst, length, ttl, hoplimit, proto, spt, dpt = match.groups()
+        return UfwRecord(iface, src, dst, length, ttl or hoplimit, proto, spt, dpt)
+    # Lines rewritten by other tools may reorder fields; look each one up on its own
+    fields = {key: pattern.search(line) for key, pattern in UFW_FIELD.items()}
+    if fields["SRC"] is None:
+        return None
+    values = {key: match.group(1) if match else None for key, match in fields.items()}
+    return UfwRecord(values["IN"], values["SRC"], values["DST"], values["LEN"], values["TTL"],
+                     values["PROTO"], values["SPT"], values["DPT"])
+
+def parse_snort(line):
+    """Reads a snort alert_fast line into a SnortAlert, or returns None if it is not a classified alert."""
+    if "[Classification:" not in line:
+        return None
+    match = SNORT_ALERT.search(line)
+    if match is None:
+        return None
+    classification, proto, src = match.groups()
+    return SnortAlert(classification.strip(), proto, src)
+
+def count_snort(text, counts, details):
+    """Adds the classified alerts in a block of lines to counts; returns how many there were.
+
+    The sources are counted with one findall, and details gets {"classification", "protocol"}
+    from the first alert of each IP it does not have yet.
+    """
+    found = Counter(SNORT_SOURCE.findall(text))
+    for ip, n in found.items():
+        counts[ip] += n
+    new = {ip for ip in found if ip not in details}
+    for match in SNORT_ALERT.finditer(text) if new else ():
+        classification, protocol, ip = match.groups()
+        if ip in new:
+            new.discard(ip)
+            details[ip] = {"classification": classification.strip(), "protocol": protocol}
+            if not new:
+                break
+    return sum(found.values())
+
+SuricataAlert = namedtuple("SuricataAlert", "src classification proto timestamp signature_id severity dest_port")
+SURICATA_SRC = re.compile(r"\[(\d{1,3}(?:\.\d{1,3}){3})\]")
+SURICATA_CLASS = re.compile(r"\[Classification: (.*?)\]")
+SURICATA_PROTO = re.compile(r"\{(\w+)\}")
+
+def parse_suricata(line):
+    """Reads an EVE JSON alert, or a fast.log-style line, into a SuricataAlert; None otherwise.
+
+    timestamp is the EVE record's own timestamp, or the whole line for the text format.
+    """
+    stripped = line.strip()
+    record = None
+    if stripped.startswith("{"):
+        # Flow, dns, http and stats records outnumber alerts by far; skip them before decoding
+        if '"alert"' not in stripped:
+            return None
+        try:
+            record = json.loads(stripped)
+        except json.JSONDecodeError:
+            pass
+    if isinstance(record, dict):
+        alert = record.get("alert")
+        if not isinstance(alert, dict) or "src_ip" not in record:
+            return None
+        return SuricataAlert(record["src_ip"], alert.get("category", "Unknown"), record.get("proto", "Unknown"),
+                             record.get("timestamp", ""), alert.get("signature_id"), alert.get("severity"),
+                             record.get("dest_port"))
+    src_match = SURICATA_SRC.search(line)
+    if src_match is None:
+        return None
+    class_match = SURICATA_CLASS.search(line)
+    proto_match = SURICATA_PROTO.search(line)
+    return SuricataAlert(src_match.group(1), class_match.group(1).strip() if class_match else "Unknown",
+                         proto_match.group(1).strip() if proto_match else "Unknown", line, None, None, None)
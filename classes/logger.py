@@ -1,35 +1,256 @@
-import os
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+DEFAULTS = {
+    "format": "json",
+    "rotation": "size",  # "size", "time" or "none"
+    "max_bytes": 10 * 1024 * 1024,
+    "when": "midnight",
+    "backup_count": 5,
+    "queue_size": 10000,
+    "rate_limit": {"enabled": True, "burst": 10, "window": 60, "level": "WARNING"},
+}
+
+# Addresses and numbers vary between otherwise identical messages
+VARIABLE = re.compile(r"[0-9a-fA-F]*:[0-9a-fA-F:.]+|\d+")
+# Attributes every LogRecord has; anything else was passed through extra= and goes into the JSON line
+STANDARD = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, thread, message and any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD and key != "exc_text":
+                entry[key] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The original "time [LEVEL] message" lines, noting suppressed repeats."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} ({suppressed} similar message(s) suppressed)" if suppressed else line
+
+class RateLimit(logging.Filter):
+    """Lets through `burst` messages of one kind per `window` seconds and counts the rest.
+
+    Messages are of one kind when they differ only in addresses and numbers, so a failing
+    firewall command logged once per IP collapses into a few lines; the first message of the
+    next window carries the number that were suppressed.
+    """
+
+    def __init__(self, config):
+        super().__init__()
+        self.burst = config.get("burst", 10)
+        self.window = config.get("window", 60)
+        self.level = logging.getLevelName(config.get("level", "WARNING"))
+        self.kinds = {}  # key -> [window start, sent, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.levelno, VARIABLE.sub("#", str(record.msg)))
+        now = time.monotonic()
+        with self.lock:
+            state = self.kinds.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self.kinds[key] = [now, 1, 0]
+                if len(self.kinds) > 10000:
+                    self.kinds = {k: v for k, v in self.kinds.items() if now - v[0] < self.window}
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never waits for the writer: when the queue is full the record is dropped and counted."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The records are not shared with another handler, so unlike QueueHandler's this
+        # does not copy them; it only resolves what cannot cross to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                notice = logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                           "Log queue full, dropped %d record(s)", (self.dropped,), None)
+                self.queue.put_nowait(self.prepare(notice))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class Writer:
+    """Drains the log queue on a background thread: one write and one flush per batch of records."""
+
+    BATCH = 1024
+
+    def __init__(self, log_queue, handler):
+        self.queue = log_queue
+        self.handler = handler
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        # Waits for room in a full queue rather than losing what is already in it
+        self.queue.put(None)
+        self.thread.join()
+        self.handler.close()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < self.BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            if records:
+                self._write(records)
+            if batch[-1] is None:
+                return
+
+    def _should_rotate(self, text, record):
+        # Checked once per batch, against the size the whole batch would bring the file to
+        handler = self.handler
+        if isinstance(handler, logging.handlers.RotatingFileHandler):
+            if handler.maxBytes <= 0:
+                return False
+            handler.stream.seek(0, 2)
+            size = handler.stream.tell()
+            return size > 0 and size + len(text.encode()) > handler.maxBytes
+        return isinstance(handler, logging.handlers.TimedRotatingFileHandler) and handler.shouldRollover(record)
+
+    def _write(self, records):
+        handler = self.handler
+        try:
+            text = "".join(handler.format(record) + "\n" for record in records)
+            handler.acquire()
+            try:
+                if self._should_rotate(text, records[-1]):
+                    handler.doRollover()
+                handler.stream.write(text)
+                handler.stream.flush()
+            finally:
+                handler.release()
+        except Exception:
+            handler.handleError(records[-1])
+
+_writer = None
+_settings = None
+_lock = threading.Lock()
+
+def _file_handler(path, settings):
+    rotation = settings.get("rotation", "size")
+    if rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(path, when=settings.get("when", "midnight"),
+                                                         backupCount=settings.get("backup_count", 5))
+    if rotation == "size":
+        return logging.handlers.RotatingFileHandler(path, maxBytes=settings.get("max_bytes", 10 * 1024 * 1024),
+                                                    backupCount=settings.get("backup_count", 5))
+    return logging.FileHandler(path)
+
+def configure(config=None, log_folder="logs", log_file="activity.log"):
+    """Routes the root logger through a bounded queue to a background writer thread.
+
+    Callers only resolve the message and enqueue it; the writer thread does the JSON or text
+    formatting, the file I/O and rotation. Calling it again replaces the previous setup, so main can apply
+    config.json after the first Logger() has already started logging with the defaults.
+    """
+    global _writer, _settings
+    settings = dict(DEFAULTS, **(config or {}))
+    with _lock:
+        _stop()
+        if not os.path.exists(log_folder):
+            os.makedirs(log_folder)
+        file_handler = _file_handler(os.path.join(log_folder, log_file), settings)
+        file_handler.setFormatter(JsonFormatter() if settings.get("format") == "json" else TextFormatter())
+
+        handler = DroppingQueueHandler(queue.Queue(settings.get("queue_size", 10000)))
+        rate_limit = settings.get("rate_limit", {})
+        if rate_limit.get("enabled"):
+            handler.addFilter(RateLimit(rate_limit))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        _writer = Writer(handler.queue, file_handler)
+        _writer.start()
+        _settings = settings
+
+def _stop():
+    global _writer
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, DroppingQueueHandler):
+            root.removeHandler(handler)
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+def shutdown():
+    """Writes out everything still queued and stops the writer thread."""
+    with _lock:
+        _stop()
+
+atexit.register(shutdown)
 
 class Logger:
     def __init__(self, log_folder="logs", log_file="activity.log"):
         self.log_folder = log_folder
         self.log_file = log_file
         self.log_path = os.path.join(log_folder, log_file)
-        self._ensure_log_file()
         self._setup_logger()
 
-    def _ensure_log_file(self):
-        if not os.path.exists(self.log_folder):
-            os.makedirs(self.log_folder)
-        if not os.path.exists(self.log_path):
-            with open(self.log_path, "w") as f:
-                f.write("")  # create empty log file
-
     def _setup_logger(self):
-        logging.basicConfig(
-            filename=self.log_path,
-            level=logging.INFO,
-            format="%(asctime)s [%(levelname)s] %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S"
-        )
+        if _writer is None:
+            configure(_settings, self.log_folder, self.log_file)
         self.logger = logging.getLogger()
 
-    def info(self, message):
-        self.logger.info(message)
+    def info(self, message, **fields):
+        self.logger.info(message, extra=fields or None)
 
-    def error(self, message):
-        self.logger.error(message)
+    def error(self, message, **fields):
+        self.logger.error(message, extra=fields or None)
 
     def thread_event(self, thread_name, action):
-        self.info(f"Thread '{thread_name}' {action}")
\ No newline at end of file
+        self.info(f"Thread '{thread_name}' {action}", event="thread", component=thread_name, action=action)
@@ -0,0 +1,360 @@
+import json
+import os
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from classes.blocklist import BlocklistIndex, ChangeIndex, PackedSet, pack
+from classes.logger import Logger
+from classes.metrics import get_metrics
+from classes.storage import get_storage
+
+# Classifications held by the threat index; anything else answers as unknown
+TRACKED = ("attack", "suspicious")
+
+class ThreatIndex(ChangeIndex):
+    """threat_summary's attack and suspicious IPs, held in memory and kept current by deltas.
+
+    Triggers append new IPs, classification changes and deletions to threat_changes. An
+    Analyzer run that rescores an IP without changing its class records nothing, so steady
+    state costs the Analyzer no extra writes.
+    """
+
+    CHANGES = "threat_changes"
+    COLUMNS = "ip, classification"
+
+    def _create_triggers(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS threat_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                ip TEXT,
+                classification TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS threat_summary_insert AFTER INSERT ON threat_summary BEGIN
+                INSERT INTO threat_changes (ip, classification) VALUES (NEW.ip, NEW.classification);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS threat_summary_update AFTER UPDATE OF classification ON threat_summary
+            WHEN OLD.classification IS NOT NEW.classification BEGIN
+                INSERT INTO threat_changes (ip, classification) VALUES (NEW.ip, NEW.classification);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS threat_summary_delete AFTER DELETE ON threat_summary BEGIN
+                INSERT INTO threat_changes (ip, classification) VALUES (OLD.ip, NULL);
+            END
+        """)
+
+    @staticmethod
+    def drop(conn):
+        """Removes the triggers and threat_changes, which nothing prunes while no lookup service runs."""
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS threat_summary_{event}")
+        conn.execute("DROP TABLE IF EXISTS threat_changes")
+
+    def _reload(self, conn):
+        self.seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM threat_changes").fetchone()[0]
+        keys = {name: {4: [], 16: []} for name in TRACKED}
+        rows = conn.execute(
+            f"SELECT ip, classification FROM threat_summary WHERE classification IN ({', '.join('?' for _ in TRACKED)})",
+            TRACKED
+        )
+        for ip, classification in rows:
+            key = pack(ip)
+            if key is not None:
+                keys[classification][key[0]].append(key[1])
+        self.sets = {name: {width: PackedSet(width, values) for width, values in by_width.items()}
+                     for name, by_width in keys.items()}
+        self.logger.info("Threat index loaded: " + ", ".join(f"{self.size(name)} {name}" for name in TRACKED))
+
+    def _state(self):
+        return {}, [blob for name in TRACKED for width in (4, 16) for blob in self.sets[name][width].state()]
+
+    def _restore_state(self, meta, blobs):
+        if len(blobs) != 8 * len(TRACKED):
+            raise ValueError("unexpected number of sets")
+        parts = iter(blobs)
+        self.sets = {name: {width: PackedSet.restore(width, [next(parts) for _ in range(4)]) for width in (4, 16)}
+                     for name in TRACKED}
+
+    def size(self, name):
+        return sum(len(keys) for keys in self.sets[name].values())
+
+    def _apply(self, ip, classification):
+        key = pack(ip)
+        if key is None:
+            return ip
+        for name in TRACKED:
+            keys = self.sets[name][key[0]]
+            (keys.add if name == classification else keys.discard)(key[1])
+        return ip
+
+    def classification(self, key):
+        """The tracked classification of a packed address, or None."""
+        for name in TRACKED:
+            if key[1] in self.sets[name][key[0]]:
+                return name
+        return None
+
+class LRUCache:
+    """A bounded mapping that evicts its least recently read entry and counts hits and misses.
+
+    It has its own lock, held only for the dict operations, so hits never wait on an index.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class LookupService:
+    """Answers "what do we know about this IP?" from memory, over localhost HTTP or a Unix socket.
+
+    Blocked addresses and prefixes come from a BlocklistIndex on defense.db and attack and
+    suspicious IPs from a ThreatIndex on threats.db; both are refreshed by deltas every
+    refresh_interval seconds. Answers for hot addresses are kept in an LRU cache, from which
+    each refresh drops the addresses it changed (everything, after a reload or prefix change).
+
+    GET /lookup?ip=A[&ip=B...] or POST /lookup with a JSON list of addresses returns JSON;
+    GET /check?ip=A (or the X-Real-IP header, for nginx auth_request) answers 403 for blocked
+    and attack addresses and 204 otherwise; GET /health reports readiness and sizes.
+    """
+
+    def __init__(self, config):
+        self.logger = Logger()
+        self.metrics = get_metrics()
+        self.storage = get_storage()
+
+        if getattr(sys, 'frozen', False):
+            base_dir = os.path.dirname(sys.executable)
+        else:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        db_root = os.path.join(base_dir, "db")
+        self.threats_db = config.get("threats_db", os.path.join(db_root, "threats.db"))
+        self.defense_db = config.get("defense_db", os.path.join(db_root, "defense.db"))
+        self.host = config.get("host", "127.0.0.1")
+        self.port = config.get("port")
+        self.socket_path = config.get("socket")
+        self.refresh_interval = config.get("refresh_interval", 1.0)
+        self.max_batch = config.get("max_batch", 10000)
+        self.cache = LRUCache(config.get("cache_size", 65536))
+        # Held while an index loads or applies changes and while a miss reads the indexes
+        self.lock = threading.Lock()
+        self.blocklist = None
+        self.threats = None
+        self.servers = []
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    @property
+    def ready(self):
+        # Both indexes exist and have loaded once
+        return all(index is not None and index.seq is not None for index in (self.blocklist, self.threats))
+
+    def refresh(self):
+        """Creates the indexes once their tables exist, then applies the latest changes."""
+        try:
+            if self.blocklist is None:
+                self.blocklist = BlocklistIndex(self.storage, self.defense_db, self.logger)
+            if self.threats is None:
+                self.threats = ThreatIndex(self.storage, self.threats_db, self.logger)
+        except Exception as e:
+            self.logger.error(f"Lookup index unavailable: {e}")
+            return
+        for index in (self.blocklist, self.threats):
+            try:
+                changed = index.sync(self.lock)
+            except Exception as e:
+                self.logger.error(f"Lookup index refresh error on {index.db_path}: {e}")
+                continue
+            # Dropped once the changes are applied: an answer cached before then is stale, one after is current
+            if changed is None:
+                self.cache.clear()
+            else:
+                for ip in changed:
+                    self.cache.discard(pack(ip))
+        self.metrics.set("lookups_total", self.cache.hits, result="hit")
+        self.metrics.set("lookups_total", self.cache.misses, result="miss")
+
+    def _answer(self, ip, key):
+        prefix = self.blocklist.covering(ip)
+        blocked = prefix is not None or self.blocklist.blocked(ip)
+        classification = self.threats.classification(key)
+        verdict = "blocked" if blocked else classification or "unknown"
+        return {"ip": ip, "verdict": verdict, "blocked": blocked, "prefix": prefix, "classification": classification}
+
+    def lookup(self, ip):
+        """The answer for one address, or None if ip is not an address."""
+        key = pack(ip)
+        if key is None:
+            return None
+        answer = self.cache.get(key)
+        if answer is not None:
+            return answer if answer["ip"] == ip else dict(answer, ip=ip)
+        # Stored under the index lock, so a refresh cannot apply a change between the read and
+        # the put and then miss the entry when it drops the changed addresses
+        with self.lock:
+            answer = self._answer(ip, key)
+            self.cache.put(key, answer)
+        return answer
+
+    def lookup_many(self, ips):
+        return [self.lookup(ip) or {"ip": ip, "error": "not an address"} for ip in ips]
+
+    def handle(self, method, path, query, headers, body):
+        """(status, JSON-serializable body or None) for one request."""
+        if path == "/health":
+            if not self.ready:
+                return 503, {"ready": False}
+            return 200, {"ready": True, "addresses": len(self.blocklist), "prefixes": len(self.blocklist.prefixes),
+                         "threats": {name: self.threats.size(name) for name in TRACKED},
+                         "cached": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses}
+        if path not in ("/lookup", "/check"):
+            return 404, {"error": "not found"}
+        if not self.ready:
+            return 503, {"error": "index not loaded yet"}
+        if method == "POST" and path == "/lookup":
+            try:
+                ips = json.loads(body or b"[]")
+            except ValueError as e:
+                return 400, {"error": f"invalid JSON: {e}"}
+            if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
+                return 400, {"error": "expected a JSON list of addresses"}
+            if len(ips) > self.max_batch:
+                return 413, {"error": f"at most {self.max_batch} addresses per request"}
+            return 200, {"results": self.lookup_many(ips)}
+        ips = query.get("ip") or ([headers["X-Real-IP"]] if headers.get("X-Real-IP") else [])
+        if not ips:
+            return 400, {"error": "no ip given"}
+        if path == "/check":
+            answer = self.lookup(ips[0])
+            if answer is None:
+                return 400, {"error": "not an address"}
+            return (403 if answer["verdict"] in ("blocked", "attack") else 204), None
+        if len(ips) > 1:
+            if len(ips) > self.max_batch:
+                return 413, {"error": f"at most {self.max_batch} addresses per request"}
+            return 200, {"results": self.lookup_many(ips)}
+        answer = self.lookup(ips[0])
+        if answer is None:
+            return 400, {"error": "not an address"}
+        return 200, answer
+
+    def _handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so a client pays for its connection once rather than per lookup, and a
+            # buffered response, sent in one piece instead of stalling on Nagle and delayed ACKs
+            protocol_version = "HTTP/1.1"
+            wbufsize = -1
+
+            def _respond(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                try:
+                    status, payload = service.handle(method, url.path, parse_qs(url.query), self.headers, body)
+                except Exception as e:
+                    service.logger.error(f"Lookup request error: {e}")
+                    status, payload = 500, {"error": "internal error"}
+                data = b"" if payload is None else json.dumps(payload).encode()
+                self.send_response(status)
+                if data:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.refresh()
+        if self.port:
+            try:
+                server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            except OSError as e:
+                self.logger.error(f"Lookup endpoint on {self.host}:{self.port} failed: {e}")
+            else:
+                server.daemon_threads = True
+                self.servers.append(server)
+                self.logger.info(f"Lookups served on http://{self.host}:{self.port}/lookup")
+        if self.socket_path:
+            try:
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+                server = _UnixHTTPServer(self.socket_path, self._handler())
+                os.chmod(self.socket_path, 0o660)
+            except OSError as e:
+                self.logger.error(f"Lookup socket {self.socket_path} failed: {e}")
+            else:
+                self.servers.append(server)
+                self.logger.info(f"Lookups served on unix:{self.socket_path}")
+        for server in self.servers:
+            self.threads.append(threading.Thread(target=server.serve_forever, name="lookup-http", daemon=True))
+        self.threads.append(threading.Thread(target=self._refresh_loop, name="lookup-refresh", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        for thread in self.threads:
+            thread.join()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def _refresh_loop(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            self.refresh()
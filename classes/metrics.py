@@ -0,0 +1,322 @@
+import bisect
+import cProfile
+import io
+import ipaddress
+import os
+import pstats
+import random
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PREFIX = "perfect_trio_"
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+LATENCY = (1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 21600.0, 86400.0)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    "lines_read_total": ("counter", "Log lines read, by source", None),
+    "lines_matched_total": ("counter", "Log lines that produced an event, by source", None),
+    "bytes_read_total": ("counter", "Log bytes read, by source", None),
+    "bytes_per_second": ("gauge", "Read throughput of the last batch, by source", None),
+    "parse_seconds": ("histogram", "Time spent parsing one batch, by source", SECONDS),
+    "upsert_seconds": ("histogram", "Time spent writing one batch's counts, by source", SECONDS),
+    "analyzer_seconds": ("histogram", "Duration of one Analyzer run", SECONDS),
+    "ips_classified_total": ("counter", "IPs written to threat_summary by the Analyzer", None),
+    "defense_seconds": ("histogram", "Duration of one Defense run", SECONDS),
+    "ips_blocked_total": ("counter", "Firewall rules added, by kind (ip or prefix)", None),
+    "block_failures_total": ("counter", "Addresses the backend failed to block", None),
+    "ips_expired_total": ("counter", "Temporary blocks lifted after their TTL", None),
+    "blocks_scheduled": ("gauge", "Temporary blocks waiting to expire", None),
+    "ingest_to_block_seconds": ("histogram", "Time from when an IP's first event was ingested to its enforced rule", LATENCY),
+    "stage_seconds": ("histogram", "Duration of one pipeline cycle, by stage", SECONDS),
+    "stage_lag_seconds": ("histogram", "How late a pipeline cycle started, by stage", SECONDS),
+    "stage_errors_total": ("counter", "Pipeline cycles that raised, by stage", None),
+    "stage_overruns_total": ("counter", "Pipeline cycles that outlasted their interval, by stage", None),
+    "rows_pruned_total": ("counter", "Rows deleted by retention after their TTL, by table", None),
+    "retention_seconds": ("histogram", "Duration of one retention cycle", SECONDS),
+    "db_size_bytes": ("gauge", "Database file size including its WAL, by database", None),
+    "db_free_bytes": ("gauge", "Free pages not yet returned by vacuum, in bytes, by database", None),
+    "db_rows": ("gauge", "Rows per table at the last retention report, by database and table", None),
+    "lookups_total": ("counter", "IP lookups answered by the lookup service, by result (hit or miss in its cache)", None),
+}
+
+def _labels(labels, extra=None):
+    items = sorted(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(float(value)) if isinstance(value, float) else str(value)
+
+class Profiler:
+    """cProfile and tracemalloc hooks that can be switched on while the daemon runs.
+
+    cProfile follows a single thread, so each pipeline cycle is profiled on its own with
+    probability `sample` and folded into one set of stats; a cycle that starts while another
+    is being profiled runs unprofiled.
+    """
+
+    def __init__(self):
+        self.sample = 0.0
+        self.stats = None
+        self.running = threading.Lock()
+        self.lock = threading.Lock()
+        self.baseline = None
+
+    def start(self, sample=1.0):
+        with self.lock:
+            self.stats = None
+        self.sample = max(0.0, min(1.0, sample))
+
+    def stop(self):
+        self.sample = 0.0
+        return self.report()
+
+    def call(self, fn, *args):
+        if not self.sample or random.random() >= self.sample or not self.running.acquire(blocking=False):
+            return fn(*args)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(fn, *args)
+        finally:
+            self.running.release()
+            with self.lock:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def report(self, limit=30, sort="cumulative"):
+        with self.lock:
+            if self.stats is None:
+                return "No profiled cycles yet\n"
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def start_tracemalloc(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.baseline = tracemalloc.take_snapshot()
+
+    def stop_tracemalloc(self):
+        report = self.tracemalloc_report()
+        tracemalloc.stop()
+        self.baseline = None
+        return report
+
+    def tracemalloc_report(self, limit=20):
+        """Current and peak traced memory and the lines that grew most since tracing started."""
+        if not tracemalloc.is_tracing():
+            return "tracemalloc is not running\n"
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"traced memory: {current / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB"]
+        snapshot = tracemalloc.take_snapshot()
+        top = snapshot.compare_to(self.baseline, "lineno") if self.baseline else snapshot.statistics("lineno")
+        lines += [str(stat) for stat in top[:limit]]
+        return "\n".join(lines) + "\n"
+
+class Metrics:
+    """Process-wide counters, gauges and histograms in the Prometheus text format.
+
+    Everything is recorded per batch or per cycle, never per line, so collection stays on even
+    when nothing scrapes it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {name: {} for name in METRICS}
+        self.profiler = Profiler()
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(labels.items())
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(labels.items())] = value
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = tuple(labels.items())
+        with self.lock:
+            series = self.values[name].get(key)
+            if series is None:
+                # Per-bucket counts, then sum and count
+                series = self.values[name][key] = [0] * (len(buckets) + 3)
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def record_batch(self, source, reader, lines_matched, parse_seconds, upsert_seconds):
+        """One parsed and stored batch of a log source; reader is the Tailer or replay checkpoint that fed it.
+
+        The reader's line and byte counts are consumed, so a batch that read nothing adds nothing."""
+        lines_read, bytes_read = reader.lines_read, reader.bytes_read
+        reader.lines_read = reader.bytes_read = 0
+        self.inc("lines_read_total", lines_read, source=source)
+        self.inc("lines_matched_total", lines_matched, source=source)
+        self.inc("bytes_read_total", bytes_read, source=source)
+        if bytes_read and parse_seconds > 0:
+            self.set("bytes_per_second", bytes_read / parse_seconds, source=source)
+        self.observe("parse_seconds", parse_seconds, source=source)
+        self.observe("upsert_seconds", upsert_seconds, source=source)
+
+    def render(self):
+        out = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in METRICS.items():
+                series = self.values[name]
+                if not series:
+                    continue
+                full = PREFIX + name
+                out.append(f"# HELP {full} {help_text}")
+                out.append(f"# TYPE {full} {kind}")
+                for key, value in sorted(series.items()):
+                    if kind != "histogram":
+                        out.append(f"{full}{_labels(key)} {_number(value)}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float("inf"),), value):
+                        cumulative += count
+                        out.append(f"{full}_bucket{_labels(key, ('le', _number(bound)))} {cumulative}")
+                    out.append(f"{full}_sum{_labels(key)} {_number(value[-2])}")
+                    out.append(f"{full}_count{_labels(key)} {value[-1]}")
+        return "\n".join(out) + "\n"
+
+    def write_textfile(self, path):
+        """Writes the metrics for node_exporter's textfile collector, atomically."""
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "w") as file:
+            file.write(self.render())
+        os.replace(temp, path)
+
+class MetricsServer:
+    """Serves /metrics over local HTTP and/or refreshes a node_exporter textfile.
+
+    With debug set, the same server takes the profiling switches from loopback clients only:
+    POST /debug/profile/start?sample=0.1, POST /debug/profile/stop, GET /debug/profile, and
+    POST /debug/tracemalloc/start?frames=1, POST /debug/tracemalloc/stop, GET /debug/tracemalloc.
+    """
+
+    def __init__(self, config, metrics, logger):
+        self.metrics = metrics
+        self.logger = logger
+        self.host = config.get("host", "127.0.0.1")
+        self.port = config.get("port")
+        self.textfile = config.get("textfile")
+        self.textfile_interval = config.get("textfile_interval", 15)
+        self.debug = config.get("debug", False)
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        if self.port:
+            try:
+                self.server = ThreadingHTTPServer((self.host, self.port), self._handler())
+            except OSError as e:
+                self.logger.error(f"Metrics endpoint on {self.host}:{self.port} failed: {e}")
+            else:
+                self.server.daemon_threads = True
+                self.threads.append(threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True))
+                self.logger.info(f"Metrics served on http://{self.host}:{self.port}/metrics")
+        if self.textfile:
+            self.threads.append(threading.Thread(target=self._write_loop, name="metrics-textfile", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        if self.textfile:
+            self._write()
+
+    def _write(self):
+        try:
+            self.metrics.write_textfile(self.textfile)
+        except OSError as e:
+            self.logger.error(f"Metrics textfile write error: {e}")
+
+    def _write_loop(self):
+        while not self.stop_event.wait(self.textfile_interval):
+            self._write()
+
+    def handle(self, method, path, query, client):
+        """(status, body) for one request from the address client."""
+        profiler = self.metrics.profiler
+        first = lambda key, default: type(default)(query.get(key, [default])[0])
+        routes = {
+            "/metrics": ("GET", lambda: self.metrics.render()),
+            "/debug/profile/start": ("POST", lambda: profiler.start(first("sample", 1.0)) or "profiling started\n"),
+            "/debug/profile/stop": ("POST", lambda: profiler.stop()),
+            "/debug/profile": ("GET", lambda: profiler.report(first("limit", 30), first("sort", "cumulative"))),
+            "/debug/tracemalloc/start": ("POST", lambda: profiler.start_tracemalloc(first("frames", 1)) or "tracemalloc started\n"),
+            "/debug/tracemalloc/stop": ("POST", lambda: profiler.stop_tracemalloc()),
+            "/debug/tracemalloc": ("GET", lambda: profiler.tracemalloc_report(first("limit", 20))),
+        }
+        if path not in routes or (path.startswith("/debug/") and not self.debug):
+            return 404, "not found\n"
+        if path.startswith("/debug/") and not self._local(client):
+            return 403, "debug endpoints answer loopback clients only\n"
+        allowed, route = routes[path]
+        if method != allowed:
+            return 405, f"use {allowed}\n"
+        try:
+            return 200, route()
+        except (ValueError, KeyError) as e:
+            return 400, f"{e}\n"
+
+    @staticmethod
+    def _local(client):
+        try:
+            return ipaddress.ip_address(client).is_loopback
+        except ValueError:
+            return False
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                url = urlparse(self.path)
+                status, body = server.handle(method, url.path, parse_qs(url.query), self.client_address[0])
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def get_metrics():
+    """Returns the process-wide Metrics."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Metrics()
+        return _shared
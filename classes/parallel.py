@@ -0,0 +1,148 @@
+import mmap
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from classes.lineparser import AUTH_MESSAGE, SNORT_ALERT, add_username, count_auth_message, parse_suricata, parse_ufw
+
+AUTH_MESSAGE_BYTES = re.compile(AUTH_MESSAGE.pattern.encode())
+SNORT_ALERT_BYTES = re.compile(SNORT_ALERT.pattern.encode())
+
+def _decode(value):
+    return value.decode("utf-8", "replace")
+
+def _scan_auth(lines, weights, max_users):
+    # One pass over the whole range; only the distinct messages are decoded.
+    # An IP's events and usernames are summed across ranges by merge_auth.
+    counts, details = Counter(), {}
+    messages = AUTH_MESSAGE_BYTES.findall(b"\n".join(lines))
+    for message, n in Counter(messages).items():
+        count_auth_message(_decode(message), n, counts, details, weights, max_users)
+    return counts, details, len(messages)
+
+def merge_auth(first, later, max_users):
+    events, users = first
+    for event, count in later[0].items():
+        events[event] = events.get(event, 0) + count
+    for user, count in later[1].items():
+        add_username(users, user, count, max_users)
+    return first
+
+def _scan_ufw(lines):
+    counts, details = Counter(), {}
+    for line in lines:
+        start = line.find(b" SRC=") + 5
+        if start == 4:
+            continue
+        end = line.find(b" ", start)
+        ip = line[start:end] if end >= 0 else line[start:].rstrip()
+        counts[ip] += 1
+        if ip not in details:
+            details[ip] = parse_ufw(_decode(line))
+    return counts, details, sum(counts.values())
+
+def _scan_snort(lines):
+    counts, details = Counter(), {}
+    for line in lines:
+        if b"[Classification:" not in line:
+            continue
+        match = SNORT_ALERT_BYTES.search(line)
+        if match:
+            classification, proto, ip = match.groups()
+            counts[ip] += 1
+            if ip not in details:
+                details[ip] = {"classification": _decode(classification).strip(), "protocol": _decode(proto)}
+    return counts, details, sum(counts.values())
+
+def _scan_suricata(lines):
+    counts, details = Counter(), {}
+    for line in lines:
+        # Without an "alert" key or a bracketed address the line cannot match either format
+        if b'"alert"' not in line and b"[" not in line:
+            continue
+        alert = parse_suricata(_decode(line))
+        if alert is not None:
+            counts[alert.src] += 1
+            if alert.src not in details:
+                details[alert.src] = {"classification": alert.classification, "protocol": alert.proto,
+                                      "signature_id": alert.signature_id, "severity": alert.severity,
+                                      "dest_port": alert.dest_port}
+    return counts, details, sum(counts.values())
+
+SCANNERS = {"auth": _scan_auth, "ufw": _scan_ufw, "snort": _scan_snort, "suricata": _scan_suricata}
+
+def scan_range(kind, path, start, end, options=None):
+    """Counts one newline-aligned byte range of path in a worker process; returns (counts, details, lines, matched)."""
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), end, access=mmap.ACCESS_READ) as view:
+            lines = view[start:end].split(b"\n")
+    lines.pop()
+    counts, details, matched = SCANNERS[kind](lines, **(options or {}))
+    # Keys stay bytes while counting; decode them once at the end, as the text path would have
+    decoded_counts, decoded_details = Counter(), {}
+    for ip, count in counts.items():
+        decoded_counts[ip if isinstance(ip, str) else _decode(ip)] += count
+    for ip, value in details.items():
+        decoded_details.setdefault(ip if isinstance(ip, str) else _decode(ip), value)
+    return decoded_counts, decoded_details, len(lines), matched
+
+def line_ranges(path, start, end, parts):
+    """Splits [start, end) of path into up to `parts` ranges that begin and end on line boundaries."""
+    bounds = [start]
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), end, access=mmap.ACCESS_READ) as view:
+            for i in range(1, parts):
+                newline = view.find(b"\n", max(start + (end - start) * i // parts, bounds[-1]), end)
+                if newline < 0 or newline + 1 >= end:
+                    break
+                bounds.append(newline + 1)
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+class ParallelScanner:
+    """Parses a large backlog of whole log lines on every core.
+
+    The unread part of the file is split at newline boundaries, each range is memory-mapped
+    and counted on bytes by a worker process, and the per-range results are merged in file
+    order, so counts and first-seen details match a single-process read line for line.
+    """
+
+    def __init__(self, config, logger):
+        self.logger = logger
+        self.workers = config.get("workers") or os.cpu_count() or 1
+        self.min_bytes = config.get("min_bytes", 64 * 1024 * 1024)
+        self.chunk_bytes = config.get("chunk_bytes", 32 * 1024 * 1024)
+
+    def scan(self, kind, tailer, options=None):
+        """(counts, details, lines matched) for everything since tailer's checkpoint, or None to read it sequentially.
+
+        options are passed on to the kind's scanner as keyword arguments."""
+        claimed = tailer.claim_range(self.min_bytes)
+        if claimed is None:
+            return None
+        start, end = claimed
+        parts = max(self.workers, -(-(end - start) // self.chunk_bytes))
+        ranges = line_ranges(tailer.log_path, start, end, parts)
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(scan_range, repeat(kind), repeat(tailer.log_path),
+                                        [first for first, _ in ranges], [last for _, last in ranges],
+                                        repeat(options)))
+        except Exception as e:
+            self.logger.error(f"Parallel {kind} scan failed, reading sequentially: {e}")
+            tailer.pending = None
+            return None
+
+        counts, details, matched = Counter(), {}, 0
+        for range_counts, range_details, range_lines, range_matched in results:
+            tailer.lines_read += range_lines
+            matched += range_matched
+            counts.update(range_counts)
+            for ip, value in range_details.items():
+                if kind == "auth" and ip in details:
+                    merge_auth(details[ip], value, options["max_users"])
+                else:
+                    details.setdefault(ip, value)
+        self.logger.info(f"Parsed {end - start} byte(s) of {kind} log in {len(ranges)} range(s) on {self.workers} worker(s)")
+        return counts, details, matched
@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+from classes.logger import Logger
+from classes.metrics import get_metrics
+
+POLICIES = ("skip", "coalesce")
+
+class Worker:
+    """Runs one pipeline stage on its own long-lived thread.
+
+    The component (a parser, or the Analyzer/Defense pair) is built once and reused every
+    cycle, so its compiled patterns, rate windows, tailer and schema checks survive between
+    runs; a failed construction is retried on the next cycle. Cycles of one worker never
+    overlap. When a run outlasts its interval the policy decides what happens to the cycles it
+    missed: "coalesce" folds them into a single run that starts at once, "skip" drops them and
+    waits for the next slot on the original schedule. With interval None the worker only runs
+    when triggered, until set_interval gives it a schedule.
+    """
+
+    def __init__(self, name, factory, action, interval, stop, logger, policy="coalesce", jitter=0.0, slots=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown schedule policy for {name}: {policy}")
+        self.name = name
+        self.factory = factory
+        self.action = action
+        self.interval = interval
+        self.stop = stop
+        self.logger = logger
+        self.policy = policy
+        self.jitter = jitter
+        self.slots = slots
+        self.metrics = get_metrics()
+        self.component = None
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = False
+        self.next_run = None
+        self.stats = {"runs": 0, "errors": 0, "overruns": 0, "skipped": 0, "coalesced": 0,
+                      "last_seconds": None, "max_seconds": 0.0, "total_seconds": 0.0,
+                      "last_lag": None, "max_lag": 0.0, "last_started": None}
+        self.thread = threading.Thread(target=self._loop, name=f"pipeline-{name}", daemon=True)
+
+    def _offset(self):
+        # Spreads workers sharing an interval so their runs do not all start on the same tick
+        return random.uniform(0.0, self.jitter) if self.jitter > 0 else 0.0
+
+    def _loop(self):
+        self.logger.thread_event(self.name, "started")
+        self.next_run = time.monotonic()
+        due = self.next_run + self._offset()
+        while not self.stop.is_set():
+            now = time.monotonic()
+            manual = self.interval is None
+            if self.next_run is None and not manual:
+                # set_interval moved the schedule
+                self.next_run = now + self.interval
+                due = self.next_run + self._offset()
+            if not self.pending and (manual or now < due):
+                self.wake.wait(None if manual else due - now)
+                self.wake.clear()
+                continue
+            scheduled = not manual and now >= due
+            if not self._acquire():
+                break
+            try:
+                self.pending = False
+                self.run_once(lag=time.monotonic() - (due if scheduled else now))
+            finally:
+                if self.slots is not None:
+                    self.slots.release()
+            if scheduled:
+                self.next_run = self._advance(self.next_run)
+                due = self.next_run + self._offset()
+        self.logger.thread_event(self.name, "stopped")
+
+    def _acquire(self):
+        # The shared pool bounds how many stages run at once; waiting for it shows up as lag
+        if self.slots is None:
+            return True
+        while not self.slots.acquire(timeout=1.0):
+            if self.stop.is_set():
+                return False
+        return True
+
+    def _advance(self, slot):
+        now = time.monotonic()
+        if slot is None:
+            # set_interval ran during the cycle
+            return now + self.interval
+        slot += self.interval
+        if slot > now:
+            return slot
+        self.stats["overruns"] += 1
+        self.metrics.inc("stage_overruns_total", stage=self.name)
+        if self.policy == "coalesce":
+            self.stats["coalesced"] += 1
+            self.logger.info(f"{self.name} is falling behind: next cycle starts immediately")
+            return now
+        missed = int((now - slot) // self.interval) + 1
+        self.stats["skipped"] += missed
+        self.logger.info(f"{self.name} is falling behind: skipped {missed} cycle(s)")
+        return slot + missed * self.interval
+
+    def trigger(self):
+        """Asks for a run outside the schedule; returns False if the policy dropped it."""
+        if self.lock.locked() and self.policy == "skip":
+            self.stats["skipped"] += 1
+            return False
+        # Requests made while a run is in progress collapse into one follow-up run
+        if self.pending:
+            self.stats["coalesced"] += 1
+        self.pending = True
+        self.wake.set()
+        return True
+
+    def set_interval(self, seconds):
+        """Changes the interval; the next scheduled run is one new interval from now."""
+        self.interval = seconds
+        self.next_run = None
+        self.wake.set()
+
+    def run_once(self, lag=0.0):
+        """Runs one cycle now; returns the action's result, or None if it failed."""
+        with self.lock:
+            started = time.monotonic()
+            self.stats["last_started"] = time.time()
+            self.stats["last_lag"] = lag
+            self.stats["max_lag"] = max(self.stats["max_lag"], lag)
+            result = None
+            try:
+                if self.component is None:
+                    self.component = self.factory()
+                # Profiled only while the profiler is switched on, and then only for a sample of cycles
+                result = self.metrics.profiler.call(self.action, self.component)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.metrics.inc("stage_errors_total", stage=self.name)
+                self.logger.error(f"{self.name} error: {e}")
+            elapsed = time.monotonic() - started
+            self.stats["runs"] += 1
+            self.stats["last_seconds"] = elapsed
+            self.stats["max_seconds"] = max(self.stats["max_seconds"], elapsed)
+            self.stats["total_seconds"] += elapsed
+            self.metrics.observe("stage_seconds", elapsed, stage=self.name)
+            self.metrics.observe("stage_lag_seconds", lag, stage=self.name)
+            self.logger.info(f"{self.name} cycle finished in {elapsed:.2f}s (started {lag:.2f}s late)")
+            return result
+
+class Pipeline:
+    """The set of persistent workers behind the periodic (non-stream) mode.
+
+    max_concurrent bounds how many stages run at the same time across all workers; a stage
+    waiting for a free slot starts late, and that lag is recorded with its timings.
+    """
+
+    def __init__(self, logger=None, max_concurrent=None):
+        self.logger = logger or Logger()
+        self.stop_event = threading.Event()
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.workers = {}
+
+    def add(self, name, factory, action, interval, policy="coalesce", jitter=0.0):
+        self.workers[name] = Worker(name, factory, action, interval, self.stop_event, self.logger,
+                                    policy, jitter, self.slots)
+        return self.workers[name]
+
+    def start(self):
+        for worker in self.workers.values():
+            if not worker.thread.is_alive():
+                worker.thread.start()
+
+    def trigger(self, name):
+        return self.workers[name].trigger()
+
+    def set_interval(self, name, seconds):
+        self.workers[name].set_interval(seconds)
+
+    def stop(self, timeout=None):
+        """Asks every worker to stop and waits for its current cycle to finish."""
+        self.stop_event.set()
+        for worker in self.workers.values():
+            worker.wake.set()
+        for worker in self.workers.values():
+            if worker.thread.is_alive():
+                worker.thread.join(timeout)
+
+    def wait(self):
+        # Short waits keep the main thread responsive to KeyboardInterrupt
+        while not self.stop_event.wait(1.0):
+            pass
+
+    def timings(self):
+        """Per-stage run counts, durations and start lag in seconds."""
+        return {name: dict(worker.stats, interval=worker.interval, policy=worker.policy)
+                for name, worker in self.workers.items()}
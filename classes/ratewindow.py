@@ -0,0 +1,125 @@
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+MONTHS = {name: i for i, name in enumerate(("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                            "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
+
+def parse_iso(token):
+    if token.endswith("Z"):
+        token = token[:-1] + "+00:00"
+    elif len(token) > 5 and token[-5] in "+-" and token[-3] != ":":
+        token = token[:-2] + ":" + token[-2:]
+    return datetime.fromisoformat(token).timestamp()
+
+def parse_timestamp(line, default=None):
+    """Epoch seconds of a log line's leading timestamp.
+
+    Understands ISO 8601 (rsyslog high-precision, Suricata EVE), classic syslog
+    "Aug 25 00:05:01" and snort fast-alert "08/25-00:05:01.123456"; the last two carry
+    no year, so the current one is assumed. Returns default (or now) when nothing matches.
+    """
+    try:
+        if line[:4].isdigit() and line[4:5] == "-":
+            return parse_iso(line.split(" ", 1)[0])
+        if line[:3] in MONTHS:
+            month, day, clock = line.split(None, 3)[:3]
+            hour, minute, second = clock.split(":")
+            return datetime(datetime.now().year, MONTHS[month], int(day),
+                            int(hour), int(minute), int(second)).timestamp()
+        if line[2:3] == "/" and line[5:6] == "-":
+            clock = line[6:].split(" ", 1)[0]
+            hour, minute, second = clock.split(":")
+            return datetime(datetime.now().year, int(line[:2]), int(line[3:5]),
+                            int(hour), int(minute)).timestamp() + float(second)
+    except ValueError:
+        pass
+    return time.time() if default is None else default
+
+class RateWindow:
+    """Flags keys that produce `events` events within `seconds`.
+
+    Every key keeps the times of its last `events` events in an array-backed ring buffer;
+    it is flagged once the buffer is full and spans at most `seconds`. Keys idle for
+    idle_timeout seconds (in log time) are evicted, and at most max_keys are kept, dropping
+    the least recently active first, so memory stays bounded.
+    """
+
+    def __init__(self, config):
+        self.events = config.get("events", 10)
+        if self.events < 1:
+            raise ValueError(f"rate.events must be at least 1, got {self.events!r}")
+        self.seconds = config.get("seconds", 60)
+        self.idle_timeout = config.get("idle_timeout", 3600)
+        self.max_keys = config.get("max_ips", 100000)
+        self.rings = OrderedDict()  # key -> [array of times, next slot, filled]
+        self.latest = 0.0
+
+    def add(self, key, timestamp):
+        """Records one event and returns True if key is now over the rate."""
+        ring = self.rings.get(key)
+        if ring is None:
+            ring = [array("d", bytes(8 * self.events)), 0, 0]
+            self.rings[key] = ring
+            # Checked on every new key, so a flood within one second cannot pass the cap
+            self._cap()
+        else:
+            self.rings.move_to_end(key)
+
+        times, slot, filled = ring
+        times[slot] = timestamp
+        ring[1] = (slot + 1) % self.events
+        ring[2] = filled = min(filled + 1, self.events)
+
+        if timestamp > self.latest:
+            self.latest = timestamp
+            self._expire()
+
+        # When full, the next slot to overwrite holds the oldest of the last `events` times
+        return filled == self.events and timestamp - times[ring[1]] <= self.seconds
+
+    def _cap(self):
+        while len(self.rings) > self.max_keys:
+            self.rings.popitem(last=False)
+
+    def _expire(self):
+        cutoff = self.latest - self.idle_timeout
+        while self.rings:
+            key, (times, slot, _) = next(iter(self.rings.items()))
+            if times[(slot - 1) % self.events] >= cutoff:
+                break
+            del self.rings[key]
+
+    def __len__(self):
+        return len(self.rings)
+
+    def state(self):
+        """(meta, blobs) of every ring, least recently active first, for restore()."""
+        keys = list(self.rings)
+        times, slots, filled = array("d"), array("I"), array("I")
+        for key in keys:
+            ring = self.rings[key]
+            times.extend(ring[0])
+            slots.append(ring[1])
+            filled.append(ring[2])
+        meta = {"events": self.events, "latest": self.latest}
+        return meta, ["\n".join(keys).encode(), times.tobytes(), slots.tobytes(), filled.tobytes()]
+
+    def restore(self, meta, blobs):
+        """Loads state() output; False if it was taken with another ring size."""
+        if meta["events"] != self.events:
+            return False
+        keys = blobs[0].decode().split("\n") if blobs[0] else []
+        times, slots, filled = array("d"), array("I"), array("I")
+        times.frombytes(blobs[1])
+        slots.frombytes(blobs[2])
+        filled.frombytes(blobs[3])
+        if not len(keys) == len(slots) == len(filled) or len(times) != len(keys) * self.events:
+            raise ValueError("ring arrays do not match their keys")
+        self.rings = OrderedDict(
+            (key, [times[i * self.events:(i + 1) * self.events], slots[i], filled[i]]) for i, key in enumerate(keys)
+        )
+        self.latest = meta["latest"]
+        self._cap()
+        self._expire()
@@ -0,0 +1,136 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from classes.logger import Logger
+from classes.tailer import OPENERS, fingerprint, open_log
+
+ROTATION_NUMBER = re.compile(r"\.(\d+)(?:\.\w+)?$")
+
+def rotated_siblings(log_path):
+    """Rotated copies of log_path, oldest first.
+
+    Matches "auth.log.1", "auth.log.2.gz", "auth.log-20240825.gz" next to the log and
+    anything named after it in an "old" subfolder. Uncompressed and gz/bz2/xz files are
+    kept; the live file itself is left to the tailer.
+    """
+    folder, base = os.path.split(os.path.abspath(log_path))
+    found = []
+    for directory in (folder, os.path.join(folder, "old")):
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            name = entry.name
+            named = (name == base and directory != folder) or name.startswith((base + ".", base + "-"))
+            extension = os.path.splitext(name)[1]
+            if not named or not entry.is_file() or (extension not in OPENERS and not _plain(name, base)):
+                continue
+            number = ROTATION_NUMBER.search(name)
+            # Older files have older mtimes; logrotate numbers break ties, higher being older
+            found.append((entry.stat().st_mtime, -int(number.group(1)) if number else 0, entry.path))
+    return [path for _, _, path in sorted(found)]
+
+def _plain(name, base):
+    # "auth.log.1" or "auth.log-20240825", but not another compression format or a stray editor file
+    suffix = name[len(base):]
+    return suffix == "" or re.fullmatch(r"[.-][\d-]+", suffix) is not None
+
+class ReplayCheckpoint:
+    """Stands in for a Tailer in store_to_db, recording how far into a file a replay got."""
+
+    def __init__(self, source, value, path):
+        self.source = source
+        self.fingerprint = value
+        self.path = path
+        self.offset = 0
+        self.done = False
+        self.lines_read = 0  # in the current batch, for metrics
+        self.bytes_read = 0
+
+    def save_checkpoint(self, conn):
+        conn.execute("""
+            INSERT INTO replayed_files (source, fingerprint, path, offset, done)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(source, fingerprint) DO UPDATE SET path=excluded.path, offset=excluded.offset, done=excluded.done
+        """, (self.source, self.fingerprint, self.path, self.offset, int(self.done)))
+
+class Replay:
+    """Backfills the rotated history of each source through its own store_to_db.
+
+    A source's files are read oldest first, so counts, first-seen details and rate windows
+    evolve as they would have live; different sources run side by side. Progress is committed
+    with every batch in the same transaction as its counts, so an interrupted replay resumes
+    where it stopped, and files already read by the tailer are skipped.
+    """
+
+    def __init__(self, config):
+        self.batch_bytes = config.get("batch_bytes", 16 * 1024 * 1024)
+        self.logger = Logger()
+
+    def run(self, sources):
+        """sources maps a name to a parser (Auth, UFW, IDS_IPS); returns per-source totals."""
+        with ThreadPoolExecutor(max_workers=max(1, len(sources))) as pool:
+            futures = {name: pool.submit(self.replay_source, name, source) for name, source in sources.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def replay_source(self, name, source):
+        totals = {"files": 0, "lines": 0, "bytes": 0, "seconds": 0.0}
+        with source.storage.read(source.db_path) as conn:
+            progress = dict(
+                (row[0], (row[1] or 0, row[2]))
+                for row in conn.execute("SELECT fingerprint, offset, done FROM replayed_files WHERE source = ?",
+                                        (source.tailer.source,))
+            )
+        seen = set()  # fingerprints claimed by this run, so copies of one file are replayed once
+        for path in rotated_siblings(source.log_path):
+            value = fingerprint(path)
+            if value is None:
+                self.logger.info(f"Replay {name}: {path} skipped, too short to fingerprint")
+                continue
+            offset, done = progress.get(value, (0, 0))
+            if done or value in seen:
+                continue
+            seen.add(value)
+            try:
+                lines, size, seconds = self.replay_file(source, ReplayCheckpoint(source.tailer.source, value, path), offset)
+            except Exception as e:
+                self.logger.error(f"Replay {name}: {path} failed: {e}")
+                continue
+            totals["files"] += 1
+            totals["lines"] += lines
+            totals["bytes"] += size
+            totals["seconds"] += seconds
+            self.logger.info(
+                f"Replay {name}: {path} {lines} line(s), {size / 2 ** 20:.1f} MB in {seconds:.1f}s "
+                f"({lines / seconds if seconds else 0:.0f} lines/s)"
+            )
+        return totals
+
+    def replay_file(self, source, checkpoint, offset):
+        """Streams one file from offset through store_to_db, batch by batch; returns (lines, bytes, seconds)."""
+        start = time.perf_counter()
+        lines_read = 0
+        checkpoint.offset = offset
+        with open_log(checkpoint.path) as file:
+            file.seek(offset)
+            partial = b""
+            while True:
+                chunk = file.read(self.batch_bytes)
+                data = partial + chunk
+                end = len(data) if not chunk else data.rfind(b"\n") + 1
+                partial = data[end:]
+                lines = data[:end].decode("utf-8", "replace").split("\n")
+                # A trailing newline leaves an empty last element; a rotated file's unterminated last line does not
+                if lines and lines[-1] == "":
+                    lines.pop()
+                checkpoint.offset += end
+                checkpoint.lines_read = len(lines)
+                checkpoint.bytes_read = end
+                checkpoint.done = not chunk
+                source.store_to_db(lines, checkpoint)
+                lines_read += len(lines)
+                if not chunk:
+                    break
+        return lines_read, checkpoint.offset - offset, time.perf_counter() - start
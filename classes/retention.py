@@ -0,0 +1,275 @@
+import os
+import sys
+import time
+from collections import namedtuple
+from classes.analyzer import SOURCES
+from classes.logger import Logger
+from classes.metrics import get_metrics
+from classes.storage import get_storage
+
+HOUR = 3600
+DAY = 86400
+
+# One pruned table: the expression dating its rows, the column rolled up as the bucket's kind
+# (None to delete without a rollup), what one row counts as in events, which rows may go and
+# the column holding the row's address
+Rule = namedtuple("Rule", "table time kind events where address", defaults=("ip",))
+BLOCKED_AT = "CAST(strftime('%s', blocked_at) AS REAL)"
+RULES = {
+    "auth_db": (
+        Rule("failed_logins", "last_updated", "status", "count", None),
+        Rule("auth_events", "last_updated", "event", "count", None),
+        Rule("auth_users", "last_updated", None, None, None),
+    ),
+    "ids_ips_db": (
+        Rule("ids_ips_alerts", "last_updated", "classification", "count", None),
+    ),
+    "ufw_db": (
+        Rule("ufw_alerts", "last_updated", "dpt", "count", None),
+    ),
+    # Only IPs no source remembers any more; the sources are pruned first
+    "threats_db": (
+        Rule("threat_summary", "COALESCE(last_attack, first_seen, 0)", "classification", "1", "orphaned"),
+    ),
+    # Enforced blocks stay until they expire; only failed attempts and replaced prefixes are pruned
+    "defense_db": (
+        Rule("blocked_ips", BLOCKED_AT, "status", "1", "status = 'block_failed'"),
+        Rule("blocked_prefixes", BLOCKED_AT, "status", "1", "status = 'superseded'", "prefix"),
+        Rule("block_history", "last_blocked", None, None, None),
+    ),
+}
+FILES = {
+    "auth_db": "auth_data.db",
+    "ids_ips_db": "ids_ips_data.db",
+    "ufw_db": "ufw_data.db",
+    "threats_db": "threats.db",
+    "defense_db": "defense.db",
+}
+
+class Retention:
+    """Keeps the SQLite stores from growing without limit.
+
+    Rows whose last activity is older than their table's TTL are summed into hourly buckets of
+    activity_rollup (rows and events per table, IP, kind and hour) and deleted, batch_rows at a
+    time so parsers can write in between. The tables keep one running total per IP, so a row
+    lands in the hour of its last activity with all of its events, including earlier ones.
+    Hourly buckets older than hourly_ttl are merged into daily ones, and daily ones dropped
+    after rollup_ttl (0 keeps them). When nothing has been written for quiet_seconds, freed
+    pages are returned with an incremental vacuum, the WAL is truncated and the query planner
+    statistics refreshed with ANALYZE.
+    """
+
+    def __init__(self, config):
+        self.logger = Logger()
+        self.metrics = get_metrics()
+        self.storage = get_storage()
+
+        if getattr(sys, 'frozen', False):
+            base_dir = os.path.dirname(sys.executable)
+        else:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        db_root = os.path.join(base_dir, "db")
+        self.raw_ttl = config.get("raw_ttl", 30 * DAY)
+        self.ttl = config.get("ttl", {})
+        self.hourly_ttl = config.get("hourly_ttl", 7 * DAY)
+        self.rollup_ttl = config.get("rollup_ttl", 365 * DAY)
+        self.batch_rows = config.get("batch_rows", 10000)
+        self.quiet_seconds = config.get("quiet_seconds", 60)
+        self.vacuum_pages = config.get("vacuum_pages", 10000)
+        self.analysis_limit = config.get("analysis_limit", 1000)
+        self.paths = {key: config.get(key, os.path.join(db_root, name)) for key, name in FILES.items()}
+        # In single-file mode several keys share a file, whose rules then run in this order
+        self.databases = {}
+        for key, rules in RULES.items():
+            self.databases.setdefault(self.paths[key], []).extend(rules)
+        for name, _ in SOURCES:
+            source_path = self.paths[f"{name}_db"]
+            if os.path.abspath(source_path) != os.path.abspath(self.paths["threats_db"]):
+                self.storage.attach(self.paths["threats_db"], name, source_path)
+
+    def _create_tables(self, conn):
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(activity_rollup)")]
+        if columns and "ip" not in columns:
+            conn.execute("ALTER TABLE activity_rollup RENAME TO activity_rollup_old")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS activity_rollup (
+                source TEXT,
+                ip TEXT,
+                kind TEXT,
+                granularity TEXT,
+                bucket INTEGER,
+                rows INTEGER,
+                events INTEGER,
+                PRIMARY KEY (source, ip, kind, granularity, bucket)
+            )
+        """)
+        if columns and "ip" not in columns:
+            # Buckets rolled up before they were kept per IP keep their totals under no address
+            conn.execute("""
+                INSERT INTO activity_rollup (source, ip, kind, granularity, bucket, rows, events)
+                SELECT source, '', kind, granularity, bucket, rows, events FROM activity_rollup_old
+            """)
+            conn.execute("DROP TABLE activity_rollup_old")
+
+    def _exists(self, conn, table, schema="main"):
+        return conn.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+
+    def _orphaned(self, conn):
+        # The Analyzer attaches the sources under their names, or keeps them in main in single-file mode
+        attached = set(row[1] for row in conn.execute("PRAGMA database_list"))
+        checks = []
+        for name, table in SOURCES:
+            schema = name if name in attached else "main"
+            if self._exists(conn, table, schema):
+                checks.append(f"NOT EXISTS (SELECT 1 FROM {schema}.{table} s WHERE s.ip = threat_summary.ip)")
+        return " AND ".join(checks) or "1"
+
+    def _prune_batch(self, conn, rule, cutoff, after):
+        """Rolls up and deletes up to batch_rows expired rows past rowid after; returns (count, last rowid)."""
+        if not self._exists(conn, rule.table):
+            return 0, None
+        where = self._orphaned(conn) if rule.where == "orphaned" else rule.where
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS retention_rows (id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.retention_rows")
+        # Walking rowids forward visits every row once over all batches, even where no index covers the time
+        conn.execute(f"""
+            INSERT INTO temp.retention_rows (id)
+            SELECT rowid FROM {rule.table} WHERE rowid > ? AND {rule.time} < ?{f" AND {where}" if where else ""}
+            ORDER BY rowid LIMIT ?
+        """, (after, cutoff, self.batch_rows))
+        count, last = conn.execute("SELECT COUNT(*), MAX(id) FROM temp.retention_rows").fetchone()
+        if not count:
+            return 0, None
+        if rule.kind is not None:
+            conn.execute(f"""
+                INSERT INTO activity_rollup (source, ip, kind, granularity, bucket, rows, events)
+                SELECT ?, {rule.address}, COALESCE(CAST({rule.kind} AS TEXT), ''), 'hour',
+                       CAST({rule.time} / {HOUR} AS INTEGER) * {HOUR}, COUNT(*), SUM({rule.events})
+                FROM {rule.table} WHERE rowid IN (SELECT id FROM temp.retention_rows)
+                GROUP BY 2, 3, 5
+                ON CONFLICT(source, ip, kind, granularity, bucket) DO UPDATE SET rows=activity_rollup.rows + excluded.rows,
+                    events=activity_rollup.events + excluded.events
+            """, (rule.table,))
+        conn.execute(f"DELETE FROM {rule.table} WHERE rowid IN (SELECT id FROM temp.retention_rows)")
+        if rule.table == "blocked_prefixes":
+            conn.execute("DELETE FROM prefix_members WHERE prefix NOT IN (SELECT prefix FROM blocked_prefixes)")
+        return count, last
+
+    def _compact_rollups(self, conn, now):
+        cutoff = (int(now - self.hourly_ttl) // DAY) * DAY
+        conn.execute(f"""
+            INSERT INTO activity_rollup (source, ip, kind, granularity, bucket, rows, events)
+            SELECT source, ip, kind, 'day', bucket / {DAY} * {DAY}, SUM(rows), SUM(events)
+            FROM activity_rollup WHERE granularity = 'hour' AND bucket < ?
+            GROUP BY source, ip, kind, 5
+            ON CONFLICT(source, ip, kind, granularity, bucket) DO UPDATE SET rows=activity_rollup.rows + excluded.rows,
+                events=activity_rollup.events + excluded.events
+        """, (cutoff,))
+        conn.execute("DELETE FROM activity_rollup WHERE granularity = 'hour' AND bucket < ?", (cutoff,))
+        if self.rollup_ttl:
+            conn.execute("DELETE FROM activity_rollup WHERE granularity = 'day' AND bucket < ?", (now - self.rollup_ttl,))
+
+    def prune(self, now=None):
+        """Rolls up and deletes every table's expired rows; returns the number deleted per table."""
+        now = time.time() if now is None else now
+        pruned = {}
+        for db_path, rules in self.databases.items():
+            try:
+                self.storage.run(db_path, self._create_tables)
+                for rule in rules:
+                    ttl = self.ttl.get(rule.table, self.raw_ttl)
+                    if not ttl:
+                        continue
+                    after = 0
+                    while True:
+                        count, after = self.storage.run(
+                            db_path, lambda conn: self._prune_batch(conn, rule, now - ttl, after)
+                        )
+                        if count:
+                            pruned[rule.table] = pruned.get(rule.table, 0) + count
+                            self.metrics.inc("rows_pruned_total", count, table=rule.table)
+                        if count < self.batch_rows:
+                            break
+                self.storage.run(db_path, lambda conn: self._compact_rollups(conn, now))
+            except Exception as e:
+                self.logger.error(f"Retention error on {db_path}: {e}")
+        return pruned
+
+    def _maintain(self, conn):
+        if conn.execute("PRAGMA main.auto_vacuum").fetchone()[0] != 2:
+            # Files created before incremental vacuum was enabled are converted once, which rewrites them
+            conn.execute("PRAGMA main.auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM main")
+        else:
+            conn.execute(f"PRAGMA main.incremental_vacuum({int(self.vacuum_pages)})" if self.vacuum_pages
+                         else "PRAGMA main.incremental_vacuum")
+        # Attached sources are maintained through their own connections
+        conn.execute(f"PRAGMA analysis_limit={int(self.analysis_limit)}")
+        conn.execute("ANALYZE main")
+        conn.execute("PRAGMA main.wal_checkpoint(TRUNCATE)")
+
+    def maintain(self):
+        """Vacuums, analyzes and checkpoints every database; run only when the writer is idle."""
+        for db_path in self.databases:
+            if not os.path.exists(db_path):
+                continue
+            try:
+                started = time.perf_counter()
+                self.storage.maintain(db_path, self._maintain)
+                self.logger.info(f"Maintained {db_path} in {time.perf_counter() - started:.2f}s",
+                                 event="retention", database=db_path)
+            except Exception as e:
+                self.logger.error(f"Retention maintenance error on {db_path}: {e}")
+
+    def report(self):
+        """File size, free space and row counts per table for each database."""
+        report = {}
+        for db_path in self.databases:
+            if not os.path.exists(db_path):
+                continue
+            try:
+                with self.storage.read(db_path) as conn:
+                    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                    tables = [row[0] for row in conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+                    )]
+                    entry = {
+                        "bytes": sum(os.path.getsize(path) for path in (db_path, db_path + "-wal")
+                                     if os.path.exists(path)),
+                        "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+                        "rows": {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                                 for table in tables},
+                    }
+            except Exception as e:
+                self.logger.error(f"Retention report error on {db_path}: {e}")
+                continue
+            report[db_path] = entry
+            database = os.path.basename(db_path)
+            self.metrics.set("db_size_bytes", entry["bytes"], database=database)
+            self.metrics.set("db_free_bytes", entry["free_bytes"], database=database)
+            for table, rows in entry["rows"].items():
+                self.metrics.set("db_rows", rows, database=database, table=table)
+        return report
+
+    def run(self):
+        """One retention cycle: prune, maintain if the writer was idle beforehand, and report."""
+        started = time.perf_counter()
+        # Measured before pruning, whose own writes would otherwise always make it look busy
+        quiet = self.storage.idle_seconds() >= self.quiet_seconds
+        pruned = self.prune()
+        if quiet:
+            self.maintain()
+        report = self.report()
+        for db_path, entry in report.items():
+            self.logger.info(
+                f"Database {db_path}: {entry['bytes'] / 2 ** 20:.1f} MiB, {entry['free_bytes'] / 2 ** 20:.1f} MiB free, "
+                f"{sum(entry['rows'].values())} row(s)",
+                event="retention", database=db_path, bytes=entry["bytes"], free_bytes=entry["free_bytes"],
+                rows=entry["rows"]
+            )
+        self.logger.info(f"Retention pruned {sum(pruned.values())} row(s)", event="retention", pruned=pruned)
+        self.metrics.observe("retention_seconds", time.perf_counter() - started)
+        return report
@@ -0,0 +1,86 @@
+import math
+import sqlite3
+
+# Numeric features: presence and 'attack' status per source, event counts per source (scored
+# per decade, log10(1 + count)) and ports_seen_across_sources. Each of IDS and UFW keeps only
+# the first destination port it saw for an IP, so that term is 0, 1 or 2: one for each of them
+# that reported a port, the second only when it differs from the first. It is not a count of
+# the distinct ports an IP has probed.
+FEATURES = (
+    "auth", "ids_ips", "ufw",
+    "auth_attack", "ids_ips_attack", "ufw_attack",
+    "auth_count", "ids_ips_count", "ufw_count",
+    "ports_seen_across_sources",
+)
+# Earlier names of weights, still read from existing configs
+RENAMED = {"ports": "ports_seen_across_sources"}
+# Categorical features, each scored by a per-value weight table
+CATEGORIES = ("classifications", "protocols", "severities")
+
+DEFAULTS = {
+    "weights": {
+        "auth": 1.0, "ids_ips": 1.0, "ufw": 1.0,
+        "auth_attack": 0.5, "ids_ips_attack": 0.5, "ufw_attack": 0.5,
+        "auth_count": 0.25, "ids_ips_count": 0.25, "ufw_count": 0.25,
+        "ports_seen_across_sources": 0.25,
+    },
+    "classifications": {},
+    "protocols": {},
+    "severities": {"1": 1.0, "2": 0.5},
+    "thresholds": {"attack": 2.0, "suspicious": 0.0},
+}
+
+def ensure_log10(conn):
+    """Registers log10 on SQLite builds compiled without the math functions."""
+    try:
+        conn.execute("SELECT log10(1)")
+    except sqlite3.OperationalError:
+        conn.create_function("log10", 1, math.log10, deterministic=True)
+
+class Scorer:
+    """Weighted threat scores as one SQL expression over the per-IP feature columns.
+
+    score = sum(weight * feature) + the weights of the IP's classification, protocol and
+    severity. With the defaults an IP seen by two sources scores at least 2 and is an attack,
+    as under the old two-of-three rule. One source in 'attack' status (1.5) gets there on its
+    own with 100 events, or with 10 when it is IDS or UFW and reported a destination port; the
+    port term adds at most 0.5, so it tips close calls rather than deciding them. Terms with a
+    zero weight are left out.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        configured = {RENAMED.get(name, name): value for name, value in config.get("weights", {}).items()}
+        weights = dict(DEFAULTS["weights"], **configured)
+        self.weights = {name: float(weights.get(name, 0.0)) for name in FEATURES}
+        self.tables = {}
+        for name in CATEGORIES:
+            table = config.get(name, DEFAULTS[name])
+            if name == "severities":
+                table = {int(key): value for key, value in table.items()}
+            self.tables[name] = {key: float(value) for key, value in table.items()}
+        thresholds = dict(DEFAULTS["thresholds"], **config.get("thresholds", {}))
+        self.attack = float(thresholds["attack"])
+        self.suspicious = float(thresholds["suspicious"])
+
+    def score(self, columns):
+        """(SQL expression, parameters) for the score, given an expression per feature and category."""
+        terms, params = [], []
+        for name in FEATURES:
+            weight = self.weights[name]
+            if not weight or columns.get(name, "0") == "0":
+                continue
+            value = f"log10(1 + {columns[name]})" if name.endswith("_count") else columns[name]
+            terms.append(f"{weight!r} * ({value})")
+        for name in CATEGORIES:
+            table = self.tables[name]
+            if not table or columns.get(name, "NULL") == "NULL":
+                continue
+            terms.append(f"CASE {columns[name]} " + " ".join("WHEN ? THEN ?" for _ in table) + " ELSE 0 END")
+            for item in table.items():
+                params += item
+        return " + ".join(terms) or "0", params
+
+    def classification(self, score):
+        return (f"CASE WHEN {score} >= {self.attack!r} THEN 'attack' "
+                f"WHEN {score} >= {self.suspicious!r} THEN 'suspicious' ELSE 'normal' END")
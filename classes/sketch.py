@@ -0,0 +1,80 @@
+import heapq
+from collections import Counter
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter counter holding at most `capacity` keys.
+
+    Used like a Counter (`counter[ip] += 1`). Once full, an untracked key takes over the
+    slot of the smallest counter and inherits its count as overestimation error, so every
+    estimate lies within [count - error, count], and any key that was dropped occurred at
+    most min_count() <= total / capacity times. The smallest counter is found through a
+    min-heap whose stale entries are refreshed lazily when they reach the top.
+    """
+
+    def __init__(self, config):
+        self.capacity = max(1, config.get("capacity", 10000))
+        self.top_k = config.get("top_k", 1000)
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.total = 0
+
+    def __getitem__(self, key):
+        return self.counts.get(key, 0)
+
+    def __setitem__(self, key, value):
+        increment = value - self.counts.get(key, 0)
+        self.total += increment
+        if key in self.counts:
+            self.counts[key] = value
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            error = self._evict()
+        self.counts[key] = error + increment
+        self.errors[key] = error
+        heapq.heappush(self.heap, (error + increment, key))
+
+    def __contains__(self, key):
+        return key in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _evict(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts[key] == count:
+                del self.counts[key]
+                del self.errors[key]
+                return count
+            heapq.heappush(self.heap, (self.counts[key], key))
+
+    def min_count(self):
+        """Upper bound on the count of any key that is not tracked."""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def guaranteed(self, key):
+        """Occurrences of key that are certain, never an overestimate."""
+        return self.counts.get(key, 0) - self.errors.get(key, 0)
+
+    def top(self):
+        """{key: guaranteed count} for the top_k keys, skipping keys with no certain occurrence."""
+        ranked = heapq.nlargest(self.top_k, self.counts, key=self.guaranteed)
+        return {key: self.guaranteed(key) for key in ranked if self.guaranteed(key) > 0}
+
+def new_counter(config):
+    """A Counter, or a bounded SpaceSaving sketch when the "sketch" section is enabled."""
+    return SpaceSaving(config) if config.get("enabled") else Counter()
+
+def finish_counts(counter, details, logger, name):
+    """Final {ip: count} of a parse pass; a sketch only yields its top_k and drops other details."""
+    if not isinstance(counter, SpaceSaving):
+        return dict(counter), details
+    counts = counter.top()
+    if counter.min_count():
+        logger.info(
+            f"{name} sketch kept top {len(counts)} of {counter.total} event(s); "
+            f"untracked IPs have at most {counter.min_count()} event(s) each"
+        )
+    return counts, {ip: details[ip] for ip in counts if ip in details}
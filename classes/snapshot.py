@@ -0,0 +1,189 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from classes.logger import Logger
+
+MAGIC = b"PTSNAP"
+# Bumped whenever a section's layout changes; other versions are ignored and rebuilt
+VERSION = 1
+# Magic, version, CRC-32 and length of the compressed body
+HEADER = struct.Struct(">6sHIQ")
+LENGTH = struct.Struct(">I")
+
+def encode(sections):
+    """File bytes for {name: (meta, [bytes, ...])}: the header, then a compressed JSON index and the blobs."""
+    index, blobs, offset = {}, [], 0
+    for name, (meta, parts) in sections.items():
+        spans = []
+        for part in parts:
+            spans.append((offset, len(part)))
+            blobs.append(part)
+            offset += len(part)
+        index[name] = {"meta": meta, "blobs": spans}
+    head = json.dumps({"byteorder": sys.byteorder, "sections": index}).encode()
+    body = zlib.compress(LENGTH.pack(len(head)) + head + b"".join(blobs), 1)
+    return HEADER.pack(MAGIC, VERSION, zlib.crc32(body), len(body)) + body
+
+def decode(data):
+    """{name: (meta, [bytes, ...])} from encode()'s output; raises ValueError if it is not a valid snapshot."""
+    if len(data) < HEADER.size:
+        raise ValueError("truncated header")
+    magic, version, crc, length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a snapshot file")
+    if version != VERSION:
+        raise ValueError(f"version {version}, expected {VERSION}")
+    body = data[HEADER.size:]
+    if len(body) != length or zlib.crc32(body) != crc:
+        raise ValueError("checksum mismatch")
+    try:
+        payload = zlib.decompress(body)
+        size = LENGTH.unpack_from(payload)[0]
+        head = json.loads(payload[LENGTH.size:LENGTH.size + size])
+    except (zlib.error, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+    if head.get("byteorder") != sys.byteorder:
+        raise ValueError("written on a machine of another byte order")
+    start = LENGTH.size + size
+    return {
+        name: (section["meta"], [payload[start + offset:start + offset + length]
+                                 for offset, length in section["blobs"]])
+        for name, section in head["sections"].items()
+    }
+
+class Snapshots:
+    """Warm-restart state: in-memory structures saved to one binary file and restored at startup.
+
+    Components offer() a capture of their state after a cycle, when it is consistent with what
+    they have stored; it is taken at most once per interval, and once more by close(), which
+    runs after the workers have stopped. The captures are written to `path` every interval
+    seconds and on close(), to a temporary file that is fsynced and renamed over the old one,
+    together with the sections read at startup that nothing has captured again. At startup
+    each component asks restore() for its section; a missing, corrupt or other-version file is
+    logged and every component rebuilds as it would without one.
+    """
+
+    def __init__(self, config):
+        self.logger = Logger()
+        self.enabled = config.get("enabled", False)
+
+        if getattr(sys, 'frozen', False):
+            base_dir = os.path.dirname(sys.executable)
+        else:
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        self.path = config.get("path", os.path.join(base_dir, "db", "state.snap"))
+        self.interval = config.get("interval", 60)
+        self.lock = threading.Lock()
+        self.sections = {}  # name -> (meta, blobs) captured by this process
+        self.captures = {}  # name -> the latest capture offered
+        self.captured_at = {}
+        self.dirty = False
+        self.stop_event = threading.Event()
+        self.thread = None
+        # Sections read from the file and not captured again since
+        self.loaded = self._load() if self.enabled else {}
+        if self.enabled:
+            self.thread = threading.Thread(target=self._write_loop, name="snapshot", daemon=True)
+            self.thread.start()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        started = time.perf_counter()
+        try:
+            with open(self.path, "rb") as f:
+                sections = decode(f.read())
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.info(f"Snapshot {self.path} unusable, rebuilding state: {e}")
+            return {}
+        self.logger.info(f"Snapshot {self.path} read in {time.perf_counter() - started:.3f}s: "
+                         f"{len(sections)} section(s)", event="snapshot", sections=sorted(sections))
+        return sections
+
+    def restore(self, name, apply):
+        """Calls apply(meta, blobs) with the section saved under name; True if it was restored.
+
+        apply returns False (or raises) when the section no longer matches its component, which
+        then rebuilds."""
+        section = self.loaded.get(name)
+        if section is None:
+            return False
+        try:
+            restored = apply(*section) is not False
+        except Exception as e:
+            self.logger.info(f"Snapshot section {name} not restored: {e}")
+            restored = False
+        if restored:
+            self.logger.info(f"Restored {name} from snapshot", event="snapshot", section=name)
+        return restored
+
+    def offer(self, name, capture):
+        """Stores capture()'s (meta, blobs) under name unless that was done less than interval seconds ago."""
+        if not self.enabled:
+            return
+        self.captures[name] = capture
+        now = time.monotonic()
+        if now - self.captured_at.get(name, -self.interval) < self.interval:
+            return
+        self._capture(name, capture, now)
+
+    def _capture(self, name, capture, now):
+        try:
+            section = capture()
+        except Exception as e:
+            self.logger.error(f"Snapshot capture of {name} failed: {e}")
+            return
+        with self.lock:
+            self.sections[name] = section
+            self.captured_at[name] = now
+            self.loaded.pop(name, None)
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            # A component not running this time (or not yet offering) keeps its saved section
+            sections = dict(self.loaded, **self.sections)
+            self.dirty = False
+        temp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "wb") as f:
+                f.write(encode(sections))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.path)
+        except OSError as e:
+            self.logger.error(f"Snapshot write to {self.path} failed: {e}")
+            with self.lock:
+                self.dirty = True
+
+    def _write_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.save()
+
+    def close(self):
+        """Takes a last capture of everything offered and writes the file; call once the workers are stopped."""
+        self.stop_event.set()
+        if self.thread is None:
+            return
+        self.thread.join()
+        for name, capture in list(self.captures.items()):
+            self._capture(name, capture, time.monotonic())
+        self.save()
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def get_snapshots(config=None):
+    """Returns the process-wide Snapshots, creating it from config on first use (disabled without one)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Snapshots(config or {})
+        return _shared
@@ -1,7 +1,7 @@
 import os
-import re
 import sqlite3
 from collections import Counter
+from classes.lineparser import count_snort, text_blocks
 
 class Snort:
     def __init__(self, config):
@@ -37,22 +37,8 @@ class Snort:
             return {}, {}
 
         with open(self.log_path, "r") as file:
-            for line in file:
-                class_match = re.search(r"\[Classification: (.*?)\]", line)
-                proto_match = re.search(r"\{(\w+)\}", line)
-                src_match = re.search(r"\{.*?\}\s+(\d{1,3}(?:\.\d{1,3}){3}):\d+\s+->", line)
-
-                if class_match and proto_match and src_match:
-                    classification = class_match.group(1).strip()
-                    protocol = proto_match.group(1).strip()
-                    ip = src_match.group(1)
-
-                    ip_counter[ip] += 1
-                    if ip not in details:
-                        details[ip] = {
-                            "classification": classification,
-                            "protocol": protocol
-                        }
+            for text in text_blocks(file):
+                count_snort(text, ip_counter, details)
 
         return dict(ip_counter), details
 
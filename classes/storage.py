@@ -0,0 +1,215 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+class _Maintenance:
+    """A write that runs after the batch commits, outside any transaction."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+class Storage:
+    """Owns every SQLite write through one long-lived writer thread.
+
+    Writes are callables submitted through a queue; the writer runs them against
+    a WAL-mode connection per database file and commits them together once
+    batch_size of them are pending or max_delay seconds have passed (group
+    commit). Each write runs in its own savepoint, so a failing one is rolled
+    back without losing the rest of the batch. Jobs queued through maintain() run
+    after the batch commits, outside any transaction. Readers borrow pooled
+    read-only connections.
+    """
+
+    def __init__(self, config):
+        self.batch_size = config.get("batch_size", 256)
+        self.max_delay = config.get("max_delay", 0.05)
+        self.pool_size = config.get("read_pool_size", 4)
+        self.queue = queue.Queue()
+        self.writers = {}
+        self.attached = {}
+        self.attachments = {}
+        self.readers = {}
+        self.lock = threading.Lock()
+        self.last_write = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, db_path, fn):
+        """Queues fn(conn) to run on the writer thread; the Future resolves after commit."""
+        future = Future()
+        self.queue.put((db_path, fn, future))
+        return future
+
+    def run(self, db_path, fn):
+        return self.submit(db_path, fn).result()
+
+    def execute(self, db_path, sql, params=()):
+        return self.submit(db_path, lambda conn: conn.execute(sql, params).rowcount)
+
+    def executemany(self, db_path, sql, rows):
+        return self.submit(db_path, lambda conn: conn.executemany(sql, rows).rowcount)
+
+    def maintain(self, db_path, fn):
+        """Runs fn(conn) on the writer thread outside a transaction, as VACUUM and WAL checkpoints need."""
+        return self.submit(db_path, _Maintenance(fn)).result()
+
+    def idle_seconds(self):
+        """Seconds since the last committed write, or 0 while writes are queued."""
+        if not self.queue.empty():
+            return 0.0
+        return time.monotonic() - self.last_write
+
+    def attach(self, db_path, alias, other_path):
+        """Makes other_path available as alias.* on db_path's writer connection."""
+        with self.lock:
+            self.attachments.setdefault(db_path, {})[alias] = other_path
+
+    def flush(self):
+        self.run(None, None)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        with self.lock:
+            for pool in self.readers.values():
+                for conn in pool:
+                    conn.close()
+            self.readers = {}
+
+    @contextmanager
+    def read(self, db_path):
+        """Yields a read-only connection from the pool for db_path."""
+        with self.lock:
+            pool = self.readers.setdefault(db_path, [])
+            conn = pool.pop() if pool else None
+        if conn is None:
+            # Make sure the file exists (and is in WAL mode) before opening it read-only
+            self.run(db_path, lambda conn: None)
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            with self.lock:
+                pool = self.readers.setdefault(db_path, [])
+                if len(pool) < self.pool_size:
+                    pool.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def _writer(self, db_path):
+        conn = self.writers.get(db_path)
+        if conn is None:
+            conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+            # Takes effect for new files; Retention converts existing ones with a VACUUM when idle
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self.writers[db_path] = conn
+            self.attached[db_path] = {}
+        # ATTACH is not allowed inside a transaction, so it happens here before BEGIN
+        with self.lock:
+            wanted = dict(self.attachments.get(db_path, {}))
+        attached = self.attached[db_path]
+        for alias, other_path in wanted.items():
+            if attached.get(alias) != other_path:
+                if alias in attached:
+                    conn.execute(f"DETACH DATABASE {alias}")
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (other_path,))
+                attached[alias] = other_path
+        return conn
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            if item is None:
+                break
+        return batch
+
+    def _run(self):
+        running = True
+        while running:
+            batch = self._collect(self.queue.get())
+            if batch[-1] is None:
+                batch.pop()
+                running = False
+
+            by_db = {}
+            for db_path, fn, future in batch:
+                by_db.setdefault(db_path, []).append((fn, future))
+
+            for db_path, items in by_db.items():
+                self._commit(db_path, items)
+
+        for conn in self.writers.values():
+            conn.close()
+        self.writers = {}
+        self.attached = {}
+
+    def _commit(self, db_path, items):
+        if db_path is None:
+            for _, future in items:
+                future.set_result(None)
+            return
+
+        maintenance = [(fn, future) for fn, future in items if isinstance(fn, _Maintenance)]
+        items = [(fn, future) for fn, future in items if not isinstance(fn, _Maintenance)]
+        if items:
+            self._transaction(db_path, items)
+        for job, future in maintenance:
+            try:
+                future.set_result(job.fn(self._writer(db_path)))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _transaction(self, db_path, items):
+        results = []
+        try:
+            conn = self._writer(db_path)
+            conn.execute("BEGIN")
+            for fn, future in items:
+                conn.execute("SAVEPOINT item")
+                try:
+                    results.append((future, fn(conn), None))
+                    conn.execute("RELEASE item")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO item")
+                    conn.execute("RELEASE item")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+            self.last_write = time.monotonic()
+        except Exception as e:
+            if db_path in self.writers and self.writers[db_path].in_transaction:
+                self.writers[db_path].execute("ROLLBACK")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def get_storage(config=None):
+    """Returns the process-wide Storage, creating it from config on first use or after close()."""
+    global _shared
+    with _shared_lock:
+        if _shared is None or not _shared.thread.is_alive():
+            _shared = Storage(config or {})
+        return _shared
@@ -0,0 +1,236 @@
+import bz2
+import gzip
+import hashlib
+import lzma
+import mmap
+import os
+from classes.dbutil import ensure_column
+from classes.storage import get_storage
+
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+def open_log(path):
+    """Opens a plain or compressed (gz, bz2, xz) log for binary streaming reads."""
+    return OPENERS.get(os.path.splitext(path)[1], open)(path, "rb")
+
+# Bytes of a log's start that identify it
+FINGERPRINT_BYTES = 4096
+
+def fingerprint(path):
+    """Identifies a log by its first line, which survives renames and compression.
+
+    A first line longer than FINGERPRINT_BYTES is identified by its first FINGERPRINT_BYTES.
+    None while the file is too short to tell: no complete line and fewer bytes than that.
+    """
+    try:
+        with open_log(path) as file:
+            first = file.readline(FINGERPRINT_BYTES)
+    except (OSError, EOFError):
+        return None
+    if not first.endswith(b"\n") and len(first) < FINGERPRINT_BYTES:
+        return None
+    return hashlib.sha1(first).hexdigest()
+
+class Tailer:
+    """Incrementally reads a log file, resuming from a checkpoint stored in SQLite.
+
+    The checkpoint is (inode, offset, partial, first line fingerprint) per source. When
+    the inode changes the rotated file is located by inode and its tail is finished
+    before the new file is read from the start; a file shorter than the saved offset, or
+    whose first line has changed (copytruncate, then regrown past the offset), is treated
+    as truncated and re-read from byte 0.
+
+    Every file it reads is also recorded in replayed_files by fingerprint, so a later
+    replay of rotated history skips what live ingestion has already counted.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, source, log_path, db_path):
+        self.source = source
+        self.log_path = log_path
+        self.db_path = db_path
+        self.pending = None
+        self.fingerprints = {}  # inode -> (fingerprint, path) of files read since the last checkpoint
+        self.recorded = set()  # inodes whose fingerprint is already in replayed_files
+        self.lines_read = 0  # by the last read_lines() or claim_range() call, for metrics
+        self.bytes_read = 0
+        self.storage = get_storage()
+        self._init_db()
+
+    def _init_db(self):
+        self.storage.execute(self.db_path, """
+            CREATE TABLE IF NOT EXISTS read_offsets (
+                source TEXT PRIMARY KEY,
+                inode INTEGER,
+                offset INTEGER,
+                partial BLOB
+            )
+        """).result()
+        self.storage.run(self.db_path, lambda conn: ensure_column(conn, "read_offsets", "first_line", "TEXT"))
+        self.storage.execute(self.db_path, """
+            CREATE TABLE IF NOT EXISTS replayed_files (
+                source TEXT,
+                fingerprint TEXT,
+                path TEXT,
+                offset INTEGER,
+                done INTEGER,
+                PRIMARY KEY (source, fingerprint)
+            )
+        """).result()
+
+    def load_checkpoint(self):
+        with self.storage.read(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT inode, offset, partial, first_line FROM read_offsets WHERE source = ?",
+                (self.source,)
+            ).fetchone()
+        if row is None:
+            return None, 0, b"", None
+        return row[0], row[1], row[2] or b"", row[3]
+
+    def save_checkpoint(self, conn):
+        """Writes the checkpoint reached by the last read_lines() call through conn,
+        so it commits in the same transaction as the data parsed from those lines."""
+        if self.pending is None:
+            return
+        inode, offset, partial, first = self.pending
+        conn.execute("""
+            INSERT INTO read_offsets (source, inode, offset, partial, first_line)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(source) DO UPDATE SET inode=excluded.inode, offset=excluded.offset, partial=excluded.partial,
+                first_line=excluded.first_line
+        """, (self.source, inode, offset, partial, first))
+        conn.executemany("""
+            INSERT INTO replayed_files (source, fingerprint, path, offset, done)
+            VALUES (?, ?, ?, NULL, 1)
+            ON CONFLICT(source, fingerprint) DO UPDATE SET done=1
+        """, [(self.source, value, path) for value, path in self.fingerprints.values()])
+        self.recorded.update(self.fingerprints)
+        self.fingerprints = {}
+        self.pending = None
+
+    def _remember(self, path, inode):
+        if inode not in self.recorded and inode not in self.fingerprints:
+            value = fingerprint(path)
+            if value is not None:
+                self.fingerprints[inode] = (value, path)
+
+    def _find_rotated(self, inode):
+        folder = os.path.dirname(self.log_path) or "."
+        prefix = os.path.basename(self.log_path) + "."
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            return None
+        for entry in entries:
+            if entry.name.startswith(prefix) and not entry.name.endswith(".gz"):
+                try:
+                    if entry.stat().st_ino == inode:
+                        return entry.path
+                except OSError:
+                    continue
+        return None
+
+    def _read_from(self, path, offset, partial, final, blocks):
+        with open(path, "rb") as file:
+            file.seek(offset)
+            while True:
+                chunk = file.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                self.bytes_read += len(chunk)
+                data = partial + chunk
+                end = data.rfind(b"\n") + 1
+                partial = data[end:]
+                # Decoding whole lines at once is cheaper than per line and cannot split a character
+                text = data[:end].decode("utf-8", "replace")
+                if blocks:
+                    self.lines_read += text.count("\n")
+                    yield text
+                    continue
+                lines = text.split("\n")
+                lines.pop()
+                self.lines_read += len(lines)
+                yield from lines
+        # A rotated file will not grow any further, so its unterminated last line is complete
+        if final and partial:
+            self.lines_read += 1
+            yield partial.decode("utf-8", "replace")
+            partial = b""
+        self._position = (offset, partial)
+
+    def read_lines(self):
+        """Yields the lines appended since the last saved checkpoint."""
+        return self._read(blocks=False)
+
+    def read_blocks(self):
+        """Yields the text appended since the last saved checkpoint as blocks of whole lines.
+
+        For parsers that search a whole block at once; otherwise the same as read_lines()."""
+        return self._read(blocks=True)
+
+    def _read(self, blocks):
+        self.pending = None
+        self.lines_read = self.bytes_read = 0
+        try:
+            stat = os.stat(self.log_path)
+        except OSError:
+            return
+
+        inode, offset, partial, first = self.load_checkpoint()
+        current = fingerprint(self.log_path)
+        if inode is not None and inode != stat.st_ino:
+            rotated = self._find_rotated(inode)
+            if rotated is not None:
+                self._remember(rotated, inode)
+                yield from self._read_from(rotated, offset, partial, True, blocks)
+            offset, partial = 0, b""
+        elif self._truncated(offset, first, stat, current):
+            offset, partial = 0, b""
+
+        self._remember(self.log_path, stat.st_ino)
+        yield from self._read_from(self.log_path, offset, partial, False, blocks)
+        offset, partial = self._position
+        self.pending = (stat.st_ino, offset, partial, current)
+
+    @staticmethod
+    def _truncated(offset, first, stat, current):
+        # A copytruncate rotation may have been followed by enough writes to pass the old
+        # offset before this poll; the first line then no longer matches the checkpoint's
+        return offset > stat.st_size or (first is not None and current != first)
+
+    def claim_range(self, min_bytes):
+        """(start, end) of the whole lines appended since the checkpoint, for reading them in place.
+
+        Only offered when they are at least min_bytes long and nothing else must be read first
+        (a rotated file or a carried-over partial line); the range is then marked pending exactly
+        as read_lines() would. Returns None otherwise.
+        """
+        self.pending = None
+        self.lines_read = self.bytes_read = 0
+        try:
+            stat = os.stat(self.log_path)
+        except OSError:
+            return None
+
+        inode, offset, partial, first = self.load_checkpoint()
+        if inode is not None and inode != stat.st_ino:
+            return None
+        current = fingerprint(self.log_path)
+        if self._truncated(offset, first, stat, current):
+            offset, partial = 0, b""
+        if partial or stat.st_size - offset < min_bytes:
+            return None
+
+        with open(self.log_path, "rb") as file:
+            with mmap.mmap(file.fileno(), stat.st_size, access=mmap.ACCESS_READ) as view:
+                end = view.rfind(b"\n", offset, stat.st_size) + 1
+        if end <= offset:
+            return None
+        self._remember(self.log_path, stat.st_ino)
+        # The unterminated tail stays in the file past end, where the next read starts
+        self.pending = (stat.st_ino, end, b"", current)
+        self.bytes_read = end - offset
+        return offset, end
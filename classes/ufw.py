@@ -1,13 +1,35 @@
 import os
-import re
-import sqlite3
 import sys
+import time
 from collections import Counter
+from classes.dbutil import backfill_last_updated, changed_ips, ensure_column, select_in
+from classes.lineparser import UFW_SOURCE, parse_ufw, text_blocks, ufw_line, ufw_source
+from classes.logger import Logger
+from classes.metrics import get_metrics
+from classes.parallel import ParallelScanner
+from classes.ratewindow import RateWindow, parse_timestamp
+from classes.sketch import finish_counts, new_counter
+from classes.snapshot import get_snapshots
+from classes.storage import get_storage
+from classes.tailer import Tailer
 
 class UFW:
     def __init__(self, config):
         self.log_path = config.get("log_path")
         self.threshold = config.get("threshold")
+        # With a rate configured, IPs are flagged by events per time window instead of a lifetime count
+        self.rate = RateWindow(config["rate"]) if config.get("rate", {}).get("enabled") else None
+        self.snapshots = get_snapshots()
+        if self.rate is not None:
+            self.snapshots.restore("rate:ufw", self.rate.restore)
+        self.flagged = set()
+        self.lines_matched = 0  # Of the last parse, for lines_matched_total
+        # Under floods of spoofed sources, a sketch bounds memory to its capacity and keeps the top_k
+        self.sketch = config.get("sketch", {})
+        self.logger = Logger()
+        self.metrics = get_metrics()
+        parallel = config.get("parallel", {})
+        self.parallel = ParallelScanner(parallel, self.logger) if parallel.get("enabled") else None
         
         if getattr(sys, 'frozen', False):
             base_dir = os.path.dirname(sys.executable)
@@ -15,66 +37,133 @@ class UFW:
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             
         db_root = os.path.join(base_dir, "db")
-        self.db_path = os.path.join(db_root, "ufw_data.db")
+        self.db_path = config.get("db_path", os.path.join(db_root, "ufw_data.db"))
+        self.storage = get_storage()
         self._ensure_folder(db_root)
         self._init_db()
+        self.tailer = Tailer("ufw", self.log_path, self.db_path)
 
     def _ensure_folder(self, folder):
         if not os.path.exists(folder):
             os.makedirs(folder)
 
     def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS ufw_alerts (
-                    ip TEXT PRIMARY KEY,
-                    count INTEGER,
-                    proto TEXT,
-                    spt TEXT,
-                    dpt TEXT,
-                    status TEXT
-                )
-            """)
+        self.storage.run(self.db_path, self._create_tables)
 
-    def parse_logs(self):
-        ip_counter = Counter()
+    def _create_tables(self, conn):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ufw_alerts (
+                ip TEXT PRIMARY KEY,
+                count INTEGER,
+                proto TEXT,
+                spt TEXT,
+                dpt TEXT,
+                status TEXT,
+                last_updated REAL,
+                dst TEXT,
+                iface TEXT,
+                len INTEGER,
+                ttl INTEGER,
+                first_seen REAL
+            )
+        """)
+        for column, declaration in (("last_updated", "REAL"), ("dst", "TEXT"), ("iface", "TEXT"),
+                                    ("len", "INTEGER"), ("ttl", "INTEGER"), ("first_seen", "REAL")):
+            ensure_column(conn, "ufw_alerts", column, declaration)
+        conn.execute("CREATE INDEX IF NOT EXISTS ufw_alerts_last_updated ON ufw_alerts (last_updated)")
+        backfill_last_updated(conn, "ufw_alerts")
+
+    def parse_logs(self, lines=None):
+        ip_counter = new_counter(self.sketch)
+        self.flagged = set()
+        self.lines_matched = 0
         details = {}
 
-        if not os.path.isfile(self.log_path):
-            return {}, {}
+        if lines is None:
+            if not os.path.isfile(self.log_path):
+                return {}, {}
 
-        with open(self.log_path, "r") as file:
-            for line in file:
-                src_match = re.search(r"SRC=(\d{1,3}(?:\.\d{1,3}){3})", line)
-                proto_match = re.search(r"PROTO=(\w+)", line)
-                spt_match = re.search(r"SPT=(\d+)", line)
-                dpt_match = re.search(r"DPT=(\d+)", line)
+            scanned = self._scan_parallel("ufw")
+            if scanned is not None:
+                self.lines_matched = scanned[2]
+                return dict(scanned[0]), scanned[1]
 
-                if src_match:
-                    ip = src_match.group(1)
+        if self.rate is None:
+            # Counting only needs SRC, found for a whole block at once; the full record is parsed
+            # from the first line of each IP
+            blocks = self.tailer.read_blocks() if lines is None else text_blocks(lines)
+            for text in blocks:
+                found = Counter(UFW_SOURCE.findall(text))
+                for ip, n in found.items():
+                    ip_counter[ip] += n
+                    if ip not in details:
+                        details[ip] = parse_ufw(ufw_line(text, ip))
+                self.lines_matched += sum(found.values())
+                # Only a sketch drops counters, so this never fires for a plain Counter
+                if len(details) > 2 * len(ip_counter):
+                    details = {key: value for key, value in details.items() if key in ip_counter}
+        else:
+            # Rate windows need every line's own timestamp, so these are read line by line
+            for line in lines if lines is not None else self.tailer.read_lines():
+                ip = ufw_source(line)
+                if ip is not None:
                     ip_counter[ip] += 1
+                    self.lines_matched += 1
+                    if self.rate.add(ip, parse_timestamp(line)):
+                        self.flagged.add(ip)
 
                     if ip not in details:
-                        details[ip] = {
-                            "proto": proto_match.group(1) if proto_match else "Unknown",
-                            "spt": spt_match.group(1) if spt_match else "Unknown",
-                            "dpt": dpt_match.group(1) if dpt_match else "Unknown"
-                        }
+                        details[ip] = parse_ufw(line)
+                        # Only a sketch drops counters, so this never fires for a plain Counter
+                        if len(details) > 2 * len(ip_counter):
+                            details = {key: value for key, value in details.items() if key in ip_counter}
+
+        return finish_counts(ip_counter, details, self.logger, "UFW")
+
+    def _scan_parallel(self, kind):
+        # Rate windows and sketches depend on seeing the lines in order, so they stay sequential
+        if self.parallel is None or self.rate is not None or self.sketch.get("enabled"):
+            return None
+        return self.parallel.scan(kind, self.tailer)
+
+    def _status(self, ip, count, threshold):
+        if ip in self.flagged or (threshold is not None and count > threshold):
+            return "attack"
+        return "normal"
+
+    def store_to_db(self, lines=None, checkpoint=None):
+        """Upserts the new counts and returns the IPs that are new or just crossed the threshold.
 
-        return dict(ip_counter), details
+        Replay passes historical lines and its own checkpoint in place of the tailer's."""
+        started = time.perf_counter()
+        ip_counts, details = self.parse_logs(lines)
+        parsed = time.perf_counter()
+        checkpoint = checkpoint or self.tailer
+        changed = self.storage.run(self.db_path, lambda conn: self._upsert(conn, ip_counts, details, checkpoint))
+        self.metrics.record_batch("ufw", checkpoint, self.lines_matched, parsed - started, time.perf_counter() - parsed)
+        if self.rate is not None:
+            # Taken once the checkpoint is stored, so a restored window never counts lines read again
+            self.snapshots.offer("rate:ufw", self.rate.state)
+        return changed
 
-    def store_to_db(self):
-        ip_counts, details = self.parse_logs()
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            for ip, count in ip_counts.items():
-                proto = details[ip]["proto"]
-                spt = details[ip]["spt"]
-                dpt = details[ip]["dpt"]
-                status = "attack" if count > self.threshold else "normal"
-                cursor.execute("""
-                    INSERT INTO ufw_alerts (ip, count, proto, spt, dpt, status)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    ON CONFLICT(ip) DO UPDATE SET count=excluded.count, proto=excluded.proto, spt=excluded.spt, dpt=excluded.dpt, status=excluded.status
-                """, (ip, count, proto, spt, dpt, status))
-            conn.commit()
\ No newline at end of file
+    def _upsert(self, conn, ip_counts, details, checkpoint):
+        # Stamped on the writer thread, so timestamps follow commit order for the Analyzer watermark
+        now = time.time()
+        threshold = None if self.rate is not None else self.threshold
+        cursor = conn.cursor()
+        previous = dict(select_in(cursor, "SELECT ip, count FROM ufw_alerts WHERE ip IN ({})", ip_counts))
+        cursor.executemany("""
+            INSERT INTO ufw_alerts (ip, count, proto, spt, dpt, dst, iface, len, ttl, status, last_updated, first_seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ip) DO UPDATE SET count=ufw_alerts.count + excluded.count,
+                status=CASE WHEN ufw_alerts.status = 'attack' OR excluded.status = 'attack'
+                    OR ufw_alerts.count + excluded.count > ? THEN 'attack' ELSE 'normal' END,
+                last_updated=excluded.last_updated
+        """, [
+            (ip, count, details[ip].proto or "Unknown", details[ip].spt or "Unknown", details[ip].dpt or "Unknown",
+             details[ip].dst, details[ip].iface, details[ip].length, details[ip].ttl,
+             self._status(ip, count, threshold), now, now, threshold)
+            for ip, count in ip_counts.items()
+        ])
+        checkpoint.save_checkpoint(conn)
+        return changed_ips(previous, ip_counts, threshold, self.flagged)
@@ -1,6 +1,7 @@
-import time
 import threading
 import json
+import multiprocessing
+import signal
 import sys
 import os
 from datetime import datetime, timedelta
@@ -10,10 +11,17 @@ from classes.ids_ips import IDS_IPS
 from classes.ufw import UFW
 from classes.analyzer import Analyzer
 from classes.defense import Defense
-from classes.logger import Logger
+from classes.logger import Logger, configure as configure_logging
+from classes.lookup import LookupService, ThreatIndex
+from classes.metrics import MetricsServer, get_metrics
+from classes.pipeline import Pipeline
+from classes.replay import Replay
+from classes.retention import Retention
+from classes.snapshot import get_snapshots
+from classes.storage import get_storage
+from classes.watcher import Watcher
 
 logger = Logger()
-last_analysis = datetime.min  # Track last Analyzer run
 
 # Determine execution path (works for both script and PyInstaller executable)
 if getattr(sys, 'frozen', False):
@@ -27,19 +35,199 @@ config_path = os.path.join(application_path, "config.json")
 DEFAULT_CONFIG = {
     "auth": {
         "log_path": "/var/log/auth.log",
-        "threshold": 5
+        "threshold": 5,
+        "events": {
+            "failed_password": 1,
+            "invalid_user": 1,
+            "preauth_closed": 1,
+            "max_attempts": 1,
+            "pam_failure": 0,
+            "accepted": 0
+        },
+        "max_users": 100,
+        "rate": {
+            "enabled": False,
+            "events": 10,
+            "seconds": 60,
+            "idle_timeout": 3600,
+            "max_ips": 100000
+        },
+        "sketch": {
+            "enabled": False,
+            "capacity": 10000,
+            "top_k": 1000
+        },
+        "parallel": {
+            "enabled": False,
+            "workers": 0,
+            "min_bytes": 67108864
+        }
     },
     "ids_ips": {
         "log_path": "/var/log/snort/snort.alert.fast",
         "type": "snort",
-        "threshold": 5
+        "threshold": 5,
+        "rate": {
+            "enabled": False,
+            "events": 10,
+            "seconds": 60,
+            "idle_timeout": 3600,
+            "max_ips": 100000
+        },
+        "sketch": {
+            "enabled": False,
+            "capacity": 10000,
+            "top_k": 1000
+        },
+        "parallel": {
+            "enabled": False,
+            "workers": 0,
+            "min_bytes": 67108864
+        }
     },
     "ufw": {
         "log_path": "/var/log/ufw.log",
-        "threshold": 5
+        "threshold": 5,
+        "rate": {
+            "enabled": False,
+            "events": 10,
+            "seconds": 60,
+            "idle_timeout": 3600,
+            "max_ips": 100000
+        },
+        "sketch": {
+            "enabled": False,
+            "capacity": 10000,
+            "top_k": 1000
+        },
+        "parallel": {
+            "enabled": False,
+            "workers": 0,
+            "min_bytes": 67108864
+        }
     },
-    "analyzer": {},
-    "defense": {}
+    "analyzer": {
+        "scoring": {
+            "weights": {
+                "auth": 1.0,
+                "ids_ips": 1.0,
+                "ufw": 1.0,
+                "auth_attack": 0.5,
+                "ids_ips_attack": 0.5,
+                "ufw_attack": 0.5,
+                "auth_count": 0.25,
+                "ids_ips_count": 0.25,
+                "ufw_count": 0.25,
+                "ports_seen_across_sources": 0.25
+            },
+            "classifications": {},
+            "protocols": {},
+            "severities": {
+                "1": 1.0,
+                "2": 0.5
+            },
+            "thresholds": {
+                "attack": 2.0,
+                "suspicious": 0.0
+            }
+        }
+    },
+    "defense": {
+        "backend": "auto",
+        "blocklist_index": {
+            "enabled": True
+        },
+        "ttl": {
+            "enabled": False,
+            "durations": [3600, 86400, None],
+            "forget_after": 2592000,
+            "max_active": 0,
+            "retry": 60
+        },
+        "aggregate": {
+            "enabled": False,
+            "min_hosts": 8,
+            "min_density": 0.0,
+            "min_prefix_len": 24,
+            "min_prefix_len6": 64
+        }
+    },
+    "retention": {
+        "enabled": False,
+        "raw_ttl": 2592000,
+        "ttl": {
+            "threat_summary": 7776000
+        },
+        "hourly_ttl": 604800,
+        "rollup_ttl": 31536000,
+        "batch_rows": 10000,
+        "quiet_seconds": 60,
+        "vacuum_pages": 10000,
+        "analysis_limit": 1000
+    },
+    "pipeline": {
+        "intervals": {
+            "auth": 900,
+            "ids_ips": 900,
+            "ufw": 900,
+            "analysis": 3600,
+            "expiry": 60,
+            "retention": 3600
+        },
+        "policy": "coalesce",
+        "policies": {},
+        "jitter": 30,
+        "max_concurrent": 2
+    },
+    "stream": {
+        "poll_interval": 0.5
+    },
+    "replay": {
+        "batch_bytes": 16777216
+    },
+    "storage": {
+        "single_file": False,
+        "batch_size": 256,
+        "max_delay": 0.05
+    },
+    "logging": {
+        "format": "json",
+        "rotation": "size",
+        "max_bytes": 10485760,
+        "when": "midnight",
+        "backup_count": 5,
+        "queue_size": 10000,
+        "rate_limit": {
+            "enabled": True,
+            "burst": 10,
+            "window": 60,
+            "level": "WARNING"
+        }
+    },
+    "metrics": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 9108,
+        "textfile": "",
+        "textfile_interval": 15,
+        "debug": False,
+        "profile_sample": 0.0,
+        "tracemalloc_frames": 0
+    },
+    "snapshot": {
+        "enabled": False,
+        "path": "db/state.snap",
+        "interval": 60
+    },
+    "lookup": {
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 9109,
+        "socket": "",
+        "cache_size": 65536,
+        "refresh_interval": 1.0,
+        "max_batch": 10000
+    }
 }
 
 # Load or create config.json
@@ -60,6 +248,27 @@ else:
         logger.error(f"Error loading config.json: {e}. Using defaults.")
         config = DEFAULT_CONFIG
 
+# Until now the defaults applied; switch to the configured format and rotation
+configure_logging(config.get("logging"), logger.log_folder, logger.log_file)
+
+def apply_single_file_db():
+    """Points every component at one database file when storage.single_file is set."""
+    if not config.get("storage", {}).get("single_file"):
+        return
+    db_path = os.path.join(application_path, "db", "perfect_trio.db")
+    for section in ("auth", "ids_ips", "ufw"):
+        config[section]["db_path"] = db_path
+    config["analyzer"].update(auth_db=db_path, ids_ips_db=db_path, ufw_db=db_path, db_path=db_path)
+    config["defense"].update(analysis_db=db_path, db_path=db_path)
+    config.setdefault("retention", {}).update(auth_db=db_path, ids_ips_db=db_path, ufw_db=db_path,
+                                              threats_db=db_path, defense_db=db_path)
+    config.setdefault("lookup", {}).update(threats_db=db_path, defense_db=db_path)
+
+apply_single_file_db()
+
+# One writer thread owns every database connection
+storage = get_storage(config.get("storage", {}))
+
 def resolve_and_ensure_path(path_key, section_config, create_dir=False):
     """Resolves path to absolute relative to app and optionally creates directory."""
     if path_key in section_config:
@@ -70,35 +279,10 @@ def resolve_and_ensure_path(path_key, section_config, create_dir=False):
         if create_dir:
             os.makedirs(path, exist_ok=True)
 
-def run_auth():
-    logger.thread_event("Auth", "started")
-    try:
-        auth = Auth(config["auth"])
-        auth.store_to_db()
-        logger.info("Auth DB update completed")
-    except Exception as e:
-        logger.error(f"Auth error: {e}")
-    logger.thread_event("Auth", "stopped")
-
-def run_ids_ips():
-    logger.thread_event("IDS/IPS", "started")
-    try:
-        ids_ips = IDS_IPS(config["ids_ips"])
-        ids_ips.store_to_db()
-        logger.info("IDS/IPS DB update completed")
-    except Exception as e:
-        logger.error(f"IDS/IPS error: {e}")
-    logger.thread_event("IDS/IPS", "stopped")
-
-def run_ufw():
-    logger.thread_event("UFW", "started")
-    try:
-        ufw = UFW(config["ufw"])
-        ufw.store_to_db()
-        logger.info("UFW DB update completed")
-    except Exception as e:
-        logger.error(f"UFW error: {e}")
-    logger.thread_event("UFW", "stopped")
+# Warm-restart state, restored by each component as it starts
+if config.get("snapshot", {}).get("enabled"):
+    resolve_and_ensure_path("path", config["snapshot"])
+snapshots = get_snapshots(config.get("snapshot", {}))
 
 def run_analysis():
     logger.thread_event("Analyzer", "started")
@@ -120,26 +304,234 @@ def run_defense():
         logger.error(f"Defense error: {e}")
     logger.thread_event("Defense", "stopped")
 
+def run_retention():
+    logger.thread_event("Retention", "started")
+    try:
+        Retention(config.get("retention", {})).run()
+    except Exception as e:
+        logger.error(f"Retention error: {e}")
+    logger.thread_event("Retention", "stopped")
+
 def run_analysis_cycle():
     """Runs analysis and defense sequentially to ensure data consistency."""
     run_analysis()
     run_defense()
 
-if __name__ == "__main__":
+def build_pipeline():
+    """Persistent workers for the periodic mode: one per log source plus the analysis cycle."""
+    settings = config.get("pipeline", {})
+    intervals = settings.get("intervals", {})
+    policies = settings.get("policies", {})
+    policy = settings.get("policy", "coalesce")
+    jitter = settings.get("jitter", 0)
+    pipeline = Pipeline(logger, settings.get("max_concurrent"))
+    for name, cls, section in (("Auth", Auth, "auth"), ("IDS/IPS", IDS_IPS, "ids_ips"), ("UFW", UFW, "ufw")):
+        pipeline.add(name, lambda cls=cls, section=section: cls(config[section]),
+                     lambda source: source.store_to_db(), intervals.get(section, 900),
+                     policies.get(section, policy), jitter)
+    shared = {}
+    shared_lock = threading.Lock()
+
+    def defense():
+        # The expiry stage lifts blocks from the same scheduler the analysis stage fills
+        with shared_lock:
+            if "defense" not in shared:
+                shared["defense"] = Defense(config["defense"])
+            return shared["defense"]
+
+    # Defense must see the Analyzer's results, so both share one worker and run in order
+    pipeline.add("Analyzer", lambda: (Analyzer(config["analyzer"]), defense()),
+                 lambda stages: (stages[0].analyze(), stages[1].defend()), intervals.get("analysis", 3600),
+                 policies.get("analysis", policy), jitter)
+    if config["defense"].get("ttl", {}).get("enabled"):
+        pipeline.add("Expiry", defense, lambda defense: defense.expire(), intervals.get("expiry", 60),
+                     policies.get("expiry", policy), jitter)
+    if config.get("retention", {}).get("enabled"):
+        pipeline.add("Retention", lambda: Retention(config["retention"]), lambda retention: retention.run(),
+                     intervals.get("retention", 3600), policies.get("retention", policy), jitter)
+    return pipeline
+
+def run_hourly(analyzer, defense, cycle_lock):
+    """The stream mode's hourly sweep: a full analysis cycle on the stream's own Analyzer and
+    Defense, then retention when it is enabled."""
+    logger.thread_event("Hourly sweep", "started")
+    try:
+        with cycle_lock:
+            analyzer.analyze()
+            defense.defend()
+    except Exception as e:
+        logger.error(f"Hourly sweep error: {e}")
+    if config.get("retention", {}).get("enabled"):
+        run_retention()
+    logger.thread_event("Hourly sweep", "stopped")
+
+def run_stream():
+    """Follows the logs as they are written and reacts to new attackers within a second."""
+    sources = {}
+    for name, cls, section in (("Auth", Auth, "auth"), ("IDS/IPS", IDS_IPS, "ids_ips"), ("UFW", UFW, "ufw")):
+        try:
+            source = cls(config[section])
+            sources[os.path.abspath(source.log_path)] = (name, source)
+        except Exception as e:
+            logger.error(f"{name} error: {e}")
+    analyzer = Analyzer(config["analyzer"])
+    defense = Defense(config["defense"])
+    watcher = Watcher(sources, config.get("stream", {}).get("poll_interval", 0.5))
+    logger.thread_event(f"Stream ({watcher.mode})", "started")
+
+    # systemd stops the service with SIGTERM; unwind like Ctrl+C so the cleanup below and in
+    # __main__ (snapshot, storage, metrics and lookup shutdown) still runs
+    def interrupt(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, interrupt)
+
+    # One analysis cycle at a time, whether from this loop or the hourly sweep, so the sweep
+    # shares this Defense's backend and expiry heap instead of racing a second Defense
+    cycle_lock = threading.Lock()
+    sweep = None
+    last_analysis = datetime.now()
+    pending_ips = set()
+    changed_paths = set(sources)  # Catch up on anything written while we were down
     try:
         while True:
-            now = datetime.now()
+            for path in changed_paths:
+                name, source = sources[path]
+                try:
+                    pending_ips.update(source.store_to_db())
+                except Exception as e:
+                    logger.error(f"{name} error: {e}")
 
-            # Launch core systems
-            threading.Thread(target=run_auth).start()
-            threading.Thread(target=run_ids_ips).start()
-            threading.Thread(target=run_ufw).start()
+            # While a sweep holds the cycle, parsing goes on and the changed IPs wait for the next pass
+            if cycle_lock.acquire(blocking=False):
+                try:
+                    # Only the IPs that are new or crossed a threshold need re-scoring
+                    if pending_ips:
+                        analyzer.analyze(pending_ips)
+                        defense.defend(pending_ips)
+                        pending_ips = set()
+                    else:
+                        # Only a heap peek unless a temporary block is due
+                        defense.expire()
+                finally:
+                    cycle_lock.release()
 
-            # Launch Analyzer every 1 hour
+            # The hourly full sweep still runs as a safety net, never two at once
+            now = datetime.now()
             if now - last_analysis >= timedelta(hours=1):
-                threading.Thread(target=run_analysis_cycle).start()
+                if sweep is not None and sweep.is_alive():
+                    logger.info("Hourly sweep still running, skipping this one")
+                else:
+                    sweep = threading.Thread(target=run_hourly, args=(analyzer, defense, cycle_lock),
+                                             name="hourly-sweep", daemon=True)
+                    sweep.start()
                 last_analysis = now
 
-            time.sleep(900)  # Sleep for 15 minutes
+            changed_paths = watcher.wait(1.0)
+    finally:
+        watcher.close()
+        # Storage closes after this returns, so a running sweep finishes its writes first
+        if sweep is not None and sweep.is_alive():
+            logger.info("Waiting for the hourly sweep to finish")
+            sweep.join()
+        logger.thread_event("Stream", "stopped")
+
+def run_replay():
+    """Backfills the rotated history of every source, then scores it once."""
+    sources = {}
+    for name, cls, section in (("Auth", Auth, "auth"), ("IDS/IPS", IDS_IPS, "ids_ips"), ("UFW", UFW, "ufw")):
+        try:
+            sources[name] = cls(config[section])
+        except Exception as e:
+            logger.error(f"{name} error: {e}")
+    logger.thread_event("Replay", "started")
+    totals = Replay(config.get("replay", {})).run(sources)
+    for name, total in totals.items():
+        rate = total["lines"] / total["seconds"] if total["seconds"] else 0
+        summary = (f"Replay {name}: {total['files']} file(s), {total['lines']} line(s), "
+                   f"{total['bytes'] / 2 ** 20:.1f} MB in {total['seconds']:.1f}s ({rate:.0f} lines/s)")
+        logger.info(summary)
+        print(summary)
+    run_analysis_cycle()
+    logger.thread_event("Replay", "stopped")
+
+def start_metrics():
+    """Serves /metrics and the profiling switches when metrics.enabled is set; returns the server or None."""
+    settings = config.get("metrics", {})
+    if not settings.get("enabled"):
+        return None
+    if settings.get("textfile"):
+        resolve_and_ensure_path("textfile", settings)
+    metrics = get_metrics()
+    server = MetricsServer(settings, metrics, logger)
+    server.start()
+    if settings.get("profile_sample"):
+        metrics.profiler.start(settings["profile_sample"])
+    if settings.get("tracemalloc_frames"):
+        metrics.profiler.start_tracemalloc(settings["tracemalloc_frames"])
+
+    def toggle_profiler(signum, frame):
+        # SIGUSR1 switches cycle profiling on, and off again with the report written next to the activity log
+        profiler = metrics.profiler
+        if not profiler.sample:
+            profiler.start(settings.get("profile_sample") or 1.0)
+            logger.info("Profiling started")
+            return
+        report_path = os.path.join(logger.log_folder, "profile.txt")
+        with open(report_path, "w") as f:
+            f.write(profiler.stop())
+        logger.info(f"Profiling stopped, report written to {report_path}")
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, toggle_profiler)
+    return server
+
+def start_lookup():
+    """Serves IP lookups from memory when lookup.enabled is set; returns the service or None."""
+    settings = config.get("lookup", {})
+    # The indexes read the databases the Analyzer and Defense write
+    settings.setdefault("threats_db", config["analyzer"].get("db_path", os.path.join(application_path, "db", "threats.db")))
+    settings.setdefault("defense_db", config["defense"].get("db_path", os.path.join(application_path, "db", "defense.db")))
+    if not settings.get("enabled"):
+        # A previous run's triggers would otherwise keep filling threat_changes with nothing to prune it
+        if os.path.exists(settings["threats_db"]):
+            try:
+                get_storage().run(settings["threats_db"], ThreatIndex.drop)
+            except Exception as e:
+                logger.error(f"Lookup cleanup error: {e}")
+        return None
+    if settings.get("socket"):
+        resolve_and_ensure_path("socket", settings)
+    service = LookupService(settings)
+    service.start()
+    return service
+
+if __name__ == "__main__":
+    # Parallel parsing starts worker processes, which a frozen build must be able to re-enter
+    multiprocessing.freeze_support()
+    pipeline = None
+    metrics_server = start_metrics()
+    lookup_service = start_lookup()
+    try:
+        if "--replay" in sys.argv[1:]:
+            run_replay()
+        elif "--db-report" in sys.argv[1:]:
+            print(json.dumps(Retention(config.get("retention", {})).report(), indent=2))
+        elif "--stream" in sys.argv[1:]:
+            run_stream()
+        else:
+            pipeline = build_pipeline()
+            signal.signal(signal.SIGTERM, lambda signum, frame: pipeline.stop_event.set())
+            pipeline.start()
+            pipeline.wait()
     except KeyboardInterrupt:
-        logger.info("Main thread interrupted. Shutting down.")
\ No newline at end of file
+        logger.info("Main thread interrupted. Shutting down.")
+    finally:
+        if pipeline is not None:
+            pipeline.stop()
+            logger.info(f"Pipeline timings: {pipeline.timings()}")
+        if lookup_service is not None:
+            lookup_service.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+        snapshots.close()
+        storage.close()
\ No newline at end of file
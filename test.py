@@ -6,6 +6,7 @@ from datetime import datetime
 import os
 import sqlite3
 import subprocess
+from classes.pipeline import Pipeline
 
 root = tk.Tk()
 root.title("Perfect Trio")
@@ -26,11 +27,15 @@ def update_running_time(system):
         running_labels[system].config(text=f"Running Time: {str(elapsed).split('.')[0]}")
         time.sleep(1)
 
-def start_thread(system, target):
+def run_system(system, target):
     start_times[system] = datetime.now()
     update_status(system, "Running")
-    threading.Thread(target=target).start()
     threading.Thread(target=update_running_time, args=(system,), daemon=True).start()
+    target()
+
+def start_thread(system):
+    # Runs on the system's worker, in a pool slot: a click during a run is folded into one follow-up run
+    pipeline.trigger(system)
 
 def stop_thread(system):
     if system in start_times:
@@ -53,6 +58,12 @@ systems = {
     "Analyzer": run_analyzer
 }
 
+# Systems run on demand until a timer is set; at most two run at a time
+pipeline = Pipeline(max_concurrent=2)
+for name, func in systems.items():
+    pipeline.add(name, lambda: None, lambda _, n=name, f=func: run_system(n, f), None, jitter=5)
+pipeline.start()
+
 # Layout
 for i, (name, func) in enumerate(systems.items()):
     frame = ttk.LabelFrame(root, text=name)
@@ -70,7 +81,7 @@ for i, (name, func) in enumerate(systems.items()):
     last.grid(row=2, column=0, padx=5)
     last_labels[name] = last
 
-    start_btn = ttk.Button(frame, text="Start", command=lambda n=name, f=func: start_thread(n, f))
+    start_btn = ttk.Button(frame, text="Start", command=lambda n=name: start_thread(n))
     start_btn.grid(row=0, column=1, padx=5)
 
     stop_btn = ttk.Button(frame, text="Stop", command=lambda n=name: stop_thread(n))
@@ -92,12 +103,14 @@ def refresh_all():
             del start_times[system]
 
 def trigger_analyze():
-    start_thread("Analyzer", run_analyzer)
+    start_thread("Analyzer")
 
 def set_custom_timer():
     interval = simpledialog.askinteger("Set Timer", "Enter interval in minutes:", minvalue=1, maxvalue=1440)
     if interval:
-        messagebox.showinfo("Timer Set", f"Custom timer set to {interval} minutes.\n(Implement scheduling logic separately)")
+        for system in systems:
+            pipeline.set_interval(system, interval * 60)
+        messagebox.showinfo("Timer Set", f"Every system now runs every {interval} minutes.\nA run still in progress is never started again on top of itself.")
 
 def open_logs():
     log_path = "logs/activity.log"
@@ -130,4 +143,5 @@ help_menu.add_command(label="About", command=show_about)
 menu_bar.add_cascade(label="Help", menu=help_menu)
 
 root.config(menu=menu_bar)
-root.mainloop()
\ No newline at end of file
+root.mainloop()
+pipeline.stop(timeout=1)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import sqlite3
+
+from classes.Auth import Auth
+from classes.lineparser import add_username
+from classes.parallel import merge_auth
+from classes.storage import get_storage
+
+def failed(user, ip="198.51.100.7"):
+    return f"Oct 18 10:00:00 host sshd[1]: Failed password for {user} from {ip} port 22 ssh2"
+
+def test_username_cap_keeps_the_same_names_in_any_order():
+    names = ["mallory", "admin", "root", "oracle", "admin", "test", "root"]
+    sequential = {}
+    for name in names:
+        add_username(sequential, name, 1, 3)
+    first, second = {}, {}
+    for name in names[4:]:
+        add_username(first, name, 1, 3)
+    for name in names[:4]:
+        add_username(second, name, 1, 3)
+    merged = merge_auth(({}, first), ({}, second), 3)[1]
+    assert merged == sequential == {"admin": 2, "mallory": 1, "oracle": 1}
+
+def test_username_cap_holds_across_batches(tmp_path):
+    db = str(tmp_path / "auth.db")
+    auth = Auth({"log_path": str(tmp_path / "auth.log"), "threshold": 5, "max_users": 2, "db_path": db})
+    auth.store_to_db([failed("root"), failed("admin")])
+    auth.store_to_db([failed("guest"), failed("root")])
+    get_storage().flush()
+    with sqlite3.connect(db) as conn:
+        rows = conn.execute("SELECT username, count FROM auth_users ORDER BY username").fetchall()
+    assert rows == [("admin", 1), ("root", 2)]
+    get_storage().close()
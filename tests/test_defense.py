@@ -0,0 +1,18 @@
+from classes.defense import Defense
+from classes.storage import get_storage
+
+def test_empty_durations_block_permanently(tmp_path):
+    db = str(tmp_path / "defense.db")
+    defense = Defense({"db_path": db, "analysis_db": db, "ttl": {"enabled": True, "durations": []}})
+    assert defense.plan_expiries(["198.51.100.1"], 1000.0) == {"198.51.100.1": (1, None)}
+    get_storage().close()
+
+def test_repeat_offences_escalate_to_the_last_duration(tmp_path):
+    db = str(tmp_path / "defense.db")
+    defense = Defense({"db_path": db, "analysis_db": db, "ttl": {"enabled": True, "durations": [60, 600]}})
+    defense.storage.execute(db, "INSERT INTO block_history (ip, offences, last_blocked) VALUES (?, ?, ?)",
+                            ("198.51.100.1", 4, 900.0)).result()
+    assert defense.plan_expiries(["198.51.100.1", "198.51.100.2"], 1000.0) == {
+        "198.51.100.1": (5, 1600.0), "198.51.100.2": (1, 1060.0),
+    }
+    get_storage().close()
@@ -0,0 +1,139 @@
+import json
+import stat
+import sys
+
+import pytest
+
+from classes.defense import Defense
+from classes.enforcer import IpsetBackend, NftBackend, UfwBackend, get_backend
+from classes.storage import get_storage
+
+# A stand-in for nft that keeps its two sets in a JSON file and, like nft, rejects the whole
+# transaction when it deletes an element that is not there
+FAKE_NFT = """#!{python}
+import json, os, sys
+state = {state!r}
+sets = {{"blocked4": set(), "blocked6": set()}}
+if os.path.exists(state):
+    sets = {{name: set(members) for name, members in json.load(open(state)).items()}}
+for line in sys.stdin.read().splitlines():
+    words = line.split()
+    if words[:2] == ["flush", "set"]:
+        sets[words[4]].clear()
+    elif words[1:2] == ["element"]:
+        members = line[line.index("{{") + 1:line.index("}}")].replace(",", " ").split()
+        if words[0] == "add":
+            sets[words[4]].update(members)
+        elif any(member not in sets[words[4]] for member in members):
+            sys.exit("Error: Could not process rule: No such file or directory")
+        else:
+            sets[words[4]].difference_update(members)
+json.dump({{name: sorted(members) for name, members in sets.items()}}, open(state, "w"))
+"""
+
+class ListLogger:
+    def __init__(self):
+        self.errors = []
+
+    def info(self, message, **fields):
+        pass
+
+    def error(self, message, **fields):
+        self.errors.append(message)
+
+def executable(path, text):
+    path.write_text(text)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+@pytest.fixture
+def nft(tmp_path):
+    state = tmp_path / "nft.json"
+    path = executable(tmp_path / "nft", FAKE_NFT.format(python=sys.executable, state=str(state)))
+    members = lambda: json.loads(state.read_text()) if state.exists() else {"blocked4": [], "blocked6": []}
+    return path, members
+
+def test_nft_load_replaces_members(nft):
+    path, members = nft
+    backend = NftBackend({"nft_path": path}, ListLogger())
+    backend.ensure()
+    backend.block(["192.0.2.9"])
+    loaded, failed = backend.load(["198.51.100.1", "203.0.113.0/24", "2001:db8::1"])
+    assert failed == set() and len(loaded) == 3
+    assert members() == {"blocked4": ["198.51.100.1", "203.0.113.0/24"], "blocked6": ["2001:db8::1"]}
+
+def test_nft_unblock_skips_missing_members(nft):
+    path, members = nft
+    logger = ListLogger()
+    backend = NftBackend({"nft_path": path}, logger)
+    backend.block(["198.51.100.1", "198.51.100.2"])
+    removed, failed = backend.unblock(["198.51.100.1", "198.51.100.3"])
+    assert removed == {"198.51.100.1", "198.51.100.3"} and failed == set()
+    assert members()["blocked4"] == ["198.51.100.2"]
+    assert logger.errors == []
+
+def test_nft_prefix_block_with_missing_replaced_member(nft):
+    path, members = nft
+    backend = NftBackend({"nft_path": path}, ListLogger())
+    backend.block(["198.51.100.1"])
+    blocked, failed = backend.block(["198.51.100.0/24"], {"198.51.100.0/24": {"198.51.100.1", "198.51.100.2"}})
+    assert blocked == {"198.51.100.0/24"} and failed == set()
+    assert members()["blocked4"] == ["198.51.100.0/24"]
+
+def test_ipset_load_flushes_then_adds(tmp_path):
+    script = tmp_path / "ipset.in"
+    path = executable(tmp_path / "ipset", f"#!/bin/sh\ncat >> {script}\n")
+    backend = IpsetBackend({"ipset_path": path}, ListLogger())
+    loaded, failed = backend.load(["198.51.100.1", "2001:db8::1"])
+    assert len(loaded) == 2 and failed == set()
+    assert script.read_text().splitlines() == [
+        "flush perfect_trio", "flush perfect_trio6", "add perfect_trio 198.51.100.1", "add perfect_trio6 2001:db8::1",
+    ]
+
+def test_ufw_load_leaves_persistent_rules_alone(tmp_path):
+    calls = tmp_path / "ufw.calls"
+    path = executable(tmp_path / "ufw", f"#!/bin/sh\necho \"$@\" >> {calls}\n")
+    loaded, failed = UfwBackend({"ufw_path": path}, ListLogger()).load(["198.51.100.1"])
+    assert loaded == {"198.51.100.1"} and failed == set()
+    assert not calls.exists()
+
+def test_unknown_backend_is_a_config_error():
+    with pytest.raises(ValueError, match="defense.backend"):
+        get_backend({"backend": "pf"}, ListLogger())
+
+def test_defense_reapplies_recorded_blocks(tmp_path, nft):
+    path, members = nft
+    db = str(tmp_path / "defense.db")
+    defense = Defense({"db_path": db, "analysis_db": db, "backend": "nft", "nft_path": path})
+    defense.record_blocked_ips([("198.51.100.1", "blocked"), ("198.51.100.2", "block_failed")])
+    get_storage().flush()
+
+    # A fresh process after a reboot: the kernel set is empty, defense.db is not
+    assert members()["blocked4"] == []
+    restarted = Defense({"db_path": db, "analysis_db": db, "backend": "nft", "nft_path": path})
+    assert restarted.backend.name == "nft"
+    assert members()["blocked4"] == ["198.51.100.1"]
+    get_storage().close()
+
+def test_nft_block_is_one_transaction_for_both_families(tmp_path, nft):
+    path, members = nft
+    calls = tmp_path / "nft.calls"
+    wrapper = executable(tmp_path / "nft-counted", f"#!/bin/sh\necho call >> {calls}\nexec {path}\n")
+    blocked, failed = NftBackend({"nft_path": wrapper}, ListLogger()).block(
+        ["198.51.100.1", "2001:db8::1", "203.0.113.0/24"])
+    assert blocked == {"198.51.100.1", "2001:db8::1", "203.0.113.0/24"} and failed == set()
+    assert members() == {"blocked4": ["198.51.100.1", "203.0.113.0/24"], "blocked6": ["2001:db8::1"]}
+    assert calls.read_text().splitlines() == ["call"]
+
+def test_ufw_adds_one_rule_per_address(tmp_path):
+    calls = tmp_path / "ufw.calls"
+    path = executable(tmp_path / "ufw", f"#!/bin/sh\necho \"$@\" >> {calls}\n")
+    blocked, failed = UfwBackend({"ufw_path": path}, ListLogger()).block(["198.51.100.1", "198.51.100.2"])
+    assert blocked == {"198.51.100.1", "198.51.100.2"} and failed == set()
+    assert calls.read_text().splitlines() == ["deny from 198.51.100.1", "deny from 198.51.100.2"]
+
+def test_auto_falls_back_to_ufw_without_nft_or_ipset(tmp_path):
+    ufw = executable(tmp_path / "ufw", "#!/bin/sh\n")
+    missing = str(tmp_path / "missing")
+    backend = get_backend({"nft_path": missing, "ipset_path": missing, "ufw_path": ufw}, ListLogger())
+    assert backend.name == "ufw"
@@ -0,0 +1,51 @@
+from collections import Counter
+
+from classes.ids_ips import IDS_IPS
+from classes.lineparser import count_snort, parse_snort, ufw_line
+from classes.storage import get_storage
+from classes.ufw import UFW
+
+SNORT = [
+    "10/18-10:00:00.000000  [**] [1:2001219:3] ET SCAN Potential SSH Scan [**] "
+    "[Classification: Attempted Information Leak] [Priority: 2] {TCP} 198.51.100.7:40000 -> 10.0.0.5:22",
+    "10/18-10:00:01.000000  [**] [1:1000001:1] Unclassified [**] [Priority: 3] {UDP} 198.51.100.8:53 -> 10.0.0.5:53",
+    "10/18-10:00:02.000000  [**] [1:2013028:3] ET POLICY curl User-Agent [**] "
+    "[Classification: Attempted Administrator Privilege Gain] [Priority: 1] {TCP} 198.51.100.7:40001 -> 10.0.0.5:443",
+    "10/18-10:00:03.000000  [**] [1:2013028:3] ET POLICY curl User-Agent [**] "
+    "[Classification:  Misc activity ] [Priority: 3] {ICMP} 203.0.113.9:0 -> 10.0.0.5:0",
+]
+
+def ufw(src, proto="TCP"):
+    return (f"Oct 18 10:00:00 host kernel: [UFW BLOCK] IN=eth0 OUT= SRC={src} DST=10.0.0.5 LEN=60 "
+            f"TOS=0x00 PREC=0x00 TTL=50 ID=1 PROTO={proto} SPT=40000 DPT=22 WINDOW=1024 RES=0x00 SYN URGP=0")
+
+def test_block_snort_count_matches_the_line_parser():
+    counts, details = Counter(), {}
+    assert count_snort("\n".join(SNORT), counts, details) == 3
+
+    expected, first = Counter(), {}
+    for alert in filter(None, map(parse_snort, SNORT)):
+        expected[alert.src] += 1
+        first.setdefault(alert.src, {"classification": alert.classification, "protocol": alert.proto})
+    assert counts == expected == {"198.51.100.7": 2, "203.0.113.9": 1}
+    assert details == first
+
+def test_ufw_line_matches_the_whole_address():
+    text = "\n".join([ufw("10.0.0.10", "UDP"), ufw("10.0.0.1")])
+    assert ufw_line(text, "10.0.0.1") == ufw("10.0.0.1")
+    assert ufw_line(text, "10.0.0.2") is None
+
+def test_block_parsers_count_every_line(tmp_path):
+    parser = UFW({"log_path": str(tmp_path / "ufw.log"), "threshold": 5, "db_path": str(tmp_path / "ufw.db")})
+    counts, details = parser.parse_logs([ufw("10.0.0.10", "UDP"), ufw("10.0.0.1"), "unrelated", ufw("10.0.0.1")])
+    assert counts == {"10.0.0.10": 1, "10.0.0.1": 2}
+    assert parser.lines_matched == 3
+    assert (details["10.0.0.1"].proto, details["10.0.0.10"].proto) == ("TCP", "UDP")
+
+    ids = IDS_IPS({"log_path": str(tmp_path / "alert"), "threshold": 5, "type": "snort",
+                   "db_path": str(tmp_path / "ids.db")})
+    counts, details = ids.parse_snort_alerts(SNORT)
+    assert counts == {"198.51.100.7": 2, "203.0.113.9": 1}
+    assert ids.lines_matched == 3
+    assert details["203.0.113.9"] == {"classification": "Misc activity", "protocol": "ICMP"}
+    get_storage().close()
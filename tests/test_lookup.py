@@ -0,0 +1,45 @@
+import sqlite3
+import threading
+
+from classes.lookup import LookupService, ThreatIndex
+from classes.storage import get_storage
+
+def service(tmp_path):
+    threats, defense = str(tmp_path / "threats.db"), str(tmp_path / "defense.db")
+    with sqlite3.connect(threats) as conn:
+        conn.execute("CREATE TABLE threat_summary (ip TEXT PRIMARY KEY, classification TEXT, score REAL)")
+        conn.execute("INSERT INTO threat_summary VALUES ('198.51.100.1', 'attack', 9)")
+    with sqlite3.connect(defense) as conn:
+        conn.execute("CREATE TABLE blocked_ips (ip TEXT PRIMARY KEY, status TEXT)")
+        conn.execute("CREATE TABLE blocked_prefixes (prefix TEXT PRIMARY KEY, status TEXT)")
+    lookup = LookupService({"threats_db": threats, "defense_db": defense})
+    lookup.refresh()
+    return lookup, threats
+
+def test_cache_hits_do_not_wait_for_the_index_lock(tmp_path):
+    lookup, _ = service(tmp_path)
+    assert lookup.lookup("198.51.100.1")["verdict"] == "attack"
+    answers = []
+    with lookup.lock:
+        reader = threading.Thread(target=lambda: answers.append(lookup.lookup("198.51.100.1")))
+        reader.start()
+        reader.join(5)
+    assert answers and answers[0]["verdict"] == "attack"
+    assert (lookup.cache.hits, lookup.cache.misses) == (1, 1)
+    get_storage().close()
+
+def test_refresh_drops_changed_addresses_from_the_cache(tmp_path):
+    lookup, threats = service(tmp_path)
+    assert lookup.lookup("198.51.100.1")["verdict"] == "attack"
+    get_storage().execute(threats, "UPDATE threat_summary SET classification = 'normal' WHERE ip = '198.51.100.1'").result()
+    lookup.refresh()
+    assert lookup.lookup("198.51.100.1")["verdict"] == "unknown"
+    get_storage().close()
+
+def test_drop_removes_triggers_and_change_table(tmp_path):
+    _, threats = service(tmp_path)
+    get_storage().run(threats, ThreatIndex.drop)
+    with sqlite3.connect(threats) as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+    assert "threat_changes" not in names and not any(name.startswith("threat_summary_") for name in names)
+    get_storage().close()
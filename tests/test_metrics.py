@@ -0,0 +1,30 @@
+from classes.Auth import Auth
+from classes.metrics import Metrics, MetricsServer, get_metrics
+from classes.storage import get_storage
+
+class ListLogger:
+    def info(self, message, **fields):
+        pass
+
+    def error(self, message, **fields):
+        pass
+
+def test_profiling_switches_need_debug_post_and_a_local_client():
+    server = MetricsServer({}, Metrics(), ListLogger())
+    assert server.handle("GET", "/metrics", {}, "192.0.2.1")[0] == 200
+    assert server.handle("POST", "/debug/profile/start", {}, "127.0.0.1")[0] == 404
+
+    server = MetricsServer({"debug": True}, Metrics(), ListLogger())
+    assert server.handle("POST", "/debug/profile/start", {}, "192.0.2.1")[0] == 403
+    assert server.handle("GET", "/debug/profile/start", {}, "127.0.0.1")[0] == 405
+    assert server.handle("POST", "/debug/profile/start", {"sample": ["1.0"]}, "::1") == (200, "profiling started\n")
+    assert server.handle("POST", "/debug/profile/stop", {}, "127.0.0.1")[0] == 200
+
+def test_lines_matched_counts_lines_not_weighted_events(tmp_path):
+    auth = Auth({"log_path": str(tmp_path / "auth.log"), "threshold": 5, "db_path": str(tmp_path / "auth.db"),
+                 "events": {"failed_password": 3}})
+    line = "Oct 18 10:00:00 host sshd[1]: Failed password for root from 198.51.100.7 port 22 ssh2"
+    before = get_metrics().values["lines_matched_total"].get((("source", "auth"),), 0)
+    auth.store_to_db([line, line, "Oct 18 10:00:01 host CRON[2]: session opened"])
+    assert get_metrics().values["lines_matched_total"][(("source", "auth"),)] - before == 2
+    get_storage().close()
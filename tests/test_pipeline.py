@@ -0,0 +1,30 @@
+import threading
+import time
+
+from classes.pipeline import Pipeline
+
+def test_manual_worker_runs_only_when_triggered_one_at_a_time():
+    release, runs, active = threading.Event(), [], []
+    def action(_):
+        active.append(1)
+        runs.append(len(active))
+        release.wait(5)
+        active.pop()
+    pipeline = Pipeline(max_concurrent=1)
+    pipeline.add("stage", lambda: None, action, None)
+    pipeline.start()
+    time.sleep(0.2)
+    assert runs == []
+
+    pipeline.trigger("stage")
+    time.sleep(0.2)
+    pipeline.trigger("stage")
+    pipeline.trigger("stage")
+    release.set()
+    deadline = time.monotonic() + 5
+    while len(runs) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    pipeline.stop(timeout=5)
+    # Three clicks: one run, and the two during it folded into one follow-up, never overlapping
+    assert runs == [1, 1]
@@ -0,0 +1,18 @@
+import pytest
+
+from classes.ratewindow import RateWindow
+
+def test_flood_within_one_second_stays_under_the_cap():
+    window = RateWindow({"events": 3, "seconds": 60, "max_ips": 100})
+    for i in range(1000):
+        window.add(f"198.51.{i >> 8}.{i & 255}", 1000.0)
+    assert len(window) == 100
+    assert "198.51.3.231" in window.rings
+
+def test_rate_is_flagged_once_the_ring_fills():
+    window = RateWindow({"events": 3, "seconds": 60})
+    assert [window.add("198.51.100.1", t) for t in (0.0, 10.0, 20.0, 100.0)] == [False, False, True, False]
+
+def test_events_below_one_is_a_config_error():
+    with pytest.raises(ValueError, match="rate.events"):
+        RateWindow({"events": 0})
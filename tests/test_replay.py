@@ -0,0 +1,23 @@
+from classes.Auth import Auth
+from classes.replay import Replay
+from classes.storage import get_storage
+from classes.tailer import fingerprint
+
+def failed(i):
+    return f"Oct 18 10:00:{i % 60:02d} host sshd[1]: Failed password for root from 198.51.100.{i % 5} port 22 ssh2\n"
+
+def test_identical_rotated_copies_are_replayed_once(tmp_path):
+    history = "".join(failed(i) for i in range(20))
+    for name in ("auth.log.1", "auth.log.2"):
+        (tmp_path / name).write_text(history)
+    auth = Auth({"log_path": str(tmp_path / "auth.log"), "threshold": 5, "db_path": str(tmp_path / "auth.db")})
+    totals = Replay({}).replay_source("auth", auth)
+    assert (totals["files"], totals["lines"]) == (1, 20)
+    get_storage().close()
+
+def test_long_first_line_is_fingerprinted_by_its_prefix(tmp_path):
+    path = tmp_path / "eve.json.1"
+    path.write_bytes(b"x" * 5000)
+    assert fingerprint(str(path)) is not None
+    path.write_bytes(b"x" * 100)
+    assert fingerprint(str(path)) is None
@@ -0,0 +1,47 @@
+import sqlite3
+
+from classes.Auth import Auth
+from classes.retention import DAY, HOUR, Retention
+from classes.storage import get_storage
+
+def retention(tmp_path):
+    paths = {key: str(tmp_path / f"{key}.db") for key in ("auth_db", "ids_ips_db", "ufw_db", "threats_db", "defense_db")}
+    with sqlite3.connect(paths["auth_db"]) as conn:
+        conn.execute("CREATE TABLE failed_logins (ip TEXT PRIMARY KEY, count INTEGER, status TEXT, last_updated REAL)")
+        conn.executemany("INSERT INTO failed_logins VALUES (?, ?, 'attack', ?)",
+                         [("198.51.100.1", 4, 10 * HOUR + 5), ("198.51.100.2", 7, 10 * HOUR + 50)])
+    return Retention(dict(paths, raw_ttl=HOUR, hourly_ttl=30 * DAY, rollup_ttl=0)), paths["auth_db"]
+
+def rollups(db):
+    get_storage().flush()
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT ip, kind, granularity, bucket, rows, events FROM activity_rollup ORDER BY ip").fetchall()
+
+def test_rollups_are_kept_per_ip(tmp_path):
+    cycle, db = retention(tmp_path)
+    assert cycle.prune(now=100 * HOUR) == {"failed_logins": 2}
+    assert rollups(db) == [("198.51.100.1", "attack", "hour", 10 * HOUR, 1, 4),
+                           ("198.51.100.2", "attack", "hour", 10 * HOUR, 1, 7)]
+    get_storage().close()
+
+def test_rollups_without_ip_are_migrated(tmp_path):
+    cycle, db = retention(tmp_path)
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE activity_rollup (source TEXT, kind TEXT, granularity TEXT, bucket INTEGER, "
+                     "rows INTEGER, events INTEGER, PRIMARY KEY (source, kind, granularity, bucket))")
+        conn.execute("INSERT INTO activity_rollup VALUES ('failed_logins', 'attack', 'hour', 0, 3, 9)")
+    cycle.prune(now=100 * HOUR)
+    assert rollups(db)[0] == ("", "attack", "hour", 0, 3, 9)
+    assert len(rollups(db)) == 3
+    get_storage().close()
+
+def test_rows_from_before_last_updated_are_backfilled(tmp_path):
+    db = str(tmp_path / "auth.db")
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE failed_logins (ip TEXT PRIMARY KEY, count INTEGER, status TEXT)")
+        conn.execute("INSERT INTO failed_logins VALUES ('198.51.100.1', 3, 'normal')")
+    Auth({"log_path": str(tmp_path / "auth.log"), "threshold": 5, "db_path": db})
+    get_storage().flush()
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM failed_logins WHERE last_updated IS NULL").fetchone()[0] == 0
+    get_storage().close()
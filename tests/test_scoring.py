@@ -0,0 +1,4 @@
+from classes.scoring import Scorer
+
+def test_ports_term_keeps_its_old_weight_name():
+    assert Scorer({"weights": {"ports": 0.7}}).weights["ports_seen_across_sources"] == 0.7
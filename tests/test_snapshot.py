@@ -0,0 +1,16 @@
+from classes.snapshot import Snapshots
+
+def test_sections_not_offered_again_are_kept(tmp_path):
+    path = str(tmp_path / "state.snap")
+    first = Snapshots({"enabled": True, "path": path, "interval": 3600})
+    first.offer("a", lambda: ({"n": 1}, [b"one"]))
+    first.offer("b", lambda: ({"n": 2}, [b"two"]))
+    first.close()
+
+    second = Snapshots({"enabled": True, "path": path, "interval": 3600})
+    second.offer("a", lambda: ({"n": 3}, [b"three"]))
+    second.close()
+
+    third = Snapshots({"enabled": True, "path": path, "interval": 3600})
+    assert third.loaded == {"a": ({"n": 3}, [b"three"]), "b": ({"n": 2}, [b"two"])}
+    third.close()
@@ -0,0 +1,46 @@
+from classes.storage import get_storage
+from classes.tailer import Tailer
+
+def commit(tailer):
+    get_storage().run(tailer.db_path, tailer.save_checkpoint)
+
+def test_claim_range_then_read_lines_keeps_tail_once(tmp_path):
+    log = tmp_path / "auth.log"
+    log.write_bytes(b"line1\nline2\nline3\npartialtail")
+    tailer = Tailer("test", str(log), str(tmp_path / "state.db"))
+
+    assert tailer.claim_range(1) == (0, len(b"line1\nline2\nline3\n"))
+    commit(tailer)
+
+    with open(log, "ab") as file:
+        file.write(b"-more\nline4\n")
+    assert list(tailer.read_lines()) == ["partialtail-more", "line4"]
+    commit(tailer)
+    assert list(tailer.read_lines()) == []
+    get_storage().close()
+
+def test_read_lines_carries_partial_line(tmp_path):
+    log = tmp_path / "auth.log"
+    log.write_bytes(b"line1\npart")
+    tailer = Tailer("test", str(log), str(tmp_path / "state.db"))
+
+    assert list(tailer.read_lines()) == ["line1"]
+    commit(tailer)
+    with open(log, "ab") as file:
+        file.write(b"ial\n")
+    assert list(tailer.read_lines()) == ["partial"]
+    get_storage().close()
+
+def test_copytruncate_regrown_past_offset_is_read_from_start(tmp_path):
+    log = tmp_path / "auth.log"
+    log.write_bytes(b"old1\nold2\n")
+    tailer = Tailer("test", str(log), str(tmp_path / "state.db"))
+    assert list(tailer.read_lines()) == ["old1", "old2"]
+    commit(tailer)
+
+    # Copied away and truncated in place, then written past the old offset before the next poll
+    log.write_bytes(b"new1\nnew2\nnew3\n")
+    assert list(tailer.read_lines()) == ["new1", "new2", "new3"]
+    commit(tailer)
+    assert list(tailer.read_lines()) == []
+    get_storage().close()